@@ -1,23 +1,202 @@
-from flask import Flask, request, jsonify
-import firebase_admin
-from firebase_admin import auth, credentials
+from flask import Flask, Response, request, jsonify, make_response, stream_with_context
 from flask_cors import CORS
-from firebase_admin import firestore
+from google.api_core.exceptions import NotFound
+from werkzeug.http import generate_etag
 
+import functools
+import itertools
+
+import auth_helper
+import batch_recommender
 import data_helper
+import exercise_index
+import log_helper
+import metrics
 import recommender
+import serialization
+import storage
 
-cred = credentials.Certificate("./admin_credentials.json")
-firebase_admin.initialize_app(cred)
-db = firestore.client()
+# firestore by default, STORAGE_BACKEND=memory runs the whole api locally without network.
+# counted, so /metrics can report the firestore calls, reads and writes of every route
+db = storage.CountingClient(storage.create_client())
 
 app = Flask(__name__)
 CORS(app)
 
+# request ids and access records; the json lines are configured when the server starts, see main
+log_helper.init_app(app)
+
+request_metrics = metrics.Metrics(db.counters)
+request_metrics.register_cache("user_reads", data_helper.cache_stats)
+request_metrics.register_cache("premade_collections", data_helper.premade_cache_stats)
+request_metrics.register_cache("premade_workouts", recommender.premade_workout_cache_stats)
+request_metrics.register_cache("tokens", auth_helper.token_cache.stats)
+request_metrics.register_cache("exercise_index", exercise_index.stats)
+request_metrics.init_app(app)
+
+# orjson / msgpack bodies, gzipped when large; registered last so the hooks above see the final body
+serialization.init_app(app)
+
+
+def page_args():
+    """reads the optional limit and cursor query parameters of list routes
+    ?limit=<1..MAX_PAGE_SIZE>&cursor=<next_cursor of the previous page>
+
+    Raises:
+        ValueError: if limit is not a valid page size
+
+    Returns:
+        dict: keyword arguments for the data_helper get_all_* functions (empty if not paginated)
+    """
+    return data_helper.parse_page_args(request.args.get("limit"), request.args.get("cursor"))
+
+
+def fields_arg():
+    """reads the optional fields query parameter of read routes
+    ?fields=<comma separated field names, dotted for nested fields> to get only those fields
+
+    Raises:
+        ValueError: if a field name is invalid
+
+    Returns:
+        Optional[tuple[str]]: fields for the data_helper read functions (None for whole documents)
+    """
+    return data_helper.parse_fields(request.args.get("fields"))
+
+
+def workout_arg():
+    """reads the current workout of recommendation routes, the body's exercises that have an eid
+
+    Returns:
+        list[dict]: exercises
+    """
+    return [c for c in request.get_json() if ("eid" in c and c["eid"])]
+
+
+# streamed output is flushed to the client in chunks of about this many characters
+STREAM_CHUNK_SIZE = 16 * 1024
+NDJSON_MIMETYPE = "application/x-ndjson"
+
+
+def stream_mode():
+    """checks if the client opted in to a streamed list response
+    ?stream=json (json array) or ?stream=ndjson / Accept: application/x-ndjson (one document per line)
+    pagination takes precedence, a request with ?limit= is never streamed
+
+    Returns:
+        Optional[str]: "json", "ndjson" or None when the response should not be streamed
+    """
+    if "limit" in request.args:
+        return None
+    mode = request.args.get("stream")
+    if mode in ("json", "ndjson"):
+        return mode
+    if request.accept_mimetypes.best == NDJSON_MIMETYPE:
+        return "ndjson"
+    return None
+
+
+def stream_response(items, mode: str, wrap_key: str = None):
+    """build a generator backed response that serializes documents as they are read from firestore
+
+    Args:
+        items (iterable of dict): documents, usually a data_helper iter_* generator
+        mode (str): "json" for a json array, "ndjson" for one json document per line
+        wrap_key (str, optional): in json mode, put the array under this key of an object. Defaults to None.
+
+    Returns:
+        http response: 200 streamed response
+    """
+    items = iter(items)
+    # read the first document before answering, so a failing read still gets an error status
+    first = next(items, None)
+    documents = itertools.chain([first], items) if first is not None else iter(())
+
+    if mode == "ndjson":
+        opening, closing, mimetype = "", "", NDJSON_MIMETYPE
+    elif wrap_key:
+        opening, closing, mimetype = f'{{"{wrap_key}":[', "]}", "application/json"
+    else:
+        opening, closing, mimetype = "[", "]", "application/json"
+
+    def generate():
+        chunk, size = [opening], len(opening)
+        for i, item in enumerate(documents):
+            encoded = app.json.dumps(item, separators=(",", ":"))
+            if mode == "ndjson":
+                encoded += "\n"
+            elif i:
+                encoded = "," + encoded
+            chunk.append(encoded)
+            size += len(encoded)
+            if size >= STREAM_CHUNK_SIZE:
+                yield "".join(chunk)
+                chunk, size = [], 0
+        chunk.append(closing)
+        yield "".join(chunk)
+
+    return Response(stream_with_context(generate()), status=200, mimetype=mimetype)
+
+
+def conditional_collection(collection: str):
+    """decorator for list routes of users/<uid>/<collection>: the response gets an ETag made of
+    the collection version, the response format and the request url, and a request whose If-None-Match holds it gets a
+    304 without reading the collection. the version is read first, so a write racing the read can
+    only make the ETag older than the body, never newer, and cached bodies are only reused for the
+    version they were read at (see data_helper.read_at_version)
+
+    Args:
+        collection (str): collection the route lists
+    """
+
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(uid, *args, **kwargs):
+            try:
+                version = data_helper.get_collection_version(uid, collection, db)
+            except Exception as e:
+                return jsonify({"error": str(e)}), 400
+            mimetype = serialization.response_mimetype(request.accept_mimetypes)
+            etag = generate_etag(f"{collection}|{version}|{mimetype}|{request.full_path}".encode())
+            # weak comparison, the tag of a gzipped list comes back weak
+            if request.if_none_match.contains_weak(etag):
+                response = Response(status=304)
+            else:
+                with data_helper.read_at_version(uid, collection, version):
+                    response = make_response(view(uid, *args, **kwargs))
+                if response.status_code != 200:
+                    return response
+            response.set_etag(etag)
+            # clients may keep the list but must revalidate it before use
+            response.cache_control.no_cache = True
+            response.cache_control.private = True
+            return response
+
+        return wrapper
+
+    return decorator
+
+
+def import_response(uid: str, collection: str, template_id: str = None):
+    """parse a bulk import body (json array, or ndjson when sent as application/x-ndjson) and
+    import its records
+
+    Returns:
+        http response: 200 imported and failed counts, {"index", "id"} or {"index", "error"} per
+            record; 400 if the body holds no records
+    """
+    try:
+        records = data_helper.parse_records(request.get_data(), request.mimetype == NDJSON_MIMETYPE)
+        results = data_helper.import_records(uid, collection, records, db, template_id)
+    except Exception as e:
+        return jsonify({"error": str(e)}), 400
+    failed = sum("error" in result for result in results)
+    return jsonify({"imported": len(results) - failed, "failed": failed, "results": results}), 200
+
 
 @app.route("/verify-token", methods=["POST"])
 def verify_token():
-    """Verifies request token
+    """Verifies request token (verified tokens are cached until they expire)
     /verify-tokens , POST with 'token' in request
 
     Returns:
@@ -25,7 +204,7 @@ def verify_token():
     """
     token = request.json.get("token")
     try:
-        decoded_token = auth.verify_id_token(token)
+        decoded_token = auth_helper.token_cache.verify(token)
         return jsonify({"uid": decoded_token["uid"]}), 200
     except Exception as e:
         return jsonify({"error": str(e)}), 401
@@ -78,7 +257,7 @@ def create_user_exercise(uid):
 @app.route("/users/<uid>/exercises/<exercise_id>", methods=["GET"])
 def read_user_exercise(uid, exercise_id):
     """route for getting a specific exercise
-    /users/<uid>/exercises/<exercise_id>; GET
+    /users/<uid>/exercises/<exercise_id>; GET; optional ?fields= to get only some fields
     Args:
         uid (str): user id
         exercise_id (str): exercise id
@@ -87,27 +266,42 @@ def read_user_exercise(uid, exercise_id):
         http resposne: either 200, exercise response; or 404 or 400
     """
     try:
+        fields = fields_arg()
         exercise = data_helper.get_user_exercise(uid, exercise_id, db)
         if exercise:
-            return jsonify(exercise), 200
+            return jsonify(data_helper.project(exercise, fields)), 200
         return jsonify({"error": "Exercise not found."}), 404
     except Exception as e:
         return jsonify({"error": str(e)}), 400
 
 
 @app.route("/users/<uid>/exercises", methods=["GET"])
+@conditional_collection("exercises")
 def read_all_user_exercises(uid):
     """reads all user exercises
-    /users/<uid>/exercises, GET
+    /users/<uid>/exercises, GET; optional ?limit=&cursor= to get one page, ?stream=json|ndjson to stream,
+    ?muscle=<one of recommender.muscles> to get only the exercises of a muscle, ?fields= to get only some fields.
+    ?q=<name prefix> searches the user's and the premade exercises instead, returning at most
+    ?limit= (default exercise_index.SEARCH_LIMIT) of them, the user's first
 
     Args:
         uid (str): user id
 
     Returns:
-        http response: 200, exercises; 400
+        http response: 200, exercises (or {items, next_cursor} when paginated) (with ETag); 304 if If-None-Match matches; 400
     """
     try:
-        exercises = data_helper.get_all_user_exercises(uid, db)
+        muscle = data_helper.parse_muscle(request.args.get("muscle"))
+        fields = fields_arg()
+        if "q" in request.args:
+            prefix, limit = exercise_index.parse_search(request.args["q"], request.args.get("limit"))
+            return jsonify(data_helper.search_user_exercises(uid, prefix, db, muscle, limit, fields)), 200
+        mode = stream_mode()
+        if mode:
+            return stream_response(
+                data_helper.iter_user_exercises(uid, db, muscle, fields), mode
+            )
+        exercises = data_helper.get_all_user_exercises(uid, db, muscle=muscle, fields=fields, **page_args())
         return jsonify(exercises), 200
     except Exception as e:
         return jsonify({"error": str(e)}), 400
@@ -166,16 +360,14 @@ def add_pain():
     body_part = request.json.get("body_part")
 
     # Validate pain_level
-    if not isinstance(pain_level, int) or pain_level < 1 or pain_level > 10:
-        return (
-            jsonify({"error": "Pain level must be an integer between 1 and 10."}),
-            400,
-        )
+    try:
+        data_helper.check_pain_level(pain_level)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
 
-    collection_name = f"users/{uid}/pain"
     doc_data = {"date": date, "pain_level": pain_level, "body_part": body_part}
     try:
-        doc_id = data_helper.create_document(collection_name, doc_data, db)
+        doc_id = data_helper.create_pain(uid, doc_data, db)
         return jsonify({"message": "Pain added successfully.", "hash_id": doc_id}), 200
     except Exception as e:
         return jsonify({"error": str(e)}), 401
@@ -184,21 +376,30 @@ def add_pain():
 @app.route("/get-all-pain", methods=["POST"])
 def get_all_pain():
     """get all pain notes
-    /get-all-pain; POST; expects UID
+    /get-all-pain; POST; expects UID; optional ?limit=&cursor= to get one page, ?stream=json|ndjson to stream,
+    ?fields= to get only some fields
 
     Returns:
-        http response: 200 painlist; 401
+        http response: 200 painlist (and next_cursor when paginated); 400 or 401
     """
     uid = request.json.get("uid")
-    collection_name = f"users/{uid}/pain"
     try:
-        pain_docs = db.collection(collection_name).stream()
-        pain_list = []
-        for doc in pain_docs:
-            pain_data = doc.to_dict()
-            pain_data["hash_id"] = doc.id  # Include the document ID for reference
-            pain_list.append(pain_data)
-        return jsonify({"pain": pain_list}), 200
+        pagination = page_args()
+        fields = fields_arg()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    try:
+        mode = stream_mode()
+        if mode:
+            return stream_response(
+                data_helper.iter_user_collection(uid, "pain", db, id_field="hash_id", fields=fields),
+                mode,
+                wrap_key="pain",
+            )
+        pain = data_helper.get_all_pain(uid, db, fields=fields, **pagination)
+        if pagination:
+            return jsonify({"pain": pain["items"], "next_cursor": pain["next_cursor"]}), 200
+        return jsonify({"pain": pain}), 200
     except Exception as e:
         return jsonify({"error": str(e)}), 401
 
@@ -218,20 +419,13 @@ def edit_pain():
     body_part = request.json.get("body_part")
 
     # Validate pain_level if provided
-    if pain_level is not None and (
-        not isinstance(pain_level, int) or pain_level < 1 or pain_level > 10
-    ):
-        return (
-            jsonify({"error": "Pain level must be an integer between 1 and 10."}),
-            400,
-        )
+    if pain_level is not None:
+        try:
+            data_helper.check_pain_level(pain_level)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
 
-    collection_name = f"users/{uid}/pain"
     try:
-        pain_doc_ref = db.collection(collection_name).document(hash_id)
-        if not pain_doc_ref.get().exists:
-            return jsonify({"error": "Document not found."}), 404
-
         updates = {}
         if date:
             updates["date"] = date
@@ -240,7 +434,8 @@ def edit_pain():
         if body_part:
             updates["body_part"] = body_part
 
-        pain_doc_ref.update(updates)
+        if not data_helper.update_pain(uid, hash_id, updates, db):
+            return jsonify({"error": "Document not found."}), 404
         return jsonify({"message": "Pain updated successfully."}), 200
     except Exception as e:
         return jsonify({"error": str(e)}), 401
@@ -255,18 +450,29 @@ def remove_pain():
     """
     uid = request.json.get("uid")
     hash_id = request.json.get("hash_id")
-    collection_name = f"users/{uid}/pain"
     try:
-        pain_doc_ref = db.collection(collection_name).document(hash_id)
-        if not pain_doc_ref.get().exists:
+        if not data_helper.delete_pain(uid, hash_id, db):
             return jsonify({"error": "Document not found."}), 404
-
-        pain_doc_ref.delete()
         return jsonify({"message": "Pain removed successfully."}), 200
     except Exception as e:
         return jsonify({"error": str(e)}), 401
 
 
+@app.route("/users/<uid>/pain/bulk", methods=["POST"])
+def import_pain(uid):
+    """create many pain notes
+    /users/<uid>/pain/bulk; POST; json array (or {"records": [...]}) or ndjson of pain notes, each
+    validated like /add-pain. at most 10000, written 500 per batched write
+
+    Args:
+        uid (str): user id
+
+    Returns:
+        http response: 200 id or error of every record; 400
+    """
+    return import_response(uid, "pain")
+
+
 ### CRUD for Workouts
 @app.route("/users/<uid>/workouts", methods=["POST"])
 def create_template(uid):
@@ -293,18 +499,26 @@ def create_template(uid):
 
 
 @app.route("/users/<uid>/workouts", methods=["GET"])
+@conditional_collection("workouts")
 def read_all_templates(uid):
     """get all workouts
-    /users/<uid>/workouts; GET
+    /users/<uid>/workouts; GET; optional ?limit=&cursor= to get one page, ?stream=json|ndjson to stream,
+    ?fields= to get only some fields
 
     Args:
         uid (str): user id
 
     Returns:
-        http response: 200, templates; 400
+        http response: 200, templates (or {items, next_cursor} when paginated) (with ETag); 304 if If-None-Match matches; 400
     """
     try:
-        templates = data_helper.get_all_template_workouts(uid, db)
+        fields = fields_arg()
+        mode = stream_mode()
+        if mode:
+            return stream_response(
+                data_helper.iter_user_collection(uid, "workouts", db, fields=fields), mode
+            )
+        templates = data_helper.get_all_template_workouts(uid, db, fields=fields, **page_args())
         return jsonify(templates), 200
     except Exception as e:
         return jsonify({"error": str(e)}), 400
@@ -313,7 +527,7 @@ def read_all_templates(uid):
 @app.route("/users/<uid>/workouts/<template_id>", methods=["GET"])
 def read_template(uid, template_id):
     """read a specific template
-    /users/<uid>/workouts/<template_id>; GET
+    /users/<uid>/workouts/<template_id>; GET; optional ?fields= to get only some fields
 
     Args:
         uid (str): user id
@@ -323,9 +537,10 @@ def read_template(uid, template_id):
         http response: 200, remplate; 400 or 404
     """
     try:
+        fields = fields_arg()
         template = data_helper.get_template_workout(uid, template_id, db)
         if template:
-            return jsonify(template), 200
+            return jsonify(data_helper.project(template, fields)), 200
         return jsonify({"error": "Template workout not found."}), 404
     except Exception as e:
         return jsonify({"error": str(e)}), 400
@@ -405,12 +620,28 @@ def create_completed(uid, template_id):
         return jsonify({"error": str(e)}), 400
 
 
+@app.route("/users/<uid>/workouts/<template_id>/completed/bulk", methods=["POST"])
+def import_completed(uid, template_id):
+    """create many completed instances of a workout
+    /users/<uid>/workouts/<template_id>/completed/bulk; POST; json array (or {"records": [...]}) or
+    ndjson of completed workouts. at most 10000, written 500 per batched write
+
+    Args:
+        uid (str): user id
+        template_id (str): workout_id
+
+    Returns:
+        http response: 200 id or error of every record; 400
+    """
+    return import_response(uid, "completed", template_id)
+
+
 @app.route(
     "/users/<uid>/workouts/<template_id>/completed/<completed_id>", methods=["GET"]
 )
 def read_completed(uid, template_id, completed_id):
     """read specific completed workout id
-    /users/<uid>/workouts/<template_id>/completed/<completed_id>; GET
+    /users/<uid>/workouts/<template_id>/completed/<completed_id>; GET; optional ?fields= to get only some fields
 
     Args:
         uid (str): user id
@@ -421,11 +652,12 @@ def read_completed(uid, template_id, completed_id):
         http response: 200, copmleted; 400, 404
     """
     try:
+        fields = fields_arg()
         completed = data_helper.get_completed_workout(
             uid, template_id, completed_id, db
         )
         if completed:
-            return jsonify(completed), 200
+            return jsonify(data_helper.project(completed, fields)), 200
         return jsonify({"error": "Completed workout not found."}), 404
     except Exception as e:
         return jsonify({"error": str(e)}), 400
@@ -434,18 +666,25 @@ def read_completed(uid, template_id, completed_id):
 @app.route("/users/<uid>/workouts/<template_id>/completed", methods=["GET"])
 def read_all_completed(uid, template_id):
     """read all completed workouts of sepcific template
-    /users/<uid>/workouts/<template_id>/completed; GET
+    /users/<uid>/workouts/<template_id>/completed; GET; optional ?limit=&cursor= to get one page, ?stream=json|ndjson to stream,
+    ?fields= to get only some fields
 
     Args:
         uid (str): user id
         template_id (str): template id
 
     Returns:
-        http response: 200 completed workouts; 400
+        http response: 200 completed workouts (or {items, next_cursor} when paginated); 400
     """
     try:
+        fields = fields_arg()
+        mode = stream_mode()
+        if mode:
+            return stream_response(
+                data_helper.iter_completed_workouts(uid, template_id, db, fields), mode
+            )
         completed_workouts = data_helper.get_all_completed_workouts(
-            uid, template_id, db
+            uid, template_id, db, fields=fields, **page_args()
         )
         return jsonify(completed_workouts), 200
     except Exception as e:
@@ -455,7 +694,7 @@ def read_all_completed(uid, template_id):
 @app.route("/users/<uid>/workouts/ALL/completed", methods=["GET"])
 def read_all_completed_all(uid):
     """read all completed workouts
-    /users/<uid>/workouts/ALL/completed; GET
+    /users/<uid>/workouts/ALL/completed; GET; optional ?stream=json|ndjson to stream, ?fields= to get only some fields
 
     Args:
         uid (str): user id
@@ -466,7 +705,11 @@ def read_all_completed_all(uid):
 
     # Get all completed workouts for all templates
     try:
-        completed_workouts = data_helper.get_all_completed_workouts_all(uid, db)
+        fields = fields_arg()
+        mode = stream_mode()
+        if mode:
+            return stream_response(data_helper.iter_all_completed_workouts(uid, db, fields), mode)
+        completed_workouts = data_helper.get_all_completed_workouts_all(uid, db, fields)
         return jsonify(completed_workouts), 200
     except Exception as e:
         return jsonify({"error": str(e)}), 400
@@ -532,14 +775,73 @@ def get_recommended_exercise(uid):
         http : 200 with recommended focus, intenstiy; 400
     """
     try:
-        curr_workout = request.get_json()
-        curr_workout = [c for c in curr_workout if ("eid" in c and c["eid"])]
+        curr_workout = workout_arg()
         recommendation = recommender.recommend_exercise(uid, curr_workout, db)
         return jsonify({"status": "success", **recommendation}), 200
     except Exception as e:
         return jsonify({"error": str(e)}), 400
 
 
+@app.route("/recommend/<uid>/ranked", methods=["POST"])
+def get_ranked_recommendations(uid):
+    """get the k best muscles to work next, weighing the user's recent training load, each with its
+    intensity and the user's exercises working it
+    /recommend/<uid>/ranked?k=3; POST; body expects the list of exercises currently working on,
+    k (optional, 1 to the number of muscles) is the number of muscles
+
+    Args:
+        uid (str): user id
+
+    Returns:
+        http response: 200 with the ranked {muscle, score, load, intensity, exercises}; 400
+    """
+    try:
+        k = recommender.parse_top_k(request.args.get("k"))
+        curr_workout = workout_arg()
+        recommended = recommender.recommend_ranked(uid, curr_workout, db, k)
+        return jsonify({"status": "success", "recommended": recommended}), 200
+    except Exception as e:
+        return jsonify({"error": str(e)}), 400
+
+
+@app.route("/recommend/<uid>/exercises", methods=["POST"])
+def get_recommended_exercises(uid):
+    """get recommended exercises for many workouts at once
+    /recommend/<uid>/exercises; POST; body expects a list of workouts (or {"workouts": [...]}),
+    each a list of exercises like /recommend/<uid>/exercise, at most batch_recommender.MAX_WORKOUTS
+
+    Args:
+        uid (str): user id
+
+    Returns:
+        http response: 200 with one {recommended, intensity} (or {error}) per workout; 400
+    """
+    try:
+        workouts = batch_recommender.parse_workouts(request.get_json())
+        recommendations = batch_recommender.recommend_exercises(uid, workouts, db)
+        return jsonify({"status": "success", "recommendations": recommendations}), 200
+    except Exception as e:
+        return jsonify({"error": str(e)}), 400
+
+
+@app.route("/recommend/<uid>/templates", methods=["GET"])
+def get_recommended_templates(uid):
+    """get a recommended exercise for every workout template of the user
+    /recommend/<uid>/templates; GET
+
+    Args:
+        uid (str): user id
+
+    Returns:
+        http response: 200 with template id -> {recommended, intensity} (or {error}); 400
+    """
+    try:
+        recommendations = batch_recommender.recommend_templates(uid, db)
+        return jsonify({"status": "success", "recommendations": recommendations}), 200
+    except Exception as e:
+        return jsonify({"error": str(e)}), 400
+
+
 @app.route("/recommend/workout/<part>", methods=["GET"])
 def get_recommended_workout(part):
     """get recommended workout
@@ -549,12 +851,17 @@ def get_recommended_workout(part):
         part (str): 'arms, upper body, mid body, legs'
 
     Returns:
-        http response: 200 recommended_workout; 400 or 404
+        http response: 200 recommended_workout (with ETag and Cache-Control); 304 if If-None-Match matches; 400 or 404
     """
     try:
         rec_workout = recommender.recommend_workout(part, db)
         if rec_workout:
-            return jsonify(rec_workout), 200
+            # premade workouts rarely change, let clients and proxies reuse them
+            response = jsonify(rec_workout)
+            response.add_etag()
+            response.cache_control.public = True
+            response.cache_control.max_age = recommender.PREMADE_WORKOUT_TTL
+            return response.make_conditional(request)
         return jsonify({"error": "recommended workout not found"}), 404
     except Exception as e:
         return jsonify({"error": str(e)}), 400
@@ -583,18 +890,26 @@ def create_journal(uid):
 
 
 @app.route("/users/<uid>/journals", methods=["GET"])
+@conditional_collection("journals")
 def read_all_journals(uid):
     """get all journals
-    /users/<uid>/journals; GET
+    /users/<uid>/journals; GET; optional ?limit=&cursor= to get one page, ?stream=json|ndjson to stream,
+    ?fields= to get only some fields
 
     Args:
         uid (str): user id
 
     Returns:
-        http response: 200, journal; 400
+        http response: 200, journal (or {items, next_cursor} when paginated) (with ETag); 304 if If-None-Match matches; 400
     """
     try:
-        journals = data_helper.get_all_journals(uid, db)
+        fields = fields_arg()
+        mode = stream_mode()
+        if mode:
+            return stream_response(
+                data_helper.iter_user_collection(uid, "journals", db, fields=fields), mode
+            )
+        journals = data_helper.get_all_journals(uid, db, fields=fields, **page_args())
         return jsonify(journals), 200
     except Exception as e:
         return jsonify({"error": str(e)}), 400
@@ -645,18 +960,26 @@ def create_medication(uid):
 
 
 @app.route("/users/<uid>/medications", methods=["GET"])
+@conditional_collection("medications")
 def read_all_medications(uid):
     """read all medicine notes
-    /users/<uid>/medications; GET
+    /users/<uid>/medications; GET; optional ?limit=&cursor= to get one page, ?stream=json|ndjson to stream,
+    ?fields= to get only some fields
 
     Args:
         uid (str): user id
 
     Returns:
-        http respones: 200, medication notes; 400
+        http respones: 200, medication notes (or {items, next_cursor} when paginated) (with ETag); 304 if If-None-Match matches; 400
     """
     try:
-        medications = data_helper.get_all_medications(uid, db)
+        fields = fields_arg()
+        mode = stream_mode()
+        if mode:
+            return stream_response(
+                data_helper.iter_user_collection(uid, "medications", db, fields=fields), mode
+            )
+        medications = data_helper.get_all_medications(uid, db, fields=fields, **page_args())
         return jsonify(medications), 200
     except Exception as e:
         return jsonify({"error": str(e)}), 400
@@ -682,5 +1005,62 @@ def delete_medication(uid, medication_id):
         return jsonify({"error": str(e)}), 400
 
 
+@app.route("/users/<uid>/batch", methods=["POST"])
+def batch_write(uid):
+    """apply several writes atomically
+    /users/<uid>/batch; POST; body is a list of operations (or {"operations": [...]}), at most 500
+    writes (a delete also writes its tombstone):
+    {"op": create|update|delete, "collection": exercises|workouts|completed|pain|journals|medications,
+    "id": (update, delete), "template_id": (completed), "data": (create, update)}
+
+    Args:
+        uid (str): user id
+
+    Returns:
+        http response: 200 results with the id of every operation; 400 errors by operation index;
+            404 if a document to update does not exist. on any error nothing is written
+    """
+    body = request.get_json(silent=True)
+    operations = body.get("operations") if isinstance(body, dict) else body
+    try:
+        results = data_helper.commit_batch(uid, operations, db)
+        return jsonify({"results": results}), 200
+    except data_helper.BatchError as e:
+        return jsonify({"error": str(e), "errors": e.errors}), 400
+    except NotFound as e:
+        return jsonify({"error": str(e)}), 404
+    except Exception as e:
+        return jsonify({"error": str(e)}), 400
+
+
+@app.route("/users/<uid>/sync", methods=["GET"])
+def sync(uid):
+    """documents changed since the previous sync
+    /users/<uid>/sync; GET; ?since=<watermark of the previous sync>, omitted for everything
+
+    Args:
+        uid (str): user id
+
+    Returns:
+        http response: 200 {changes: {collection: [documents]}, deleted: [{collection, id,
+            template_id, deleted_at}], watermark}; 400; 410 if since is older than the deletions
+            kept (reload everything)
+    """
+    try:
+        since = data_helper.parse_since(request.args.get("since"))
+    except data_helper.SyncExpired as e:
+        return jsonify({"error": str(e)}), 410
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    try:
+        result = data_helper.get_changes(uid, since, db)
+        result["watermark"] = data_helper.format_watermark(result["watermark"])
+        return jsonify(result), 200
+    except Exception as e:
+        return jsonify({"error": str(e)}), 400
+
+
 if __name__ == "__main__":
+    # json lines written by a background thread, see log_helper for LOG_LEVEL / LOG_SAMPLE_RATES
+    log_helper.configure_logging()
     app.run(host="0.0.0.0", port=5001)
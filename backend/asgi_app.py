@@ -0,0 +1,176 @@
+"""the api of app.py as an ASGI application, for servers that only speak ASGI. run it with
+
+    uvicorn asgi_app:app --port 5001
+
+the routes that make several firestore reads (recommendations, all completed workouts, sync) are
+served natively: their views await async_helper on google.cloud.firestore.AsyncClient, so a request
+waiting on firestore holds no thread. they run in the flask app's request context, with its hooks,
+so request ids, access logs, metrics, encoding and status codes are those of app.py. every other
+route, and streamed responses, are the flask app behind a2wsgi's WSGI adapter, on its thread pool
+"""
+
+from a2wsgi import WSGIMiddleware
+from a2wsgi.wsgi import build_environ
+from flask import jsonify, request, request_started
+from werkzeug.exceptions import HTTPException
+
+import io
+
+import app as app_module
+import async_helper
+import data_helper
+import log_helper
+import recommender
+import storage
+
+# firestore by default, STORAGE_BACKEND=memory runs the whole api locally without network, on the
+# memory engine of app.py
+db = storage.create_async_client(engine=app_module.db.client)
+
+# requests of the flask app served at once, each holds a thread while it waits on firestore
+WORKERS = 32
+
+flask_app = app_module.app
+_wsgi = WSGIMiddleware(flask_app, workers=WORKERS)
+# flask endpoint -> async view served instead of it
+_views = {}
+
+
+def native(endpoint: str):
+    """serve a route of app.py with an async view, called with the same arguments"""
+
+    def decorator(view):
+        _views[endpoint] = view
+        return view
+
+    return decorator
+
+
+@native("read_all_completed_all")
+async def read_all_completed_all(uid):
+    """see app.read_all_completed_all"""
+    try:
+        completed_workouts = await async_helper.get_all_completed_workouts_all(uid, db, app_module.fields_arg())
+        return jsonify(completed_workouts), 200
+    except Exception as e:
+        return jsonify({"error": str(e)}), 400
+
+
+@native("get_recommended_exercise")
+async def get_recommended_exercise(uid):
+    """see app.get_recommended_exercise"""
+    try:
+        recommendation = await async_helper.recommend_exercise(uid, app_module.workout_arg(), db)
+        return jsonify({"status": "success", **recommendation}), 200
+    except Exception as e:
+        return jsonify({"error": str(e)}), 400
+
+
+@native("get_ranked_recommendations")
+async def get_ranked_recommendations(uid):
+    """see app.get_ranked_recommendations"""
+    try:
+        k = recommender.parse_top_k(request.args.get("k"))
+        recommended = await async_helper.recommend_ranked(uid, app_module.workout_arg(), db, k)
+        return jsonify({"status": "success", "recommended": recommended}), 200
+    except Exception as e:
+        return jsonify({"error": str(e)}), 400
+
+
+@native("sync")
+async def sync(uid):
+    """see app.sync"""
+    try:
+        since = data_helper.parse_since(request.args.get("since"))
+    except data_helper.SyncExpired as e:
+        return jsonify({"error": str(e)}), 410
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    try:
+        result = await async_helper.get_changes(uid, since, db)
+        result["watermark"] = data_helper.format_watermark(result["watermark"])
+        return jsonify(result), 200
+    except Exception as e:
+        return jsonify({"error": str(e)}), 400
+
+
+def _native_view(scope):
+    """the async view of a request, None when the flask app serves it"""
+    if scope["method"] not in ("GET", "POST"):
+        return None
+    adapter = flask_app.url_map.bind_to_environ(build_environ(scope, io.BytesIO()))
+    try:
+        endpoint, _ = adapter.match()
+    except HTTPException:
+        return None
+    return _views.get(endpoint)
+
+
+async def _read_body(receive):
+    chunks = []
+    while True:
+        message = await receive()
+        chunks.append(message.get("body", b""))
+        if not message.get("more_body"):
+            return b"".join(chunks)
+
+
+def _replay(body: bytes, receive):
+    """receive for a request whose body was already read"""
+    pending = [{"type": "http.request", "body": body, "more_body": False}]
+
+    async def replayed():
+        return pending.pop() if pending else await receive()
+
+    return replayed
+
+
+async def _dispatch(view, scope, body: bytes):
+    """app.py's full_dispatch_request with an async view
+
+    Returns:
+        Optional[flask.Response]: None when the flask app has to serve the request (streamed responses)
+    """
+    with flask_app.request_context(build_environ(scope, io.BytesIO(body))):
+        if app_module.stream_mode():
+            return None
+        try:
+            request_started.send(flask_app, _async_wrapper=flask_app.ensure_sync)
+            rv = flask_app.preprocess_request()
+            if rv is None:
+                rv = await view(**request.view_args)
+        except Exception as e:
+            rv = flask_app.handle_user_exception(e)
+        return flask_app.finalize_request(rv)
+
+
+async def _send(response, send):
+    headers = [(k.lower().encode("latin-1"), v.encode("latin-1")) for k, v in response.headers.items()]
+    await send({"type": "http.response.start", "status": response.status_code, "headers": headers})
+    await send({"type": "http.response.body", "body": response.get_data()})
+    response.close()
+
+
+async def _lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            log_helper.configure_logging()
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def app(scope, receive, send):
+    """the ASGI application"""
+    if scope["type"] == "lifespan":
+        return await _lifespan(receive, send)
+    view = _native_view(scope) if scope["type"] == "http" else None
+    if view is not None:
+        body = await _read_body(receive)
+        response = await _dispatch(view, scope, body)
+        if response is not None:
+            return await _send(response, send)
+        receive = _replay(body, receive)
+    await _wsgi(scope, receive, send)
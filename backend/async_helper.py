@@ -0,0 +1,106 @@
+"""asyncio versions of the read helpers that asgi_app serves natively, on
+google.cloud.firestore.AsyncClient (or storage.AsyncMemoryClient). a request waiting on firestore
+holds no thread, and reads that do not depend on each other are awaited together. the queries,
+validation and scoring are those of data_helper and recommender, only the awaiting differs.
+
+these reads are not served from data_helper.user_cache, which is filled and invalidated by the
+synchronous helpers
+"""
+
+import asyncio
+import google.cloud.firestore
+
+import data_helper
+import muscle_load
+import pain_summary
+import recommender
+from user_summary import completed_query
+
+
+async def _snapshots(query):
+    return [doc async for doc in query.stream()]
+
+
+async def get_all_completed_workouts_all(
+    uid: str, db: google.cloud.firestore.AsyncClient, fields: tuple = None
+):
+    """see data_helper.get_all_completed_workouts_all
+
+    Returns:
+        list[dict]: list of all completed workouts, represented with a dict (with template_id)
+    """
+    docs = await _snapshots(data_helper.selected(completed_query(uid, db), fields))
+    return list(data_helper.completed_with_template(docs))
+
+
+async def get_changes(uid: str, since, db: google.cloud.firestore.AsyncClient):
+    """see data_helper.get_changes. the watermark is read first, then the queries of every
+    collection run together
+
+    Returns:
+        dict: {"changes", "deleted", "watermark"}
+    """
+    watermark = (await data_helper.versions_ref(uid, db).get()).read_time
+    queries = data_helper.changes_queries(uid, since, db)
+    snapshots = await asyncio.gather(*(_snapshots(query) for query in queries.values()))
+    return data_helper.changes_result(dict(zip(queries, snapshots)), watermark)
+
+
+async def get_recent_pain(uid: str, db: google.cloud.firestore.AsyncClient, days: int = 7):
+    """the user's valid pain notes from the past `days` days, newest first, see
+    recommender.get_recent_pain
+
+    Returns:
+        list[dict]: pain notes with date, body_part and pain_level
+    """
+    docs = await _snapshots(recommender.recent_pain_query(uid, db, days))
+    return [note for note in (doc.to_dict() for doc in docs) if "body_part" in note and "pain_level" in note]
+
+
+async def _recent_pain(uid: str, summary, db: google.cloud.firestore.AsyncClient):
+    """the notes get_intensity looks at: from the pain summary, or read when the user has none"""
+    if summary is not None:
+        return pain_summary.recent_pain(summary)
+    return await get_recent_pain(uid, db)
+
+
+async def read_exercises(uid: str, eids, db: google.cloud.firestore.AsyncClient, *documents):
+    """see recommender.read_exercises
+
+    Returns:
+        tuple: (eid -> exercise document, the pain summary or None, the data of each of documents or None)
+    """
+    refs = recommender.exercise_refs(uid, eids, db, *documents)
+    snapshots = [doc async for doc in db.get_all(refs)]
+    return recommender.split_exercises(uid, snapshots, *(ref.path for ref in refs[len(eids):]))
+
+
+async def recommend_exercise(uid: str, curr_workout, db: google.cloud.firestore.AsyncClient):
+    """see recommender.recommend_exercise
+
+    Returns:
+        dict[str,str]: dict with fields 'recommended' and 'intensity'
+    """
+    exercise_info, summary = await read_exercises(uid, recommender.workout_eids([curr_workout]), db)
+    to_recommend = recommender.pick_muscle(curr_workout, exercise_info)
+    recent_pain = await _recent_pain(uid, summary, db)
+    return {"recommended": to_recommend, "intensity": recommender.get_intensity(recent_pain, to_recommend)}
+
+
+async def recommend_ranked(
+    uid: str, curr_workout, db: google.cloud.firestore.AsyncClient, k: int = recommender.DEFAULT_TOP_K
+):
+    """see recommender.recommend_ranked. the candidate exercises and, for users without a pain
+    summary, the recent pain notes are read together
+
+    Returns:
+        list[dict]: {"muscle", "score", "load", "intensity", "exercises"}, best first
+    """
+    exercise_info, summary, load = await read_exercises(
+        uid, recommender.workout_eids([curr_workout]), db, muscle_load.load_ref(uid, db)
+    )
+    ranked = recommender.rank_muscles(curr_workout, exercise_info, load, k)
+    exercise_docs, recent_pain = await asyncio.gather(
+        _snapshots(recommender.candidates_query(uid, ranked, db)), _recent_pain(uid, summary, db)
+    )
+    return recommender.add_candidates(ranked, exercise_docs, recent_pain)
@@ -0,0 +1,104 @@
+from firebase_admin import auth
+from flask import g, jsonify, request
+from cachetools import TLRUCache
+
+import functools
+import hashlib
+import threading
+import time
+
+# upper bound on the number of verified tokens kept in memory
+TOKEN_CACHE_SIZE = 4096
+
+
+class TokenCache:
+    """bounded LRU cache of verified firebase id tokens.
+    entries are keyed by a hash of the token (raw tokens are never kept) and expire at the
+    token's own 'exp' claim, so a cached token is never accepted after it would fail verification
+    """
+
+    def __init__(self, maxsize: int = TOKEN_CACHE_SIZE):
+        """
+        Args:
+            maxsize (int, optional): max number of tokens kept. Defaults to TOKEN_CACHE_SIZE.
+        """
+        self._cache = TLRUCache(
+            maxsize=maxsize, ttu=lambda _key, decoded, _now: decoded["exp"], timer=time.time
+        )
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def verify(self, token: str):
+        """verify an id token, only calling firebase when the token is not cached
+
+        Args:
+            token (str): firebase id token
+
+        Raises:
+            Exception: anything auth.verify_id_token raises for an invalid token
+
+        Returns:
+            dict: decoded token claims
+        """
+        key = hashlib.sha256(token.encode()).hexdigest() if isinstance(token, str) else None
+        if key is not None:
+            with self._lock:
+                decoded = self._cache.get(key)
+                if decoded is not None:
+                    self.hits += 1
+                    return decoded
+                self.misses += 1
+
+        decoded = auth.verify_id_token(token)
+        if key is not None and "exp" in decoded:
+            with self._lock:
+                self._cache[key] = decoded
+        return decoded
+
+    def stats(self):
+        """
+        Returns:
+            dict: hits, misses and number of cached tokens
+        """
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "size": len(self._cache)}
+
+    def clear(self):
+        """drop every cached token and reset the counters"""
+        with self._lock:
+            self._cache.clear()
+            self.hits = 0
+            self.misses = 0
+
+
+token_cache = TokenCache()
+
+
+def require_auth(view):
+    """route decorator for /users/<uid>/... routes.
+    the request needs an 'Authorization: Bearer <id token>' header, verified through token_cache,
+    and the token has to belong to the <uid> of the route. the decoded token is put in flask.g.token
+
+    Args:
+        view (function): flask view
+
+    Returns:
+        function: the wrapped view, answering 401 (bad/missing token) or 403 (other user) itself
+    """
+
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        scheme, _, token = request.headers.get("Authorization", "").partition(" ")
+        if scheme.lower() != "bearer" or not token:
+            return jsonify({"error": "Missing bearer token."}), 401
+        try:
+            decoded = token_cache.verify(token)
+        except Exception as e:
+            return jsonify({"error": str(e)}), 401
+        if "uid" in kwargs and decoded.get("uid") != kwargs["uid"]:
+            return jsonify({"error": "Token does not belong to this user."}), 403
+        g.token = decoded
+        return view(*args, **kwargs)
+
+    return wrapper
@@ -0,0 +1,205 @@
+"""recommend_exercise for many workouts at once, e.g. every template of a user or a nightly job over
+all users. the workouts become a (workouts x muscles) matrix of exercise counts, the muscle groups of
+recommender.pick_muscle a 0/1 (muscles x groups) membership matrix, and pick_muscle's rules are
+applied to every workout in one numpy pass. the results are the same as pick_muscle's, workout by
+workout, ties included
+"""
+
+import logging
+import google.cloud.firestore
+import numpy as np
+
+import data_helper
+import pain_summary
+import recommender
+
+logger = logging.getLogger(__name__)
+
+# workouts accepted by one batch request
+MAX_WORKOUTS = 1_000
+
+MUSCLE_INDEX = {muscle: i for i, muscle in enumerate(recommender.muscles)}
+_MUSCLES = len(recommender.muscles)
+
+# pick_muscle's groups (arms, mid body, upper body, legs) in the order it tries them, one column each
+_GROUPS = [recommender.ARMS, recommender.MIDBODY, recommender.ARMS + recommender.MIDBODY, recommender.LEGS]
+MEMBERSHIP = np.array([[muscle in group for group in _GROUPS] for muscle in recommender.muscles], dtype=np.int64)
+
+# the muscles every group (and the full body fallback, last) recommends from in tie order, as muscle
+# indices. rows are padded with _MUSCLES, the index of a column that is never the least worked
+_CHOICES = [
+    recommender.ARM_CHOICES,
+    recommender.MIDBODY_CHOICES,
+    recommender.UPPER_BODY_CHOICES,
+    recommender.LEGS_CHOICES,
+    recommender.muscles,
+]
+CHOICES = np.array(
+    [[MUSCLE_INDEX[muscle] for muscle in choices] + [_MUSCLES] * (_MUSCLES - len(choices)) for choices in _CHOICES],
+    dtype=np.intp,
+)
+_NEVER_LEAST = np.iinfo(np.int64).max
+
+
+def encode_workouts(workouts, exercise_info: dict):
+    """
+    Args:
+        workouts (list of workouts): every exercise has an eid
+        exercise_info (dict): eid -> exercise document (with its muscle)
+
+    Raises:
+        KeyError: if an exercise is not in exercise_info or its muscle is unknown, like pick_muscle
+
+    Returns:
+        tuple: (workouts x muscles matrix of exercise counts, number of exercises per workout)
+    """
+    cells = [
+        row * _MUSCLES + MUSCLE_INDEX[exercise_info[exer["eid"]]["muscle"]]
+        for row, workout in enumerate(workouts)
+        for exer in workout
+    ]
+    counts = np.bincount(np.array(cells, dtype=np.intp), minlength=len(workouts) * _MUSCLES)
+    sizes = np.array([len(workout) for workout in workouts], dtype=np.int64)
+    return counts.reshape(len(workouts), _MUSCLES), sizes
+
+
+def pick_muscle_indices(counts, sizes):
+    """recommender.pick_muscle on every row of a count matrix
+
+    Args:
+        counts (np.ndarray): workouts x muscles exercise counts
+        sizes (np.ndarray): exercises per workout
+
+    Returns:
+        np.ndarray: index (into recommender.muscles) of the muscle to recommend, per workout
+    """
+    rows = np.arange(len(counts))
+    # the first group worked by a majority of the exercises, the full body when there is none
+    needed = sizes // 2 + 1
+    majority = np.column_stack([counts @ MEMBERSHIP >= needed[:, None], np.ones(len(counts), dtype=bool)])
+    choices = CHOICES[majority.argmax(axis=1)]
+    # argmin returns the first least worked choice, the tie order of pick_muscle
+    padded = np.column_stack([counts, np.full(len(counts), _NEVER_LEAST)])
+    least = np.take_along_axis(padded, choices, axis=1).argmin(axis=1)
+    return choices[rows, least]
+
+
+def pick_muscles(workouts, exercise_info: dict):
+    """recommender.pick_muscle for many workouts
+
+    Args:
+        workouts (list of workouts): every exercise has an eid
+        exercise_info (dict): eid -> exercise document (with its muscle)
+
+    Raises:
+        KeyError: if an exercise is not in exercise_info or its muscle is unknown
+
+    Returns:
+        list[str]: the muscle to recommend, per workout
+    """
+    if not workouts:
+        return []
+    counts, sizes = encode_workouts(workouts, exercise_info)
+    return [recommender.muscles[i] for i in pick_muscle_indices(counts, sizes)]
+
+
+def _workout_error(workout, exercise_info: dict):
+    for exer in workout:
+        exercise = exercise_info.get(exer["eid"])
+        if exercise is None:
+            return f"Exercise not found: {exer['eid']}"
+        if not isinstance(exercise.get("muscle"), str) or exercise["muscle"] not in MUSCLE_INDEX:
+            return f"Exercise has no known muscle: {exer['eid']}"
+    return None
+
+
+def recommendations(workouts, exercise_info: dict, recent_pain):
+    """recommend_exercise's answer for every workout. a workout with an exercise that does not
+    exist gets an error instead, the others are still recommended
+
+    Args:
+        workouts (list of workouts): every exercise has an eid
+        exercise_info (dict): eid -> exercise document
+        recent_pain (list of notes): pain notes, newest first
+
+    Returns:
+        list[dict]: {"recommended", "intensity"} or {"error"}, per workout
+    """
+    results = [None] * len(workouts)
+    valid = []
+    for index, workout in enumerate(workouts):
+        error = _workout_error(workout, exercise_info)
+        if error:
+            results[index] = {"error": error}
+        else:
+            valid.append(index)
+    picks = pick_muscles([workouts[index] for index in valid], exercise_info)
+    intensities = {muscle: recommender.get_intensity(recent_pain, muscle) for muscle in set(picks)}
+    for index, muscle in zip(valid, picks):
+        results[index] = {"recommended": muscle, "intensity": intensities[muscle]}
+    return results
+
+
+def parse_workouts(body):
+    """the workouts of a batch request: a json array of workouts (or {"workouts": [...]}), every
+    workout a list of exercises; exercises without an eid are left out, like /recommend/<uid>/exercise
+
+    Raises:
+        ValueError: if the body is not a non empty list of workouts, or has too many
+
+    Returns:
+        list of workouts
+    """
+    workouts = body.get("workouts") if isinstance(body, dict) else body
+    if not isinstance(workouts, list) or not workouts:
+        raise ValueError("Body must be a non empty list of workouts.")
+    if len(workouts) > MAX_WORKOUTS:
+        raise ValueError(f"At most {MAX_WORKOUTS} workouts per request.")
+    if not all(isinstance(workout, list) and all(isinstance(c, dict) for c in workout) for workout in workouts):
+        raise ValueError("Every workout must be a list of exercises.")
+    return [[c for c in workout if ("eid" in c and c["eid"])] for workout in workouts]
+
+
+def template_workout(template: dict):
+    """a template's exercises ("sets|reps|weight|eid") as a workout"""
+    workout = []
+    for exercise in template.get("exercises") or []:
+        fields = exercise.split("|") if isinstance(exercise, str) else []
+        if len(fields) == 4 and fields[3]:
+            workout.append({"eid": fields[3]})
+    return workout
+
+
+def recommend_exercises(uid: str, workouts, db: google.cloud.firestore.Client):
+    """recommend_exercise for many workouts of one user, with one multi-get for all their exercises
+
+    Args:
+        uid (str): user id
+        workouts (list of workouts): see parse_workouts
+        db (google.cloud.firestore.Client): firebase db
+
+    Returns:
+        list[dict]: see recommendations
+    """
+    exercise_info, summary = recommender.read_exercises(uid, recommender.workout_eids(workouts), db)
+    if summary is not None:
+        recent_pain = pain_summary.recent_pain(summary)
+    else:
+        recent_pain = list(recommender.get_recent_pain(uid, db))
+    return recommendations(workouts, exercise_info, recent_pain)
+
+
+def recommend_templates(uid: str, db: google.cloud.firestore.Client):
+    """recommend_exercise for every template of a user
+
+    Args:
+        uid (str): user id
+        db (google.cloud.firestore.Client): firebase db
+
+    Returns:
+        dict: template id -> {"recommended", "intensity"} or {"error"}
+    """
+    templates = data_helper.get_all_template_workouts(uid, db)
+    results = recommend_exercises(uid, [template_workout(template) for template in templates], db)
+    logger.info("templates recommended", extra={"uid": uid, "templates": len(templates)})
+    return {template["id"]: result for template, result in zip(templates, results)}
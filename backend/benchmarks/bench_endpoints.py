@@ -0,0 +1,527 @@
+"""endpoint benchmarks: drives every route of app.py through the flask test client against the
+in-memory storage engine, seeded with synthetic users of different sizes, and reports latency
+percentiles, storage calls per request and peak memory per route.
+latencies are those of the memory engine (which scans whole collections), so they are for comparing
+commits with each other; storage calls and reads per request carry over to firestore as they are.
+
+    cd backend
+    python benchmarks/bench_endpoints.py                        # all profiles
+    python benchmarks/bench_endpoints.py -p small -n 50         # one profile, 50 requests per route
+    python benchmarks/bench_endpoints.py --compare benchmarks/results/<old commit>.json
+
+results are written as json (by default to benchmarks/results/<commit>.json) so two commits can be
+compared with --compare, which exits with status 1 when a route got slower than --threshold allows
+or makes more storage calls than before
+"""
+
+from datetime import datetime, timedelta, timezone
+from urllib.parse import quote
+
+import argparse
+import json
+import math
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+import tracemalloc
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import auth_helper  # noqa: E402
+import data_helper  # noqa: E402
+import log_helper  # noqa: E402
+import muscle_load  # noqa: E402
+import pain_summary  # noqa: E402
+import recommender  # noqa: E402
+import storage  # noqa: E402
+
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), "results")
+
+# synthetic users, sizes are numbers of documents
+PROFILES = {
+    "small": {
+        "exercises": 10,
+        "templates": 3,
+        "completed": 5,
+        "pain": 10,
+        "journals": 5,
+        "medications": 5,
+    },
+    "medium": {
+        "exercises": 100,
+        "templates": 10,
+        "completed": 100,
+        "pain": 1_000,
+        "journals": 100,
+        "medications": 20,
+    },
+    "large": {
+        "exercises": 500,
+        "templates": 20,
+        "completed": 500,
+        "pain": 50_000,
+        "journals": 1_000,
+        "medications": 50,
+    },
+}
+# exercises of every muscle in globals/exercises/premades, copied into new users
+PREMADES_PER_MUSCLE = 5
+BODY_PARTS = ("arms", "upper body", "mid body", "legs")
+
+
+def percentile(samples, p):
+    """nearest-rank percentile
+
+    Args:
+        samples (list): numbers, sorted
+        p (float): percentile, 0-100
+
+    Returns:
+        float: the sample at the percentile
+    """
+    if not samples:
+        return None
+    rank = max(0, min(len(samples) - 1, math.ceil(p / 100 * len(samples)) - 1))
+    return samples[rank]
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+### seeding
+def seed_globals(db):
+    """premade exercises (PREMADES_PER_MUSCLE per muscle) and one premade workout per body part"""
+    premades = db.collection("globals/exercises/premades")
+    for muscle in recommender.muscles:
+        for i in range(PREMADES_PER_MUSCLE):
+            premades.document(f"{muscle}-{i}").set({"name": f"{muscle} {i}", "muscle": muscle})
+    workouts = db.collection("globals/workouts/premades")
+    for part in BODY_PARTS:
+        workouts.document(part).set(
+            {"name": part, "exercises": [f"3|10|0|{m}-0" for m in recommender.muscles[:4]]}
+        )
+
+
+def completed_workout(exercise_ids, rng, day):
+    return {
+        "exercises": [f"3|{rng.randint(5, 15)}|{rng.randint(0, 100)}|{eid}" for eid in exercise_ids],
+        "notes": "synthetic",
+        "difficulty": rng.randint(1, 10),
+        "dateCompleted": day.strftime("%Y-%m-%d"),
+    }
+
+
+def pain_note(rng, day):
+    return {
+        "date": day.strftime("%Y-%m-%d"),
+        "pain_level": rng.randint(1, 10),
+        "body_part": rng.choice(recommender.muscles),
+    }
+
+
+def seed_user(db, uid, sizes, rng):
+    """write a synthetic user straight to the store
+
+    Args:
+        db (storage.MemoryClient): store
+        uid (str): user id
+        sizes (dict): number of documents per collection (see PROFILES)
+        rng (random.Random): source of synthetic values
+
+    Returns:
+        dict: ids of the seeded documents, by collection
+    """
+    today = datetime.now()
+    user_ref = db.collection("users").document(uid)
+    user_ref.set({"firstName": "Bench", "lastName": uid})
+    ids = {}
+
+    exercises = user_ref.collection("exercises")
+    ids["exercises"] = []
+    for i in range(sizes["exercises"]):
+        muscle = recommender.muscles[i % len(recommender.muscles)]
+        exercises.document(f"e{i:06d}").set({"name": f"exercise {i}", "muscle": muscle})
+        ids["exercises"].append(f"e{i:06d}")
+
+    ids["workouts"], ids["completed"] = [], {}
+    for t in range(sizes["templates"]):
+        template_ids = rng.sample(ids["exercises"], min(4, len(ids["exercises"])))
+        template = user_ref.collection("workouts").document(f"t{t:04d}")
+        template.set({"name": f"template {t}", "exercises": [f"3|10|0|{e}" for e in template_ids]})
+        ids["workouts"].append(template.id)
+        ids["completed"][template.id] = []
+        for c in range(sizes["completed"]):
+            doc = template.collection("completed").document(f"c{c:06d}")
+            doc.set(completed_workout(template_ids, rng, today - timedelta(days=c)))
+            ids["completed"][template.id].append(doc.id)
+
+    pain = user_ref.collection("pain")
+    ids["pain"] = []
+    for i in range(sizes["pain"]):
+        pain.document(f"p{i:06d}").set(pain_note(rng, today - timedelta(days=i % 365)))
+        ids["pain"].append(f"p{i:06d}")
+
+    for collection in ("journals", "medications"):
+        ids[collection] = []
+        for i in range(sizes[collection]):
+            user_ref.collection(collection).document(f"{collection[0]}{i:06d}").set(
+                {"title": f"{collection} {i}", "text": "synthetic " * 20}
+            )
+            ids[collection].append(f"{collection[0]}{i:06d}")
+    return ids
+
+
+def seed_disposable(db, uid, collection_path, count, data):
+    """documents for the delete routes to consume, one per request"""
+    collection = db.collection(f"users/{uid}/{collection_path}")
+    return [collection.add(dict(data))[1].id for _ in range(count)]
+
+
+### scenarios
+def scenarios(db, uid, ids, iterations, rng):
+    """every route with what one request to it looks like
+
+    Args:
+        db (storage.MemoryClient): seeded store
+        uid (str): seeded user
+        ids (dict): what seed_user returned
+        iterations (int): requests per route, delete routes get that many documents to delete
+        rng (random.Random): source of synthetic values
+
+    Returns:
+        list: (name, method, function of the request number returning (url, json body))
+    """
+    today = datetime.now()
+    template = ids["workouts"][0]
+    exercise = ids["exercises"][0]
+    completed = ids["completed"][template][0]
+    pain = ids["pain"][0]
+    workout = [{"eid": e} for e in ids["exercises"][:3]]
+    # a week of workouts, recommended together
+    workouts = [[{"eid": e} for e in rng.sample(ids["exercises"], min(4, len(ids["exercises"])))] for _ in range(7)]
+
+    # every request needs its own document to delete (or user to set up); made before timing
+    n = iterations + 1
+    delete_exercises = seed_disposable(db, uid, "exercises", n, {"name": "x", "muscle": recommender.CHEST})
+    delete_journals = seed_disposable(db, uid, "journals", n, {"title": "x"})
+    delete_medications = seed_disposable(db, uid, "medications", n, {"title": "x"})
+    delete_pain = seed_disposable(db, uid, "pain", n, pain_note(rng, today))
+    delete_completed = seed_disposable(db, uid, f"workouts/{template}/completed", n, {"notes": "x"})
+    delete_templates = []
+    for i in range(n):
+        template_ref = db.collection(f"users/{uid}/workouts").document(f"delete-{i:04d}")
+        template_ref.set({"name": "x"})
+        for c in range(10):
+            template_ref.collection("completed").add({"notes": "x"})
+        delete_templates.append(template_ref.id)
+    # the notes and workouts were seeded without their summary and load counters, like the data of
+    # users from before they existed
+    pain_summary.rebuild(uid, db)
+    muscle_load.rebuild(uid, db)
+
+    # /sync returns what the other scenarios wrote after seeding
+    sync_since = datetime.now(timezone.utc).isoformat()
+    exercise_body = {"name": "bench exercise", "muscle": recommender.BICEPS}
+    # a year of logging, imported in one request
+    pain_import = [pain_note(rng, today) for _ in range(365)]
+    completed_import = [completed_workout(ids["exercises"][:4], rng, today) for _ in range(365)]
+    return [
+        ("verify-token", "POST", lambda i: ("/verify-token", {"token": f"bench-token-{i % 10}"})),
+        ("setup-user", "POST", lambda i: ("/setup-user", {"uid": f"{uid}-setup-{i}", "firstName": "a", "lastName": "b"})),
+        ("create exercise", "POST", lambda i: (f"/users/{uid}/exercises", exercise_body)),
+        ("read exercise", "GET", lambda i: (f"/users/{uid}/exercises/{exercise}", None)),
+        ("read exercises", "GET", lambda i: (f"/users/{uid}/exercises", None)),
+        ("read exercises page", "GET", lambda i: (f"/users/{uid}/exercises?limit=50", None)),
+        ("read exercises stream", "GET", lambda i: (f"/users/{uid}/exercises?stream=ndjson", None)),
+        ("read exercises of muscle", "GET", lambda i: (f"/users/{uid}/exercises?muscle={recommender.muscles[i % len(recommender.muscles)]}", None)),
+        ("search exercises", "GET", lambda i: (f"/users/{uid}/exercises?q={recommender.muscles[i % len(recommender.muscles)][:3]}", None)),
+        ("update exercise", "PUT", lambda i: (f"/users/{uid}/exercises/{exercise}", {"name": f"renamed {i}"})),
+        ("delete exercise", "DELETE", lambda i: (f"/users/{uid}/exercises/{delete_exercises[i]}", None)),
+        ("add pain", "POST", lambda i: ("/add-pain", {"uid": uid, **pain_note(rng, today)})),
+        ("get all pain", "POST", lambda i: ("/get-all-pain", {"uid": uid})),
+        ("get all pain page", "POST", lambda i: ("/get-all-pain?limit=100", {"uid": uid})),
+        ("get all pain stream", "POST", lambda i: ("/get-all-pain?stream=json", {"uid": uid})),
+        ("edit pain", "POST", lambda i: ("/edit-pain", {"uid": uid, "hash_id": pain, "pain_level": 1 + i % 10})),
+        ("remove pain", "POST", lambda i: ("/remove-pain", {"uid": uid, "hash_id": delete_pain[i]})),
+        ("import pain", "POST", lambda i: (f"/users/{uid}/pain/bulk", pain_import)),
+        ("create template", "POST", lambda i: (f"/users/{uid}/workouts", {"name": "bench", "exercises": []})),
+        ("read templates", "GET", lambda i: (f"/users/{uid}/workouts", None)),
+        ("read template", "GET", lambda i: (f"/users/{uid}/workouts/{template}", None)),
+        ("read template fields", "GET", lambda i: (f"/users/{uid}/workouts/{template}?fields=name", None)),
+        ("update template", "PUT", lambda i: (f"/users/{uid}/workouts/{template}", {"name": f"renamed {i}"})),
+        ("delete template", "DELETE", lambda i: (f"/users/{uid}/workouts/{delete_templates[i]}", None)),
+        ("create completed", "POST", lambda i: (
+            f"/users/{uid}/workouts/{template}/completed",
+            completed_workout(ids["exercises"][:4], rng, today),
+        )),
+        ("import completed", "POST", lambda i: (f"/users/{uid}/workouts/{template}/completed/bulk", completed_import)),
+        ("read completed", "GET", lambda i: (f"/users/{uid}/workouts/{template}/completed/{completed}", None)),
+        ("read all completed", "GET", lambda i: (f"/users/{uid}/workouts/{template}/completed", None)),
+        ("read all completed all", "GET", lambda i: (f"/users/{uid}/workouts/ALL/completed", None)),
+        ("read all completed all fields", "GET", lambda i: (
+            f"/users/{uid}/workouts/ALL/completed?fields=dateCompleted", None
+        )),
+        ("update completed", "PUT", lambda i: (
+            f"/users/{uid}/workouts/{template}/completed/{completed}", {"notes": f"edited {i}"}
+        )),
+        ("delete completed", "DELETE", lambda i: (
+            f"/users/{uid}/workouts/{template}/completed/{delete_completed[i]}", None
+        )),
+        ("recommend exercise", "POST", lambda i: (f"/recommend/{uid}/exercise", workout)),
+        ("recommend ranked", "POST", lambda i: (f"/recommend/{uid}/ranked?k=3", workout)),
+        ("recommend exercises", "POST", lambda i: (f"/recommend/{uid}/exercises", workouts)),
+        ("recommend templates", "GET", lambda i: (f"/recommend/{uid}/templates", None)),
+        ("recommend workout", "GET", lambda i: (f"/recommend/workout/{BODY_PARTS[i % len(BODY_PARTS)]}", None)),
+        ("create journal", "POST", lambda i: (f"/users/{uid}/journals", {"title": "bench", "text": "x"})),
+        ("read journals", "GET", lambda i: (f"/users/{uid}/journals", None)),
+        ("delete journal", "DELETE", lambda i: (f"/users/{uid}/journals/{delete_journals[i]}", None)),
+        ("create medication", "POST", lambda i: (f"/users/{uid}/medications", {"title": "bench"})),
+        ("read medications", "GET", lambda i: (f"/users/{uid}/medications", None)),
+        ("delete medication", "DELETE", lambda i: (f"/users/{uid}/medications/{delete_medications[i]}", None)),
+        ("batch", "POST", lambda i: (f"/users/{uid}/batch", [
+            {"op": "create", "collection": "completed", "template_id": template,
+             "data": completed_workout(ids["exercises"][:4], rng, today)},
+            {"op": "create", "collection": "pain", "data": pain_note(rng, today)},
+            {"op": "update", "collection": "exercises", "id": exercise, "data": {"name": f"batched {i}"}},
+        ])),
+        ("sync", "GET", lambda i: (f"/users/{uid}/sync?since={quote(sync_since)}", None)),
+        ("sync all", "GET", lambda i: (f"/users/{uid}/sync", None)),
+        ("metrics", "GET", lambda i: ("/metrics", None)),
+    ]
+
+
+def unbenchmarked_routes(client, scenario_list):
+    """routes of the app no scenario sends a request to
+
+    Returns:
+        list: 'METHOD rule' of every route without a scenario
+    """
+    adapter = client.application.url_map.bind("localhost")
+    covered = set()
+    for _, method, request_for in scenario_list:
+        url, _ = request_for(0)
+        endpoint, _ = adapter.match(url.partition("?")[0], method=method)
+        covered.add((endpoint, method))
+    missing = []
+    for rule in client.application.url_map.iter_rules():
+        for method in sorted(rule.methods - {"HEAD", "OPTIONS"}):
+            if rule.endpoint != "static" and (rule.endpoint, method) not in covered:
+                missing.append(f"{method} {rule.rule}")
+    return missing
+
+
+### running
+def clear_caches():
+    data_helper.user_cache.clear()
+    auth_helper.token_cache.clear()
+    with recommender._premade_workouts_lock:
+        recommender._premade_workouts.clear()
+
+
+def send(client, method, url, body):
+    response = client.open(url, method=method, json=body)
+    # streamed bodies are produced while reading them, which is part of the request
+    response.get_data()
+    return response
+
+
+def bench_route(client, db, name, method, request_for, iterations, warm, memory_samples):
+    """time one route
+
+    Returns:
+        dict: latency percentiles (ms), storage calls/reads/writes per request, peak memory (KiB)
+    """
+    latencies, statuses = [], {}
+    calls = reads = writes = 0
+    for i in range(iterations):
+        url, body = request_for(i)
+        if not warm:
+            clear_caches()
+        before = dict(db.counters.current())
+        start = time.perf_counter()
+        response = send(client, method, url, body)
+        latencies.append((time.perf_counter() - start) * 1000)
+        after = db.counters.current()
+        calls += after["calls"] - before["calls"]
+        reads += after["reads"] - before["reads"]
+        writes += after["writes"] - before["writes"]
+        statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+    # tracemalloc slows everything down, so memory is measured in separate requests
+    peak = 0
+    for i in range(memory_samples):
+        url, body = request_for(iterations + i)
+        if not warm:
+            clear_caches()
+        tracemalloc.start()
+        send(client, method, url, body)
+        peak = max(peak, tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+
+    latencies.sort()
+    return {
+        "route": name,
+        "method": method,
+        "url": request_for(0)[0],
+        "requests": iterations,
+        "statuses": {str(status): count for status, count in sorted(statuses.items())},
+        "p50_ms": round(percentile(latencies, 50), 3),
+        "p95_ms": round(percentile(latencies, 95), 3),
+        "p99_ms": round(percentile(latencies, 99), 3),
+        "max_ms": round(latencies[-1], 3),
+        "store_calls": round(calls / iterations, 2),
+        "store_reads": round(reads / iterations, 2),
+        "store_writes": round(writes / iterations, 2),
+        "peak_kib": round(peak / 1024, 1),
+    }
+
+
+def run(profiles, iterations=20, warm=False, memory_samples=1, seed=0):
+    """benchmark every route for every profile
+
+    Args:
+        profiles (dict): profile name -> sizes (see PROFILES)
+        iterations (int, optional): timed requests per route. Defaults to 20.
+        warm (bool, optional): keep process caches between requests. Defaults to False (cold).
+        memory_samples (int, optional): requests per route traced for peak memory. Defaults to 1.
+        seed (int, optional): seed of the synthetic data. Defaults to 0.
+
+    Returns:
+        dict: environment and one result per (profile, route)
+    """
+    results, missing = [], []
+    # imported on first use, so main() can pick the storage backend app.py starts with
+    import app as app_module
+
+    original_db = app_module.db
+    # tokens verified by firebase cannot be made up, verification is stubbed (the cache is not)
+    original_verify = auth_helper.auth.verify_id_token
+    auth_helper.auth.verify_id_token = lambda token: {"uid": token, "exp": time.time() + 3600}
+    try:
+        for profile, sizes in profiles.items():
+            rng = random.Random(seed)
+            db = storage.CountingClient(storage.MemoryClient())
+            seed_globals(db._target)
+            uid = f"bench-{profile}"
+            ids = seed_user(db._target, uid, sizes, rng)
+            scenario_list = scenarios(db._target, uid, ids, iterations + memory_samples, rng)
+            app_module.db = db
+            with data_helper._premade_lock:
+                data_helper._premade_trees.clear()
+            clear_caches()
+            with app_module.app.test_client() as client:
+                missing = unbenchmarked_routes(client, scenario_list)
+                for name, method, request_for in scenario_list:
+                    result = bench_route(
+                        client, db, name, method, request_for, iterations, warm, memory_samples
+                    )
+                    results.append({"profile": profile, **result})
+    finally:
+        app_module.db = original_db
+        auth_helper.auth.verify_id_token = original_verify
+        clear_caches()
+        with data_helper._premade_lock:
+            data_helper._premade_trees.clear()
+
+    return {
+        "commit": git_commit(),
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "iterations": iterations,
+        "cache": "warm" if warm else "cold",
+        "profiles": profiles,
+        "unbenchmarked_routes": missing,
+        "results": results,
+    }
+
+
+### reporting
+def print_table(report, baseline=None):
+    old = {}
+    if baseline:
+        old = {(r["profile"], r["route"]): r for r in baseline["results"]}
+    header = f"{'profile':<8} {'route':<24} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'calls':>7} {'reads':>9} {'writes':>7} {'peak KiB':>10}"
+    print(header + ("  p95 vs baseline" if baseline else ""))
+    for r in report["results"]:
+        line = (
+            f"{r['profile']:<8} {r['route']:<24} {r['p50_ms']:>9.3f} {r['p95_ms']:>9.3f} {r['p99_ms']:>9.3f}"
+            f" {r['store_calls']:>7} {r['store_reads']:>9} {r['store_writes']:>7} {r['peak_kib']:>10}"
+        )
+        before = old.get((r["profile"], r["route"]))
+        if before and before["p95_ms"]:
+            line += f"  x{r['p95_ms'] / before['p95_ms']:.2f}"
+        print(line)
+    for route in report["unbenchmarked_routes"]:
+        print(f"not benchmarked: {route}")
+
+
+def regressions(report, baseline, threshold):
+    """routes slower (p95) than threshold times the baseline, or making more storage calls
+
+    Returns:
+        list: descriptions of the regressions
+    """
+    old = {(r["profile"], r["route"]): r for r in baseline["results"]}
+    found = []
+    for r in report["results"]:
+        before = old.get((r["profile"], r["route"]))
+        if not before:
+            continue
+        if r["p95_ms"] > before["p95_ms"] * threshold:
+            found.append(f"{r['profile']} {r['route']}: p95 {before['p95_ms']} -> {r['p95_ms']} ms")
+        if r["store_calls"] > before["store_calls"]:
+            found.append(f"{r['profile']} {r['route']}: store calls {before['store_calls']} -> {r['store_calls']}")
+    return found
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("-p", "--profile", action="append", choices=sorted(PROFILES), help="profiles to run, default all")
+    parser.add_argument("-n", "--iterations", type=int, default=20, help="timed requests per route")
+    parser.add_argument("--warm", action="store_true", help="keep process caches between requests")
+    parser.add_argument("--memory-samples", type=int, default=1, help="requests per route traced for peak memory")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("-o", "--output", help="results file, default benchmarks/results/<commit>.json")
+    parser.add_argument("--compare", help="results file of an earlier run to compare with")
+    parser.add_argument("--threshold", type=float, default=1.25, help="p95 slowdown counted as a regression")
+    args = parser.parse_args(argv)
+
+    # the app starts on the memory engine, not firestore; per request info records would be part
+    # of what is measured
+    os.environ["STORAGE_BACKEND"] = "memory"
+    log_helper.configure_logging(os.environ.get("LOG_LEVEL", "WARNING"))
+
+    profiles = {name: PROFILES[name] for name in (args.profile or PROFILES)}
+    report = run(profiles, args.iterations, args.warm, args.memory_samples, args.seed)
+
+    output = args.output or os.path.join(RESULTS_DIR, f"{report['commit']}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    print_table(report, baseline)
+    print(f"results written to {output}")
+    if baseline:
+        found = regressions(report, baseline, args.threshold)
+        for regression in found:
+            print(f"regression: {regression}")
+        return 1 if found else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
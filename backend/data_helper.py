@@ -1,14 +1,240 @@
 from google.cloud import firestore
 from firebase_admin import credentials
 from firebase_admin import firestore
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
+import contextlib
+import contextvars
+import functools
+import inspect
+import json
+import logging
+import re
+import threading
 import google.cloud.firestore
 
+import exercise_index
+import muscle_load
+import pain_summary
+import recommender
+from user_cache import UserCache
+from user_summary import completed_query
 
+logger = logging.getLogger(__name__)
+
+# firestore allows at most 500 writes in one batch
+BATCH_LIMIT = 500
+
+# premade collections copied into every new user: (source, destination under users/{uid})
+PREMADE_COLLECTIONS = [
+    ("globals/exercises/premades", "exercises"),
+    ("globals/workouts/premades", "workouts"),
+]
+
+# premade documents are read once per process and reused for every sign up
+_premade_trees = {}
+_premade_lock = threading.Lock()
+_premade_stats = {"hits": 0, "misses": 0}
+
+
+# per-user read-through cache of the get_* helpers, invalidated by the write helpers
+user_cache = UserCache()
+# every cached collection, used when a whole user is written
+USER_COLLECTIONS = ("user", "exercises", "workouts", "completed", "pain", "journals", "medications")
+# {(uid, collection): version token} the current request read, see read_at_version
+_read_versions = contextvars.ContextVar("read_versions", default=None)
+
+
+def _cache_key_part(value):
+    """clients (and other objects) are keyed by identity, plain values by value"""
+    if value is None or isinstance(value, (str, int, float, bool, tuple)):
+        return value
+    return ("obj", id(value))
+
+
+def cached_read(collection: str):
+    """decorator for get_* helpers taking uid first: results are
+    served from user_cache until a write helper touches the same user's collection. inside
+    read_at_version, results are also keyed by the collection version
+
+    Args:
+        collection (str): collection the helper reads
+    """
+
+    def decorator(fn):
+        def cache_key(args, kwargs):
+            return (
+                fn.__name__,
+                tuple(_cache_key_part(arg) for arg in args),
+                tuple(sorted((k, _cache_key_part(v)) for k, v in kwargs.items())),
+            )
+
+        @functools.wraps(fn)
+        def wrapper(uid, *args, **kwargs):
+            versions = _read_versions.get()
+            version = versions.get((uid, collection)) if versions else None
+            return user_cache.get_or_load(
+                uid, collection, (version, cache_key(args, kwargs)), lambda: fn(uid, *args, **kwargs)
+            )
+
+        return wrapper
+
+    return decorator
+
+
+def invalidates(*collections: str, bump: bool = True):
+    """decorator for write helpers taking uid first and a db argument:
+    the user's cached reads of collections are dropped and their versions bumped once the write is
+    done (or failed part way)
+
+    Args:
+        collections (str): collections the helper writes
+        bump (bool, optional): bump the versions of the collections, False for helpers that write
+            version_bump in their own transaction or batch. Defaults to True.
+    """
+
+    def decorator(fn):
+        signature = inspect.signature(fn)
+
+        def db_argument(uid, args, kwargs):
+            return signature.bind(uid, *args, **kwargs).arguments["db"]
+
+        @functools.wraps(fn)
+        def wrapper(uid, *args, **kwargs):
+            try:
+                return fn(uid, *args, **kwargs)
+            finally:
+                user_cache.invalidate(uid, *collections)
+                if bump:
+                    try_bump_versions(uid, collections, db_argument(uid, args, kwargs))
+
+        return wrapper
+
+    return decorator
+
+
+@contextlib.contextmanager
+def read_at_version(uid: str, collection: str, version: str):
+    """serve the cached reads of the user's collection made inside the block only if they were
+    loaded at this version. writes of other processes do not invalidate this process's cache, but
+    they bump the version, so a body cached before them is not sent under a newer version's ETag
+
+    Args:
+        uid (str): uid
+        collection (str): collection
+        version (str): see get_collection_version
+    """
+    token = _read_versions.set({**(_read_versions.get() or {}), (uid, collection): version})
+    try:
+        yield
+    finally:
+        _read_versions.reset(token)
+
+
+def cache_stats():
+    """hit / miss statistics of the per-user read cache
+
+    Returns:
+        dict: see UserCache.stats
+    """
+    return user_cache.stats()
+
+
+### collection versions
+# every write helper increments the version of the collections it writes in this document,
+# so a client can tell whether a collection changed from one small read
+VERSIONS_DOCUMENT = ("meta", "versions")
+
+
+def versions_ref(uid: str, db):
+    return db.collection("users").document(uid).collection(VERSIONS_DOCUMENT[0]).document(VERSIONS_DOCUMENT[1])
+
+
+def version_bump(uid: str, collections, db):
+    """the write that increments the versions of the user's collections, to add to a transaction or
+    batch with transaction.set(*version_bump(...))
+
+    Args:
+        uid (str): uid
+        collections (iterable of str): collections that were written
+        db (google.cloud.firestore.Client): firestore client
+
+    Returns:
+        tuple: (document reference, data, merge)
+    """
+    return versions_ref(uid, db), {collection: firestore.Increment(1) for collection in collections}, True
+
+
+def bump_versions(uid: str, collections, db: google.cloud.firestore.Client):
+    """increment the versions of the user's collections
+
+    Args:
+        uid (str): uid
+        collections (iterable of str): collections that were written
+        db (google.cloud.firestore.Client): firestore client
+
+    Returns:
+        the write result
+    """
+    versions_ref, data, merge = version_bump(uid, collections, db)
+    return versions_ref.set(data, merge=merge)
+
+
+def try_bump_versions(uid: str, collections, db: google.cloud.firestore.Client):
+    """bump_versions after a write that is already done: a failed bump is logged, not raised, so the
+    caller still gets the result of the write (clients revalidate on the next bump)
+
+    Args:
+        uid (str): uid
+        collections (iterable of str): collections that were written
+        db (google.cloud.firestore.Client): firestore client
+    """
+    try:
+        bump_versions(uid, collections, db)
+    except Exception:
+        logger.exception("version bump failed", extra={"uid": uid, "collections": sorted(collections)})
+
+
+def _version_token(snapshot, collection: str):
+    # the creation time tells a recreated user (whose counters restart) from the old one
+    if not snapshot.exists:
+        return "0"
+    created = snapshot.create_time.timestamp() if snapshot.create_time else 0
+    return f"{created}:{(snapshot.to_dict() or {}).get(collection, 0)}"
+
+
+def get_collection_version(uid: str, collection: str, db: google.cloud.firestore.Client):
+    """an opaque version of the user's collection that changes with every write to it.
+    never cached, it is what tells other processes' writes apart
+
+    Args:
+        uid (str): uid
+        collection (str): collection name
+        db (google.cloud.firestore.Client): firestore client
+
+    Returns:
+        str: version
+    """
+    return _version_token(versions_ref(uid, db).get(), collection)
+
+
+def _invalidate_path(collection_name: str, db):
+    """invalidate the cache and bump the version for writes made through a raw
+    users/{uid}/{collection} path"""
+    parts = collection_name.strip("/").split("/")
+    if len(parts) >= 3 and parts[0] == "users":
+        collection = "completed" if parts[-1] == "completed" else parts[2]
+        user_cache.invalidate(parts[1], collection)
+        if collection == "exercises":
+            exercise_index.forget(parts[1])
+        try_bump_versions(parts[1], (collection,), db)
+
+
+@invalidates(*USER_COLLECTIONS)
 def create_user_document(
     uid: str, firstName: str, lastName: str, db: google.cloud.firestore.Client
 ):
     """Generates the User document on the backend
+    the user document and the copies of the premade collections are written with batched writes
 
     Args:
         uid (str): user id
@@ -23,25 +249,95 @@ def create_user_document(
         "first_name": firstName,
         "last_name": lastName,
     }
-    user_doc_ref.set(user_data)
-    print(f"Document for UID {uid} created successfully in users/{uid}")
+    writes = [(user_doc_ref, stamped(user_data))]
 
-    print(f"\tCopying global files")
-    source_collection_path = "globals/exercises/premades"
-    source_collection_ref = db.collection(source_collection_path)
+    logger.debug("copying premade collections", extra={"uid": uid})
+    try:
+        for source_collection_path, destination_name in PREMADE_COLLECTIONS:
+            tree = get_premade_tree(source_collection_path, db)
+            _queue_collection_tree(tree, user_doc_ref.collection(destination_name), writes)
+    except Exception:
+        logger.exception("error copying premade collections", extra={"uid": uid})
 
-    destination_collection_path = f"users/{uid}/exercises"
-    destination_collection_ref = db.collection(destination_collection_path)
-    copy_collection_recursive(source_collection_ref, destination_collection_ref, db)
-    print("copied exercises")
+    commit_writes(writes, db)
+    exercise_index.forget(uid)
+    logger.info("user document created", extra={"uid": uid, "copied": len(writes) - 1})
 
-    source_collection_path = "globals/workouts/premades"
-    source_collection_ref = db.collection(source_collection_path)
 
-    destination_collection_path = f"users/{uid}/workouts"
-    destination_collection_ref = db.collection(destination_collection_path)
-    copy_collection_recursive(source_collection_ref, destination_collection_ref, db)
-    print("copied workouts")
+def get_premade_tree(source_collection_path: str, db: google.cloud.firestore.Client):
+    """get a premade collection (and its subcollections), reading it from firestore only
+    the first time it is asked for in this process
+
+    Args:
+        source_collection_path (str): path of the premade collection
+        db (google.cloud.firestore.Client):
+
+    Returns:
+        list[tuple]: see read_collection_tree
+    """
+    with _premade_lock:
+        if source_collection_path in _premade_trees:
+            _premade_stats["hits"] += 1
+        else:
+            _premade_stats["misses"] += 1
+            _premade_trees[source_collection_path] = read_collection_tree(
+                db.collection(source_collection_path)
+            )
+        return _premade_trees[source_collection_path]
+
+
+def premade_cache_stats():
+    """hit / miss statistics of the premade collection cache used when setting up users
+
+    Returns:
+        dict: hits, misses and number of cached collections
+    """
+    with _premade_lock:
+        return {**_premade_stats, "size": len(_premade_trees)}
+
+
+def read_collection_tree(collection_ref):
+    """reads every document of a collection and, recursively, its real subcollections
+
+    Args:
+        collection_ref (firebase collection):
+
+    Returns:
+        list[tuple[str, dict, dict]]: (doc id, doc data, {subcollection name: tree}) per document
+    """
+    tree = []
+    for doc in collection_ref.stream():
+        subcollections = {
+            subcollection_ref.id: read_collection_tree(subcollection_ref)
+            for subcollection_ref in doc.reference.collections()
+        }
+        tree.append((doc.id, doc.to_dict(), subcollections))
+    return tree
+
+
+def _queue_collection_tree(tree, destination_collection_ref, writes):
+    """adds the (ref, data) sets needed to copy a collection tree under destination to writes"""
+    for doc_id, doc_data, subcollections in tree:
+        destination_doc_ref = destination_collection_ref.document(doc_id)
+        writes.append((destination_doc_ref, stamped(doc_data)))
+        for subcollection_name, subtree in subcollections.items():
+            _queue_collection_tree(
+                subtree, destination_doc_ref.collection(subcollection_name), writes
+            )
+
+
+def commit_writes(writes, db: google.cloud.firestore.Client):
+    """sets every (ref, data) pair using as few batched writes as possible
+
+    Args:
+        writes (list[tuple[DocumentReference, dict]]): documents to set
+        db (google.cloud.firestore.Client):
+    """
+    for start in range(0, len(writes), BATCH_LIMIT):
+        batch = db.batch()
+        for doc_ref, doc_data in writes[start : start + BATCH_LIMIT]:
+            batch.set(doc_ref, doc_data)
+        batch.commit()
 
 
 def copy_collection_recursive(source_collection_ref, destination_collection_ref, db):
@@ -53,28 +349,16 @@ def copy_collection_recursive(source_collection_ref, destination_collection_ref,
         db (firestore client):
     """
     try:
-        for doc in source_collection_ref.stream():
-            doc_id = doc.id
-            doc_data = doc.to_dict()
-
-            destination_doc_ref = destination_collection_ref.document(doc_id)
-            destination_doc_ref.set(doc_data)
-
-            for subcollection_name, subcollection_data in doc_data.items():
-                if isinstance(subcollection_data, dict):
-                    source_subcollection_ref = source_collection_ref.document(
-                        doc_id
-                    ).collection(subcollection_name)
-                    destination_subcollection_ref = destination_collection_ref.document(
-                        doc_id
-                    ).collection(subcollection_name)
-                    copy_collection_recursive(
-                        source_subcollection_ref, destination_subcollection_ref, db
-                    )
-    except Exception as e:
-        print(f"Error copying collection: {e}")
+        writes = []
+        _queue_collection_tree(
+            read_collection_tree(source_collection_ref), destination_collection_ref, writes
+        )
+        commit_writes(writes, db)
+    except Exception:
+        logger.exception("error copying collection", extra={"source": source_collection_ref.id})
 
 
+@cached_read("user")
 def get_user_document(uid: str, db: google.cloud.firestore.Client):
     """Get User document
 
@@ -92,6 +376,40 @@ def get_user_document(uid: str, db: google.cloud.firestore.Client):
     return None
 
 
+@invalidates(*USER_COLLECTIONS, bump=False)
+def delete_user_document(uid: str, db: google.cloud.firestore.Client):
+    """Delete User document and all of the user's data (exercises, workouts, notes...)
+
+    Args:
+        uid (str):
+        db (google.cloud.firestore.Client):
+
+    Returns:
+        int: number of documents deleted
+    """
+    user_doc_ref = db.collection("users").document(uid)
+    deleted = delete_document_recursive(user_doc_ref, db)
+    exercise_index.forget(uid)
+    logger.info("user document deleted", extra={"uid": uid, "nested": deleted - 1})
+    return deleted
+
+
+def delete_document_recursive(doc_ref, db: google.cloud.firestore.Client):
+    """delete a document and everything under it.
+    subcollections are discovered with collections(), all of their descendants are read with one
+    chunked query per subcollection, and the deletes are sent in parallel batches by a BulkWriter,
+    so the number of round trips does not grow with the number of documents
+
+    Args:
+        doc_ref (firebase document): document to delete
+        db (google.cloud.firestore.Client):
+
+    Returns:
+        int: number of documents deleted
+    """
+    return db.recursive_delete(doc_ref, bulk_writer=db.bulk_writer())
+
+
 def create_document(
     collection_name: str, doc_data: dict, db: google.cloud.firestore.Client
 ):
@@ -106,8 +424,9 @@ def create_document(
         int: id of document (0 if not created)
     """
     collection_ref = db.collection(collection_name)
-    _, doc_ref = collection_ref.add(doc_data)
-    print(f"Document created successfully in {collection_name}/{doc_ref.id}.")
+    _, doc_ref = collection_ref.add(stamped(doc_data))
+    _invalidate_path(collection_name, db)
+    logger.info("document created", extra={"collection": collection_name, "doc_id": doc_ref.id})
     return doc_ref.id
 
 
@@ -123,11 +442,240 @@ def edit_document(
         db (google.cloud.firestore.Client):
     """
     doc_ref = db.collection(collection_name).document(doc_id)
-    doc_ref.update(doc_data)
-    print(f"Document updated successfully in {collection_name}/{doc_id}.")
+    doc_ref.update(stamped(doc_data))
+    _invalidate_path(collection_name, db)
+    logger.info("document updated", extra={"collection": collection_name, "doc_id": doc_id})
+
+
+# largest page a client can ask for
+MAX_PAGE_SIZE = 500
+
+
+def parse_page_args(limit: str = None, cursor: str = None):
+    """validate the limit and cursor query parameters of list routes
+
+    Args:
+        limit (str, optional): requested page size, None when not paginated
+        cursor (str, optional): next_cursor of the previous page
+
+    Raises:
+        ValueError: if limit is not a valid page size
+
+    Returns:
+        dict: keyword arguments for the get_all_* functions (empty if not paginated)
+    """
+    if limit is None:
+        return {}
+    limit = int(limit)
+    if limit < 1 or limit > MAX_PAGE_SIZE:
+        raise ValueError(f"limit must be between 1 and {MAX_PAGE_SIZE}.")
+    return {"limit": limit, "cursor": cursor}
+
+
+# most field paths a read can ask for with fields=
+MAX_FIELDS = 20
+_FIELD_PATH = re.compile(r"[A-Za-z_][A-Za-z0-9_]*(\.[A-Za-z_][A-Za-z0-9_]*)*")
+
+
+def parse_fields(fields: str = None):
+    """validate the fields query parameter of read routes, comma separated (dotted) field paths
+
+    Args:
+        fields (str, optional): requested fields, None when the whole documents are wanted
+
+    Raises:
+        ValueError: if a field path is invalid, or there are more than MAX_FIELDS
+
+    Returns:
+        Optional[tuple[str]]: the distinct field paths, sorted, without those inside another one
+    """
+    if fields is None:
+        return None
+    paths = sorted({path.strip() for path in fields.split(",")})
+    if not paths or len(paths) > MAX_FIELDS or not all(_FIELD_PATH.fullmatch(path) for path in paths):
+        raise ValueError(f"fields must be 1 to {MAX_FIELDS} comma separated field names.")
+    # "a" already returns all of "a.b"
+    return tuple(path for path in paths if not any(path.startswith(other + ".") for other in paths))
+
+
+def selected(query, fields=None):
+    """the query reading only fields (firestore select), when fields are given"""
+    return query if fields is None else query.select(fields)
+
+
+def project(document: dict, fields=None):
+    """select() for a document that was read whole: a new dict with only the fields present in it
+
+    Args:
+        document (dict): document data, None if there is no document
+        fields (tuple[str], optional): see parse_fields, None for the whole document. Defaults to None.
+
+    Returns:
+        Optional[dict]: the projected document (document itself when fields is None)
+    """
+    if document is None or fields is None:
+        return document
+    projected = {}
+    for path in fields:
+        parts, value = path.split("."), document
+        for part in parts:
+            if not isinstance(value, dict) or part not in value:
+                break
+            value = value[part]
+        else:
+            parent = projected
+            for part in parts[:-1]:
+                parent = parent.setdefault(part, {})
+            parent[parts[-1]] = value
+    return projected
+
+
+def parse_muscle(muscle: str = None):
+    """validate the muscle query parameter of the exercise list routes
+
+    Args:
+        muscle (str, optional): requested muscle, None when not filtered
+
+    Raises:
+        ValueError: if muscle is not one of recommender.muscles
+
+    Returns:
+        Optional[str]: muscle
+    """
+    if muscle is not None and muscle not in recommender.muscles:
+        raise ValueError(f"muscle must be one of {', '.join(recommender.muscles)}.")
+    return muscle
+
+
+def iter_docs(docs, id_field: str = "id"):
+    """lazily turn document snapshots into dicts, with the document id stored under id_field
+
+    Args:
+        docs (iterable of firebase documents):
+        id_field (str, optional): key for the document id. Defaults to "id".
+
+    Yields:
+        dict:
+    """
+    for doc in docs:
+        doc_data = doc.to_dict()
+        doc_data[id_field] = doc.id
+        yield doc_data
+
+
+def docs_to_list(docs, id_field: str = "id"):
+    """turn document snapshots into dicts, with the document id stored under id_field
+
+    Args:
+        docs (iterable of firebase documents):
+        id_field (str, optional): key for the document id. Defaults to "id".
+
+    Returns:
+        list[dict]:
+    """
+    return list(iter_docs(docs, id_field))
+
+
+def iter_user_collection(
+    uid: str,
+    collection_name: str,
+    db: google.cloud.firestore.Client,
+    id_field: str = "id",
+    fields: tuple = None,
+):
+    """lazily read a collection directly under the user (exercises, workouts, journals, medications, pain)
+    documents are yielded as they arrive from firestore, so nothing is held in memory
+
+    Args:
+        uid (str): uid
+        collection_name (str): name of the collection under users/{uid}
+        db (google.cloud.firestore.Client): firestore client
+        id_field (str, optional): key for the document id. Defaults to "id".
+        fields (tuple[str], optional): only read these fields, see parse_fields. Defaults to None.
+
+    Yields:
+        dict: document data with the document id
+    """
+    collection_ref = db.collection("users").document(uid).collection(collection_name)
+    yield from iter_docs(selected(collection_ref, fields).stream(), id_field)
+
+
+def read_page(collection_ref, limit: int, cursor: str = None, id_field: str = "id"):
+    """read one page of a collection.
+    pages are ordered by document id, so ordering is stable and the cursor is simply the id of
+    the last document of the previous page. one extra document is read to know if there is a next page
+
+    Args:
+        collection_ref (firebase collection):
+        limit (int): max number of documents in the page
+        cursor (str, optional): next_cursor of the previous page, None for the first page
+        id_field (str, optional): key for the document id. Defaults to "id".
+
+    Returns:
+        dict: {"items": list[dict], "next_cursor": str or None when there are no more pages}
+    """
+    query = collection_ref.order_by("__name__")
+    if cursor:
+        query = query.start_after({"__name__": cursor})
+    docs = list(query.limit(limit + 1).stream())
+    next_cursor = docs[limit - 1].id if len(docs) > limit else None
+    return {"items": docs_to_list(docs[:limit], id_field), "next_cursor": next_cursor}
+
+
+### change tracking, read by /sync
+# every document written by the helpers below carries the commit time of its last write
+UPDATED_AT = "updated_at"
+# deleted documents leave a tombstone in users/{uid}/tombstones, kept this long
+# (expire_at is meant for a firestore TTL policy on the tombstones collection group)
+TOMBSTONES = "tombstones"
+TOMBSTONE_RETENTION = timedelta(days=30)
+
+
+def stamped(doc_data: dict):
+    """a copy of doc_data whose updated_at is set to the commit time of the write"""
+    return {**doc_data, UPDATED_AT: firestore.SERVER_TIMESTAMP}
+
+
+def tombstone(uid: str, collection: str, doc_id: str, db, template_id: str = None):
+    """the tombstone left by deleting a document. deleting a template removes its completed
+    workouts too, they get no tombstones of their own
+
+    Args:
+        uid (str): uid
+        collection (str): collection of the deleted document
+        doc_id (str): id of the deleted document
+        db (google.cloud.firestore.Client): firestore client
+        template_id (str, optional): template of a deleted completed workout. Defaults to None.
+
+    Returns:
+        tuple: (DocumentReference, dict) to set
+    """
+    key = ".".join(filter(None, (collection, template_id, doc_id)))
+    data = {
+        "collection": collection,
+        "id": doc_id,
+        "deleted_at": firestore.SERVER_TIMESTAMP,
+        "expire_at": datetime.now(timezone.utc) + TOMBSTONE_RETENTION,
+    }
+    if template_id:
+        data["template_id"] = template_id
+    return db.collection("users").document(uid).collection(TOMBSTONES).document(key), data
+
+
+def delete_with_tombstone(uid: str, collection: str, doc_ref, db, template_id: str = None):
+    """delete a document and leave its tombstone, in one batched write
+
+    Returns:
+        the write results
+    """
+    batch = db.batch()
+    batch.delete(doc_ref)
+    batch.set(*tombstone(uid, collection, doc_ref.id, db, template_id))
+    return batch.commit()
 
 
 ### CRUD for Exercises
+@invalidates("exercises")
 def create_user_exercise(
     uid: str, exercise_data: dict, db: google.cloud.firestore.Client
 ):
@@ -143,11 +691,13 @@ def create_user_exercise(
     """ """"""
 
     exercises_ref = db.collection("users").document(uid).collection("exercises")
-    doc_ref = exercises_ref.add(exercise_data)
-    print(f"Exercise created successfully for user {uid} with ID: {doc_ref[1].id}")
+    doc_ref = exercises_ref.add(stamped(exercise_data))
+    exercise_index.added(uid, doc_ref[1].id, exercise_data)
+    logger.info("exercise created", extra={"uid": uid, "exercise_id": doc_ref[1].id})
     return doc_ref[1].id
 
 
+@cached_read("exercises")
 def get_user_exercise(uid: str, exercise_id: str, db: google.cloud.firestore.Client):
     """Retrieve details of a specific exercise for a user.
 
@@ -172,27 +722,104 @@ def get_user_exercise(uid: str, exercise_id: str, db: google.cloud.firestore.Cli
     return None
 
 
-def get_all_user_exercises(uid: str, db: google.cloud.firestore.Client):
+def exercises_query(uid: str, db, muscle: str = None):
+    """the user's exercises, only those of muscle when it is given (an equality query served by
+    firestore's single field index, also when paginated by document id)
+
+    Args:
+        uid (str): uid
+        db (google.cloud.firestore.Client): firestore client
+        muscle (str, optional): one of recommender.muscles. Defaults to None.
+
+    Returns:
+        query or collection reference
+    """
+    exercises_ref = db.collection("users").document(uid).collection("exercises")
+    if muscle is None:
+        return exercises_ref
+    return exercises_ref.where(filter=firestore.FieldFilter("muscle", "==", muscle))
+
+
+@cached_read("exercises")
+def get_all_user_exercises(
+    uid: str,
+    db: google.cloud.firestore.Client,
+    limit: int = None,
+    cursor: str = None,
+    muscle: str = None,
+    fields: tuple = None,
+):
     """Retrieve all exercises for a user.
 
     Args:
         uid (str): The unique identifier of the user.
         db (google.cloud.firestore.Client): Firestore client instance.
+        limit (int, optional): page size; when given, only one page is returned. Defaults to None.
+        cursor (str, optional): next_cursor of the previous page. Defaults to None.
+        muscle (str, optional): only the exercises of this muscle. Defaults to None.
+        fields (tuple[str], optional): only read these fields, see parse_fields. Defaults to None.
 
     Returns:
         List[Dict]: A list of dictionaries containing the details of all exercises for the user.
+            (or a read_page dict when limit is given)
     """
 
-    exercises_ref = db.collection("users").document(uid).collection("exercises")
-    exercise_docs = exercises_ref.stream()
-    exercise_list = []
-    for doc in exercise_docs:
-        exercise_data = doc.to_dict()
-        exercise_data["id"] = doc.id
-        exercise_list.append(exercise_data)
-    return exercise_list
+    exercises_ref = selected(exercises_query(uid, db, muscle), fields)
+    if limit is not None:
+        return read_page(exercises_ref, limit, cursor)
+    return docs_to_list(exercises_ref.stream())
+
+
+def iter_user_exercises(
+    uid: str, db: google.cloud.firestore.Client, muscle: str = None, fields: tuple = None
+):
+    """lazily read the user's exercises, see iter_user_collection and exercises_query
+
+    Yields:
+        dict: exercise with its id
+    """
+    yield from iter_docs(selected(exercises_query(uid, db, muscle), fields).stream())
+
+
+def _exercise_documents(exercise_docs):
+    return [(doc.id, doc.to_dict()) for doc in exercise_docs]
+
+
+def search_user_exercises(
+    uid: str,
+    prefix: str,
+    db: google.cloud.firestore.Client,
+    muscle: str = None,
+    limit: int = exercise_index.SEARCH_LIMIT,
+    fields: tuple = None,
+):
+    """search the user's and the premade exercises by name prefix, see exercise_index.
+    the user's exercises are read once per INDEX_TTL, the premade ones once per process
+
+    Args:
+        uid (str): uid
+        prefix (str): normalized name prefix, see exercise_index.parse_search
+        db (google.cloud.firestore.Client): firestore client
+        muscle (str, optional): only the exercises of this muscle. Defaults to None.
+        limit (int, optional): max number of results. Defaults to exercise_index.SEARCH_LIMIT.
+        fields (tuple[str], optional): only return these fields, see parse_fields. Defaults to None.
+
+    Returns:
+        list[dict]: exercises with their id and source ("user" or "premade"), the user's first
+    """
+    user = exercise_index.user_index(uid, lambda: _exercise_documents(exercises_query(uid, db).stream()))
+    premades = exercise_index.premade_index(get_premade_tree(PREMADE_COLLECTIONS[0][0], db))
+    return projected_results(exercise_index.search(prefix, user, premades, muscle, limit), fields)
 
 
+def projected_results(results, fields=None, keep=("id", "source")):
+    """project search results, keeping the keys that are not document fields"""
+    if fields is None:
+        return results
+    return [{**project(result, fields), **{key: result[key] for key in keep}} for result in results]
+
+
+@invalidates("exercises")
 def update_user_exercise(
     uid: str, exercise_id: str, exercise_data: dict, db: google.cloud.firestore.Client
 ):
@@ -212,10 +839,12 @@ def update_user_exercise(
         .collection("exercises")
         .document(exercise_id)
     )
-    exercises_ref.update(exercise_data)
-    print(f"Exercise with ID {exercise_id} updated successfully for user {uid}.")
+    exercises_ref.update(stamped(exercise_data))
+    exercise_index.updated(uid, exercise_id, exercise_data)
+    logger.info("exercise updated", extra={"uid": uid, "exercise_id": exercise_id})
 
 
+@invalidates("exercises")
 def delete_user_exercise(uid: str, exercise_id: str, db: google.cloud.firestore.Client):
     """Delete a specific exercise for a user.
     Args:
@@ -230,11 +859,13 @@ def delete_user_exercise(uid: str, exercise_id: str, db: google.cloud.firestore.
         .collection("exercises")
         .document(exercise_id)
     )
-    exercises_ref.delete()
-    print(f"Exercise with ID {exercise_id} deleted successfully for user {uid}.")
+    delete_with_tombstone(uid, "exercises", exercises_ref, db)
+    exercise_index.removed(uid, exercise_id)
+    logger.info("exercise deleted", extra={"uid": uid, "exercise_id": exercise_id})
 
 
 ### CRUD for Workouts
+@invalidates("workouts")
 def create_template_workout(
     uid: str, template_data: dict, db: google.cloud.firestore.Client
 ):
@@ -250,13 +881,12 @@ def create_template_workout(
     """
 
     workouts_ref = db.collection("users").document(uid).collection("workouts")
-    doc_ref = workouts_ref.add(template_data)
-    print(
-        f"Template workout created successfully for user {uid} with ID: {doc_ref[1].id}"
-    )
+    doc_ref = workouts_ref.add(stamped(template_data))
+    logger.info("template workout created", extra={"uid": uid, "template_id": doc_ref[1].id})
     return doc_ref[1].id
 
 
+@cached_read("workouts")
 def get_template_workout(uid: str, template_id: str, db: google.cloud.firestore.Client):
     """Retrieve a specific template workout.
 
@@ -281,6 +911,7 @@ def get_template_workout(uid: str, template_id: str, db: google.cloud.firestore.
     return None
 
 
+@invalidates("workouts")
 def update_template_workout(
     uid: str, template_id: str, template_data: dict, db: google.cloud.firestore.Client
 ):
@@ -298,10 +929,11 @@ def update_template_workout(
         .collection("workouts")
         .document(template_id)
     )
-    workouts_ref.update(template_data)
-    print(f"Template workout {template_id} updated successfully for user {uid}.")
+    workouts_ref.update(stamped(template_data))
+    logger.info("template workout updated", extra={"uid": uid, "template_id": template_id})
 
 
+@invalidates("workouts", "completed")
 def delete_template_workout(
     uid: str, template_id: str, db: google.cloud.firestore.Client
 ):
@@ -319,40 +951,50 @@ def delete_template_workout(
         .collection("workouts")
         .document(template_id)
     )
-    completed_ref = workouts_ref.collection("Completed_workouts")
-    completed_docs = completed_ref.stream()
-    for doc in completed_docs:
-        doc.reference.delete()
-    workouts_ref.delete()
-    print(
-        f"Template workout {template_id} and its completed workouts deleted successfully for user {uid}."
+    deleted = delete_document_recursive(workouts_ref, db)
+    tombstone_ref, tombstone_data = tombstone(uid, "workouts", template_id, db)
+    tombstone_ref.set(tombstone_data)
+    if deleted > 1:
+        # its completed workouts were deleted with it
+        muscle_load.catch_up(uid, db, rebuild=True)
+    logger.info(
+        "template workout deleted",
+        extra={"uid": uid, "template_id": template_id, "deleted": deleted},
     )
 
 
-def get_all_template_workouts(uid: str, db: google.cloud.firestore.Client):
+@cached_read("workouts")
+def get_all_template_workouts(
+    uid: str,
+    db: google.cloud.firestore.Client,
+    limit: int = None,
+    cursor: str = None,
+    fields: tuple = None,
+):
     """Retrieve all of users workout templates
 
     Args:
         uid (str): user id
         db (google.cloud.firestore.Client): firestore client
+        limit (int, optional): page size; when given, only one page is returned. Defaults to None.
+        cursor (str, optional): next_cursor of the previous page. Defaults to None.
+        fields (tuple[str], optional): only read these fields, see parse_fields. Defaults to None.
 
     Returns:
-        list[dict]: list of templates
+        list[dict]: list of templates (or a read_page dict when limit is given)
     """
-    workouts_ref = db.collection("users").document(uid).collection("workouts")
-    template_docs = workouts_ref.stream()
-    template_list = []
-    for doc in template_docs:
-        template_data = doc.to_dict()
-        template_data["id"] = doc.id
-        template_list.append(template_data)
-    return template_list
+    workouts_ref = selected(db.collection("users").document(uid).collection("workouts"), fields)
+    if limit is not None:
+        return read_page(workouts_ref, limit, cursor)
+    return docs_to_list(workouts_ref.stream())
 
 
+@invalidates("completed", bump=False)
 def create_completed_workout(
     uid: str, template_id: str, completed_data: dict, db: google.cloud.firestore.Client
 ):
-    """Create new completed workout associated with template
+    """Create new completed workout associated with template, and add its sets to the
+    user's muscle load and bump the collection version in the same transaction
 
     Args:
         uid (str): uid
@@ -370,13 +1012,23 @@ def create_completed_workout(
         .document(template_id)
         .collection("completed")
     )
-    doc_ref = completed_ref.add(completed_data)
-    print(
-        f"Completed workout created successfully for user {uid} under template {template_id} with ID: {doc_ref[1].id}"
+    doc_ref = completed_ref.document()
+
+    @firestore.transactional
+    def create(transaction):
+        muscle_load.update(transaction, uid, db, added=[((template_id, doc_ref.id), completed_data)])
+        transaction.create(doc_ref, stamped(completed_data))
+        transaction.set(*version_bump(uid, ("completed",), db))
+
+    create(db.transaction())
+    logger.info(
+        "completed workout created",
+        extra={"uid": uid, "template_id": template_id, "completed_id": doc_ref.id},
     )
-    return doc_ref[1].id
+    return doc_ref.id
 
 
+@cached_read("completed")
 def get_completed_workout(
     uid: str, template_id: str, completed_id: str, db: google.cloud.firestore.Client
 ):
@@ -405,8 +1057,38 @@ def get_completed_workout(
     return None
 
 
+def iter_completed_workouts(
+    uid: str, template_id: str, db: google.cloud.firestore.Client, fields: tuple = None
+):
+    """lazily read the completed workouts of a template, see iter_user_collection
+
+    Args:
+        uid (str): uid
+        template_id (str): template id
+        db (google.cloud.firestore.Client): firestore client
+        fields (tuple[str], optional): only read these fields, see parse_fields. Defaults to None.
+
+    Yields:
+        dict: completed workout with its id
+    """
+    completed_ref = (
+        db.collection("users")
+        .document(uid)
+        .collection("workouts")
+        .document(template_id)
+        .collection("completed")
+    )
+    yield from iter_docs(selected(completed_ref, fields).stream())
+
+
+@cached_read("completed")
 def get_all_completed_workouts(
-    uid: str, template_id: str, db: google.cloud.firestore.Client
+    uid: str,
+    template_id: str,
+    db: google.cloud.firestore.Client,
+    limit: int = None,
+    cursor: str = None,
+    fields: tuple = None,
 ):
     """Get all completed workouts associated with template id
 
@@ -414,9 +1096,12 @@ def get_all_completed_workouts(
         uid (str): uid
         template_id (str): tempalte id
         db (google.cloud.firestore.Client): firestore lcient
+        limit (int, optional): page size; when given, only one page is returned. Defaults to None.
+        cursor (str, optional): next_cursor of the previous page. Defaults to None.
+        fields (tuple[str], optional): only read these fields, see parse_fields. Defaults to None.
 
     Returns:
-        List[dict]: list of all associated completed workout
+        List[dict]: list of all associated completed workout (or a read_page dict when limit is given)
     """
     completed_ref = (
         db.collection("users")
@@ -425,40 +1110,51 @@ def get_all_completed_workouts(
         .document(template_id)
         .collection("completed")
     )
-    completed_docs = completed_ref.stream()
-    completed_list = []
-    for doc in completed_docs:
-        completed_data = doc.to_dict()
-        completed_data["id"] = doc.id
-        completed_list.append(completed_data)
-    return completed_list
+    completed_ref = selected(completed_ref, fields)
+    if limit is not None:
+        return read_page(completed_ref, limit, cursor)
+    return docs_to_list(completed_ref.stream())
 
 
-def get_all_completed_workouts_all(uid: str, db: google.cloud.firestore.Client):
+@cached_read("completed")
+def get_all_completed_workouts_all(uid: str, db: google.cloud.firestore.Client, fields: tuple = None):
     """Retrieve all completed workouts for all templates
+    uses a single collection group read scoped to the user instead of reading every template
 
     Args:
         uid (str): uid
         db (google.cloud.firestore.Client): firestore client
+        fields (tuple[str], optional): only read these fields, see parse_fields. Defaults to None.
 
     Returns:
-        list[dict]: list of all completed workouts, represented with a dict
+        list[dict]: list of all completed workouts, represented with a dict (with template_id)
     """
-    workouts_ref = db.collection("users").document(uid).collection("workouts")
-    template_docs = workouts_ref.stream()
-    completed_list = []
-    for doc in template_docs:
-        template_data = doc.to_dict()
-        template_data["id"] = doc.id
-        completed_ref = workouts_ref.document(doc.id).collection("completed")
-        completed_docs = completed_ref.stream()
-        for completed_doc in completed_docs:
-            completed_data = completed_doc.to_dict()
-            completed_data["id"] = completed_doc.id
-            completed_list.append(completed_data)
-    return completed_list
+    return list(iter_all_completed_workouts(uid, db, fields))
+
+
+def iter_all_completed_workouts(uid: str, db: google.cloud.firestore.Client, fields: tuple = None):
+    """lazily read all completed workouts for all templates, see get_all_completed_workouts_all
+
+    Args:
+        uid (str): uid
+        db (google.cloud.firestore.Client): firestore client
+        fields (tuple[str], optional): only read these fields, see parse_fields. Defaults to None.
+
+    Yields:
+        dict: completed workout with its id and template_id
+    """
+    yield from completed_with_template(selected(completed_query(uid, db), fields).stream())
+
+
+def completed_with_template(completed_docs):
+    for completed_doc in completed_docs:
+        completed_data = completed_doc.to_dict()
+        completed_data["id"] = completed_doc.id
+        completed_data["template_id"] = completed_doc.reference.parent.parent.id
+        yield completed_data
 
 
+@invalidates("completed", bump=False)
 def update_completed_workout(
     uid: str,
     template_id: str,
@@ -467,7 +1163,8 @@ def update_completed_workout(
     db: google.cloud.firestore.Client,
 ):
     """Update completed workout
-    usually for when you want to add pain
+    usually for when you want to add pain. the muscle load and the collection version are updated
+    in the same transaction
 
     Args:
         uid (str): uid
@@ -475,6 +1172,9 @@ def update_completed_workout(
         completed_id (str): cid
         completed_data (dict): the new completed workout data to be added
         db (google.cloud.firestore.Client): firestore client
+
+    Raises:
+        google.api_core.exceptions.NotFound: if the completed workout does not exist
     """
 
     completed_ref = (
@@ -485,16 +1185,29 @@ def update_completed_workout(
         .collection("completed")
         .document(completed_id)
     )
-    completed_ref.update(completed_data)
-    print(
-        f"Completed workout {completed_id} updated successfully for user {uid} under template {template_id}."
+    key = (template_id, completed_id)
+
+    @firestore.transactional
+    def update(transaction):
+        stored = completed_ref.get(transaction=transaction).to_dict()
+        if stored is not None:
+            muscle_load.update(transaction, uid, db, removed=[(key, stored)], added=[(key, {**stored, **completed_data})])
+        transaction.update(completed_ref, stamped(completed_data))
+        transaction.set(*version_bump(uid, ("completed",), db))
+
+    update(db.transaction())
+    logger.info(
+        "completed workout updated",
+        extra={"uid": uid, "template_id": template_id, "completed_id": completed_id},
     )
 
 
+@invalidates("completed", bump=False)
 def delete_completed_workout(
     uid: str, template_id: str, completed_id: str, db: google.cloud.firestore.Client
 ):
-    """Delete specific completed workout
+    """Delete specific completed workout, and take it out of the muscle load and bump the collection
+    version in the same transaction
 
     Args:
         uid (str): uid
@@ -510,12 +1223,142 @@ def delete_completed_workout(
         .collection("completed")
         .document(completed_id)
     )
-    completed_ref.delete()
-    print(
-        f"Completed workout {completed_id} deleted successfully for user {uid} under template {template_id}."
+
+    @firestore.transactional
+    def delete(transaction):
+        stored = completed_ref.get(transaction=transaction).to_dict()
+        if stored is not None:
+            muscle_load.update(transaction, uid, db, removed=[((template_id, completed_id), stored)])
+        transaction.delete(completed_ref)
+        transaction.set(*tombstone(uid, "completed", completed_id, db, template_id))
+        transaction.set(*version_bump(uid, ("completed",), db))
+
+    delete(db.transaction())
+    logger.info(
+        "completed workout deleted",
+        extra={"uid": uid, "template_id": template_id, "completed_id": completed_id},
     )
 
 
+@cached_read("pain")
+def get_all_pain(
+    uid: str,
+    db: google.cloud.firestore.Client,
+    limit: int = None,
+    cursor: str = None,
+    fields: tuple = None,
+):
+    """get all pain notes for a user
+
+    Args:
+        uid (str): uid
+        db (google.cloud.firestore.Client): firestore client
+        limit (int, optional): page size; when given, only one page is returned. Defaults to None.
+        cursor (str, optional): next_cursor of the previous page. Defaults to None.
+        fields (tuple[str], optional): only read these fields, see parse_fields. Defaults to None.
+
+    Returns:
+        list[dict]: list of pain notes, with the document id as hash_id
+            (or a read_page dict when limit is given)
+    """
+    pain_ref = selected(db.collection("users").document(uid).collection("pain"), fields)
+    if limit is not None:
+        return read_page(pain_ref, limit, cursor, id_field="hash_id")
+    return docs_to_list(pain_ref.stream(), id_field="hash_id")
+
+
+@invalidates("pain", bump=False)
+def create_pain(uid: str, pain_data: dict, db: google.cloud.firestore.Client):
+    """Create new pain note, and count it in the pain summary and bump the collection version in the
+    same transaction
+
+    Args:
+        uid (str): uid
+        pain_data (dict): date, pain_level and body_part of the note
+        db (google.cloud.firestore.Client): firestore client
+
+    Returns:
+        str: id (hash_id) of the new note
+    """
+    doc_ref = db.collection("users").document(uid).collection("pain").document()
+
+    @firestore.transactional
+    def create(transaction):
+        pain_summary.update(transaction, uid, db, added=[(doc_ref.id, pain_data)])
+        transaction.create(doc_ref, stamped(pain_data))
+        transaction.set(*version_bump(uid, ("pain",), db))
+
+    create(db.transaction())
+    logger.info("pain note created", extra={"uid": uid, "hash_id": doc_ref.id})
+    return doc_ref.id
+
+
+@invalidates("pain", bump=False)
+def update_pain(uid: str, hash_id: str, updates: dict, db: google.cloud.firestore.Client):
+    """Update existing pain note, and the pain summary and the collection version in the same
+    transaction
+
+    Args:
+        uid (str): uid
+        hash_id (str): pain note id
+        updates (dict): fields to change
+        db (google.cloud.firestore.Client): firestore client
+
+    Returns:
+        bool: False if the note does not exist
+    """
+    pain_doc_ref = db.collection("users").document(uid).collection("pain").document(hash_id)
+
+    @firestore.transactional
+    def update(transaction):
+        snapshot = pain_doc_ref.get(transaction=transaction)
+        if not snapshot.exists:
+            return False
+        note = snapshot.to_dict()
+        pain_summary.update(transaction, uid, db, removed=[(hash_id, note)], added=[(hash_id, {**note, **updates})])
+        transaction.update(pain_doc_ref, stamped(updates))
+        transaction.set(*version_bump(uid, ("pain",), db))
+        return True
+
+    if not update(db.transaction()):
+        return False
+    logger.info("pain note updated", extra={"uid": uid, "hash_id": hash_id})
+    return True
+
+
+@invalidates("pain", bump=False)
+def delete_pain(uid: str, hash_id: str, db: google.cloud.firestore.Client):
+    """Delete specific pain note, and take it out of the pain summary and bump the collection version
+    in the same transaction
+
+    Args:
+        uid (str): uid
+        hash_id (str): pain note id
+        db (google.cloud.firestore.Client): firestore client
+
+    Returns:
+        bool: False if the note does not exist
+    """
+    pain_doc_ref = db.collection("users").document(uid).collection("pain").document(hash_id)
+
+    @firestore.transactional
+    def delete(transaction):
+        snapshot = pain_doc_ref.get(transaction=transaction)
+        if not snapshot.exists:
+            return False
+        pain_summary.update(transaction, uid, db, removed=[(hash_id, snapshot.to_dict())])
+        transaction.delete(pain_doc_ref)
+        transaction.set(*tombstone(uid, "pain", hash_id, db))
+        transaction.set(*version_bump(uid, ("pain",), db))
+        return True
+
+    if not delete(db.transaction()):
+        return False
+    logger.info("pain note deleted", extra={"uid": uid, "hash_id": hash_id})
+    return True
+
+
+@invalidates("journals")
 def create_journal(uid: str, journal_data: dict, db: google.cloud.firestore.Client):
     """Create new journal entry
 
@@ -528,31 +1371,39 @@ def create_journal(uid: str, journal_data: dict, db: google.cloud.firestore.Clie
         str: id of created note
     """
     journal_ref = db.collection("users").document(uid).collection("journals")
-    doc_ref = journal_ref.add(journal_data)
-    print(f"Journal entry created successfully for user {uid} with ID: {doc_ref[1].id}")
+    doc_ref = journal_ref.add(stamped(journal_data))
+    logger.info("journal entry created", extra={"uid": uid, "journal_id": doc_ref[1].id})
     return doc_ref[1].id
 
 
-def get_all_journals(uid: str, db: google.cloud.firestore.Client):
+@cached_read("journals")
+def get_all_journals(
+    uid: str,
+    db: google.cloud.firestore.Client,
+    limit: int = None,
+    cursor: str = None,
+    fields: tuple = None,
+):
     """get all journal entries for a user
 
     Args:
         uid (str): uid
         db (google.cloud.firestore.Client): firestore client
+        limit (int, optional): page size; when given, only one page is returned. Defaults to None.
+        cursor (str, optional): next_cursor of the previous page. Defaults to None.
+        fields (tuple[str], optional): only read these fields, see parse_fields. Defaults to None.
 
     Returns:
         list[dict]: list of all journal entries, each represented as dict
+            (or a read_page dict when limit is given)
     """
-    journal_ref = db.collection("users").document(uid).collection("journals")
-    journal_docs = journal_ref.stream()
-    journal_list = []
-    for doc in journal_docs:
-        journal_data = doc.to_dict()
-        journal_data["id"] = doc.id
-        journal_list.append(journal_data)
-    return journal_list
+    journal_ref = selected(db.collection("users").document(uid).collection("journals"), fields)
+    if limit is not None:
+        return read_page(journal_ref, limit, cursor)
+    return docs_to_list(journal_ref.stream())
 
 
+@invalidates("journals")
 def delete_journal(uid: str, journal_id: str, db: google.cloud.firestore.Client):
     """Delete specific journal entry
 
@@ -564,10 +1415,11 @@ def delete_journal(uid: str, journal_id: str, db: google.cloud.firestore.Client)
     journal_ref = (
         db.collection("users").document(uid).collection("journals").document(journal_id)
     )
-    journal_ref.delete()
-    print(f"Journal entry {journal_id} deleted successfully for user {uid}.")
+    delete_with_tombstone(uid, "journals", journal_ref, db)
+    logger.info("journal entry deleted", extra={"uid": uid, "journal_id": journal_id})
 
 
+@invalidates("medications")
 def create_medication(
     uid: str, medication_data: dict, db: google.cloud.firestore.Client
 ):
@@ -583,33 +1435,39 @@ def create_medication(
     """
 
     medication_ref = db.collection("users").document(uid).collection("medications")
-    doc_ref = medication_ref.add(medication_data)
-    print(
-        f"Medication entry created successfully for user {uid} with ID: {doc_ref[1].id}"
-    )
+    doc_ref = medication_ref.add(stamped(medication_data))
+    logger.info("medication entry created", extra={"uid": uid, "medication_id": doc_ref[1].id})
     return doc_ref[1].id
 
 
-def get_all_medications(uid: str, db: google.cloud.firestore.Client):
+@cached_read("medications")
+def get_all_medications(
+    uid: str,
+    db: google.cloud.firestore.Client,
+    limit: int = None,
+    cursor: str = None,
+    fields: tuple = None,
+):
     """Retrieve all medication entries for user
 
     Args:
         uid (str): UID
         db (google.cloud.firestore.Client): firestore client
+        limit (int, optional): page size; when given, only one page is returned. Defaults to None.
+        cursor (str, optional): next_cursor of the previous page. Defaults to None.
+        fields (tuple[str], optional): only read these fields, see parse_fields. Defaults to None.
 
     Returns:
         list[dict]: list of all medication entries, each represented as a dict
+            (or a read_page dict when limit is given)
     """
-    medication_ref = db.collection("users").document(uid).collection("medications")
-    medication_docs = medication_ref.stream()
-    medication_list = []
-    for doc in medication_docs:
-        medication_data = doc.to_dict()
-        medication_data["id"] = doc.id
-        medication_list.append(medication_data)
-    return medication_list
+    medication_ref = selected(db.collection("users").document(uid).collection("medications"), fields)
+    if limit is not None:
+        return read_page(medication_ref, limit, cursor)
+    return docs_to_list(medication_ref.stream())
 
 
+@invalidates("medications")
 def delete_medication(uid: str, medication_id: str, db: google.cloud.firestore.Client):
     """Delete a specific medication entry.
 
@@ -625,6 +1483,489 @@ def delete_medication(uid: str, medication_id: str, db: google.cloud.firestore.C
         .collection("medications")
         .document(medication_id)
     )
-    medication_ref.delete()
-    print(f"Medication entry {medication_id} deleted successfully for user {uid}.")
+    delete_with_tombstone(uid, "medications", medication_ref, db)
+    logger.info("medication entry deleted", extra={"uid": uid, "medication_id": medication_id})
+
+
+### validation shared by the single, batch and bulk routes
+def check_pain_level(pain_level):
+    """
+    Raises:
+        ValueError: unless pain_level is an integer between 1 and 10
+    """
+    if not isinstance(pain_level, int) or pain_level < 1 or pain_level > 10:
+        raise ValueError("Pain level must be an integer between 1 and 10.")
+
+
+def pain_document(pain_data: dict, partial: bool = False):
+    """the stored fields of a pain note, validated like /add-pain (or /edit-pain when partial)
+
+    Args:
+        pain_data (dict): date, pain_level and body_part
+        partial (bool, optional): only validate and keep the fields present. Defaults to False.
+
+    Raises:
+        ValueError: if pain_data is not an object or pain_level is invalid
+
+    Returns:
+        dict: date, pain_level and body_part (only the ones given when partial)
+    """
+    if not isinstance(pain_data, dict):
+        raise ValueError("Pain note must be an object.")
+    if not partial or pain_data.get("pain_level") is not None:
+        check_pain_level(pain_data.get("pain_level"))
+    fields = ("date", "pain_level", "body_part")
+    if partial:
+        return {field: pain_data[field] for field in fields if pain_data.get(field)}
+    return {field: pain_data.get(field) for field in fields}
+
+
+### batched writes
+# collections a batch operation can target, "completed" also needs the template_id
+BATCH_COLLECTIONS = ("exercises", "workouts", "completed", "pain", "journals", "medications")
+BATCH_OPS = ("create", "update", "delete")
+
+
+class BatchError(ValueError):
+    """invalid batch operations, nothing was written
+
+    Attributes:
+        errors (list[dict]): {"index", "error"} for every invalid operation
+    """
+
+    def __init__(self, errors):
+        super().__init__(f"{len(errors)} invalid operation(s), nothing was written.")
+        self.errors = errors
+
+
+def _user_collection_ref(uid: str, collection: str, db, template_id: str = None):
+    """users/{uid}/{collection}, or the completed workouts of template_id"""
+    user_ref = db.collection("users").document(uid)
+    if collection == "completed":
+        return user_ref.collection("workouts").document(template_id).collection("completed")
+    return user_ref.collection(collection)
+
+
+def _validate_operation(operation):
+    """raises ValueError describing what is wrong with one batch operation"""
+    if not isinstance(operation, dict):
+        raise ValueError("Operation must be an object.")
+    op, collection = operation.get("op"), operation.get("collection")
+    if op not in BATCH_OPS:
+        raise ValueError(f"op must be one of {', '.join(BATCH_OPS)}.")
+    if collection not in BATCH_COLLECTIONS:
+        raise ValueError(f"collection must be one of {', '.join(BATCH_COLLECTIONS)}.")
+    if collection == "completed" and not operation.get("template_id"):
+        raise ValueError("template_id is required for completed workouts.")
+    if op in ("update", "delete") and not operation.get("id"):
+        raise ValueError(f"id is required to {op}.")
+    if op == "delete" and collection == "workouts":
+        # a template owns its completed workouts, which a batch cannot enumerate
+        raise ValueError("Templates are deleted with DELETE /users/<uid>/workouts/<template_id>.")
+    if op in ("create", "update"):
+        data = operation.get("data")
+        if not isinstance(data, dict) or (op == "update" and not data):
+            raise ValueError("data must be a non empty object.")
+        if collection == "pain" and not pain_document(data, partial=op == "update"):
+            raise ValueError("data has no pain note fields to update.")
+
+
+def plan_batch(uid: str, operations, db: google.cloud.firestore.Client):
+    """validate every operation, then queue all of them on one WriteBatch, with the version bump of
+    the collections they write. ids of created documents are generated up front, so they are known
+    before the commit
+
+    an operation is {"op": "create" | "update" | "delete", "collection": one of BATCH_COLLECTIONS,
+    "id": document id (update / delete), "template_id": template (completed workouts), "data": fields
+    (create / update)}. pain notes are validated like /add-pain and /edit-pain
+
+    Args:
+        uid (str): uid
+        operations (list[dict]): at most BATCH_LIMIT - 1 writes (the version bump is the last one),
+            a delete counts twice
+        db (google.cloud.firestore.Client): firestore client
+
+    Raises:
+        BatchError: if any operation is invalid (with the errors of all of them)
+
+    Returns:
+        tuple: (the batch to commit, one {"index", "op", "collection", "id"} per operation,
+            set of the collections written)
+    """
+    if not isinstance(operations, list) or not operations:
+        raise BatchError([{"index": None, "error": "operations must be a non empty list."}])
+    if len(operations) > BATCH_LIMIT:
+        raise BatchError([{"index": None, "error": f"At most {BATCH_LIMIT} operations per batch."}])
+    errors = []
+    for index, operation in enumerate(operations):
+        try:
+            _validate_operation(operation)
+        except ValueError as e:
+            errors.append({"index": index, "error": str(e)})
+    if errors:
+        raise BatchError(errors)
+    # a delete also writes its tombstone, and the batch bumps the collection versions
+    writes = len(operations) + sum(operation["op"] == "delete" for operation in operations) + 1
+    if writes > BATCH_LIMIT:
+        raise BatchError([{
+            "index": None,
+            "error": f"At most {BATCH_LIMIT - 1} writes per batch, deletes count twice (tombstones).",
+        }])
+
+    batch = db.batch()
+    results, collections = [], set()
+    for index, operation in enumerate(operations):
+        op, collection = operation["op"], operation["collection"]
+        collection_ref = _user_collection_ref(uid, collection, db, operation.get("template_id"))
+        doc_ref = collection_ref.document(operation.get("id") if op != "create" else None)
+
+        data = operation.get("data")
+        if collection == "pain" and op != "delete":
+            data = pain_document(data, partial=op == "update")
+        if op == "create":
+            batch.set(doc_ref, stamped(data))
+        elif op == "update":
+            batch.update(doc_ref, stamped(data))
+        else:
+            batch.delete(doc_ref)
+            batch.set(*tombstone(uid, collection, doc_ref.id, db, operation.get("template_id")))
+        collections.add(collection)
+        results.append({"index": index, "op": op, "collection": collection, "id": doc_ref.id})
+    batch.set(*version_bump(uid, collections, db))
+    return batch, results, collections
+
+
+def commit_batch(uid: str, operations, db: google.cloud.firestore.Client):
+    """apply create / update / delete operations across the user's collections atomically,
+    in one batched write (see plan_batch)
+
+    Args:
+        uid (str): uid
+        operations (list[dict]): see plan_batch
+        db (google.cloud.firestore.Client): firestore client
+
+    Raises:
+        BatchError: if any operation is invalid, nothing is written
+        google.api_core.exceptions.NotFound: if a document to update does not exist, nothing is written
+
+    Returns:
+        list[dict]: {"index", "op", "collection", "id"} per operation
+    """
+    batch, results, collections = plan_batch(uid, operations, db)
+    try:
+        batch.commit()
+    finally:
+        user_cache.invalidate(uid, *collections)
+        if "exercises" in collections:
+            exercise_index.forget(uid)
+    if "pain" in collections:
+        pain_summary.catch_up(uid, db, *batch_pain_changes(operations, results))
+    if "completed" in collections:
+        muscle_load.catch_up(uid, db, *batch_completed_changes(operations, results))
+    logger.info("batch committed", extra={"uid": uid, "operations": len(results)})
+    return results
+
+
+def batch_completed_changes(operations, results):
+    """what a committed batch did to completed workouts, for muscle_load.catch_up
+
+    Returns:
+        tuple: (((template id, id), workout) of the created workouts, whether workouts were edited or deleted)
+    """
+    completed = [(result, operations[result["index"]]) for result in results if result["collection"] == "completed"]
+    created = [
+        ((operation["template_id"], result["id"]), operation["data"])
+        for result, operation in completed
+        if result["op"] == "create"
+    ]
+    return created, len(created) < len(completed)
+
+
+def batch_pain_changes(operations, results):
+    """what a committed batch did to pain notes, for pain_summary.catch_up
+
+    Returns:
+        tuple: ((id, note) of the created notes, whether notes were edited or deleted)
+    """
+    pain = [(result, operations[result["index"]]) for result in results if result["collection"] == "pain"]
+    created = [(result["id"], pain_document(operation["data"])) for result, operation in pain if result["op"] == "create"]
+    return created, len(created) < len(pain)
+
+
+### bulk imports
+# records accepted by one bulk import request
+BULK_IMPORT_LIMIT = 10_000
+BULK_COLLECTIONS = ("pain", "completed")
+
+
+def parse_records(body: bytes, ndjson: bool = False):
+    """the records of a bulk import body: a json array (or {"records": [...]}), or ndjson with one
+    record per line. ndjson lines that are not json are kept as the ValueError describing them, so
+    they are reported at their index like any other invalid record
+
+    Args:
+        body (bytes): request body
+        ndjson (bool, optional): body is ndjson. Defaults to False.
+
+    Raises:
+        ValueError: if the body holds no records, too many, or is not a json array
+
+    Returns:
+        list: records
+    """
+    if ndjson:
+        records = []
+        for line in filter(None, (line.strip() for line in body.splitlines())):
+            try:
+                records.append(json.loads(line))
+            except ValueError as e:
+                records.append(ValueError(f"Invalid json: {e}"))
+    else:
+        try:
+            records = json.loads(body) if body else None
+        except ValueError as e:
+            raise ValueError(f"Invalid json: {e}") from None
+        if isinstance(records, dict):
+            records = records.get("records")
+        if not isinstance(records, list):
+            raise ValueError("Body must be a json array of records or ndjson.")
+    if not records:
+        raise ValueError("No records to import.")
+    if len(records) > BULK_IMPORT_LIMIT:
+        raise ValueError(f"At most {BULK_IMPORT_LIMIT} records per import.")
+    return records
+
+
+def _import_document(collection: str, record):
+    """the document stored for one imported record, validated like the single record route"""
+    if isinstance(record, ValueError):
+        raise record
+    if collection == "pain":
+        return pain_document(record)
+    if not isinstance(record, dict) or not record:
+        raise ValueError("Completed workout must be a non empty object.")
+    return record
+
+
+def plan_import(uid: str, collection: str, records, db, template_id: str = None):
+    """validate every record and split the valid ones into batches of at most BATCH_LIMIT writes.
+    ids are generated up front, so every record has its id or its error before anything is written
+
+    Args:
+        uid (str): uid
+        collection (str): "pain" or "completed"
+        records (list): see parse_records
+        db (google.cloud.firestore.Client): firestore client
+        template_id (str, optional): template of completed workouts. Defaults to None.
+
+    Returns:
+        tuple: (list of batches of (index, doc_ref, data), one {"index", "id"} or {"index", "error"}
+            per record)
+    """
+    if collection not in BULK_COLLECTIONS:
+        raise ValueError(f"collection must be one of {', '.join(BULK_COLLECTIONS)}.")
+    collection_ref = _user_collection_ref(uid, collection, db, template_id)
+    writes, results = [], []
+    for index, record in enumerate(records):
+        try:
+            data = _import_document(collection, record)
+        except ValueError as e:
+            results.append({"index": index, "error": str(e)})
+            continue
+        doc_ref = collection_ref.document()
+        writes.append((index, doc_ref, stamped(data)))
+        results.append({"index": index, "id": doc_ref.id})
+    chunks = [writes[start : start + BATCH_LIMIT] for start in range(0, len(writes), BATCH_LIMIT)]
+    return chunks, results
+
+
+def _chunk_batch(chunk, db):
+    batch = db.batch()
+    for _, doc_ref, data in chunk:
+        batch.set(doc_ref, data)
+    return batch
+
+
+def _fail_chunk(chunk, results, error):
+    """replace the ids of a chunk whose commit failed with the error"""
+    for index, _, _ in chunk:
+        results[index] = {"index": index, "error": str(error)}
+
+
+def imported_notes(committed):
+    """(id, note) of the committed (index, doc_ref, data) writes of an import"""
+    return [(doc_ref.id, data) for _, doc_ref, data in committed]
+
+
+def imported_workouts(committed, template_id: str):
+    """((template id, id), workout) of the committed (index, doc_ref, data) writes of an import"""
+    return [((template_id, doc_ref.id), data) for _, doc_ref, data in committed]
+
+
+def _log_import(uid, collection, results):
+    failed = sum("error" in result for result in results)
+    logger.info(
+        "records imported",
+        extra={"uid": uid, "collection": collection, "imported": len(results) - failed, "failed": failed},
+    )
+
+
+def import_records(uid: str, collection: str, records, db: google.cloud.firestore.Client, template_id: str = None):
+    """create many pain notes or completed workouts, BATCH_LIMIT per batched write.
+    invalid records are skipped, a batch that fails to commit fails only its own records
+
+    Args:
+        uid (str): uid
+        collection (str): "pain" or "completed"
+        records (list): see parse_records
+        db (google.cloud.firestore.Client): firestore client
+        template_id (str, optional): template of completed workouts. Defaults to None.
+
+    Returns:
+        list[dict]: {"index", "id"} for every imported record, {"index", "error"} for the others
+    """
+    chunks, results = plan_import(uid, collection, records, db, template_id)
+    committed = []
+    try:
+        for chunk in chunks:
+            try:
+                _chunk_batch(chunk, db).commit()
+                committed.extend(chunk)
+            except Exception as e:
+                logger.exception("import batch failed", extra={"uid": uid, "collection": collection})
+                _fail_chunk(chunk, results, e)
+    finally:
+        user_cache.invalidate(uid, collection)
+        try_bump_versions(uid, (collection,), db)
+    if collection == "pain":
+        pain_summary.catch_up(uid, db, imported_notes(committed))
+    else:
+        muscle_load.catch_up(uid, db, imported_workouts(committed, template_id))
+    _log_import(uid, collection, results)
+    return results
+
+
+### delta sync
+# collections /sync reports, with the key of their document ids
+SYNC_COLLECTIONS = {
+    "exercises": "id",
+    "workouts": "id",
+    "completed": "id",
+    "pain": "hash_id",
+    "journals": "id",
+    "medications": "id",
+}
+
+
+class SyncExpired(ValueError):
+    """the since watermark is older than the tombstones, the client has to reload everything"""
+
+
+def parse_since(since: str):
+    """
+    Args:
+        since (str): watermark of an earlier sync (ISO 8601), None or empty for everything
+
+    Raises:
+        ValueError: if since is not a timestamp
+        SyncExpired: if since is older than TOMBSTONE_RETENTION
+
+    Returns:
+        Optional[datetime]: aware datetime
+    """
+    if not since:
+        return None
+    # fromisoformat only reads a Z suffix (see format_watermark) from python 3.11 on
+    if since[-1:] in ("Z", "z"):
+        since = since[:-1] + "+00:00"
+    try:
+        parsed = datetime.fromisoformat(since)
+    except ValueError:
+        raise ValueError("since must be an ISO 8601 timestamp.") from None
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    if parsed < datetime.now(timezone.utc) - TOMBSTONE_RETENTION:
+        raise SyncExpired("since is older than the deletions kept, reload everything.")
+    return parsed
+
+
+def format_watermark(watermark: datetime):
+    """ISO 8601 in UTC with a Z suffix, which needs no escaping in a query string"""
+    return watermark.astimezone(timezone.utc).isoformat().replace("+00:00", "Z")
+
 
+def _changed(query, since, field: str = UPDATED_AT):
+    if since is None:
+        return query
+    return query.where(filter=firestore.FieldFilter(field, ">", since))
+
+
+def get_changes(uid: str, since, db: google.cloud.firestore.Client):
+    """documents written and deleted after since, in every SYNC_COLLECTIONS collection.
+
+    the watermark is the read time of the first read: every write committed before it is
+    visible to all the queries that follow, so nothing is missed between two syncs (a write
+    landing while the queries run may be sent again next time)
+
+    Args:
+        uid (str): uid
+        since (Optional[datetime]): watermark of the previous sync, None for everything
+        db (google.cloud.firestore.Client): firestore client
+
+    Returns:
+        dict: {"changes": {collection: [documents]}, "deleted": [{"collection", "id",
+            "template_id" (completed), "deleted_at"}], "watermark": datetime}
+    """
+    watermark = versions_ref(uid, db).get().read_time
+    queries = changes_queries(uid, since, db)
+    return changes_result({name: query.stream() for name, query in queries.items()}, watermark)
+
+
+def changes_queries(uid: str, since, db):
+    """the queries of get_changes, independent of each other, run once the watermark is read
+
+    Args:
+        uid (str): uid
+        since (Optional[datetime]): watermark of the previous sync, None for everything
+        db (google.cloud.firestore.Client): firestore client
+
+    Returns:
+        dict: collection -> its documents written after since, for every SYNC_COLLECTIONS
+            collection, and TOMBSTONES -> the deletions after since (only when since is given)
+    """
+    user_ref = db.collection("users").document(uid)
+    queries = {
+        collection: _changed(user_ref.collection(collection), since)
+        for collection in SYNC_COLLECTIONS
+        if collection != "completed"
+    }
+    # one user scoped query, however many templates there are; firestore needs a composite index
+    # (__name__, updated_at) on the completed collection group for it
+    queries["completed"] = _changed(completed_query(uid, db), since)
+    if since is not None:
+        queries[TOMBSTONES] = _changed(user_ref.collection(TOMBSTONES), since, "deleted_at")
+    return queries
+
+
+def changes_result(snapshots: dict, watermark):
+    """get_changes' result
+
+    Args:
+        snapshots (dict): name -> the snapshots read by that query of changes_queries
+        watermark (datetime): read time of the versions document, read before the queries
+
+    Returns:
+        dict: see get_changes
+    """
+    changes = {}
+    for collection, id_field in SYNC_COLLECTIONS.items():
+        if collection == "completed":
+            changes[collection] = list(completed_with_template(snapshots[collection]))
+        else:
+            changes[collection] = docs_to_list(snapshots[collection], id_field)
+    deleted = []
+    for doc in snapshots.get(TOMBSTONES, ()):
+        entry = doc.to_dict()
+        entry.pop("expire_at", None)
+        deleted.append(entry)
+    return {"changes": changes, "deleted": deleted, "watermark": watermark}
@@ -0,0 +1,255 @@
+"""in-process name prefix index of exercise catalogs, so exercise pickers can search instead of
+downloading whole catalogs. every user's exercises, and the premade exercises, are a sorted array
+of (name key, word position, exercise id) searched with bisect; a name is indexed whole and from
+each of its words, so "cur" finds both "Curl" and "Hammer Curl" (in that order).
+
+a user's index is built from their exercises collection on their first search, then kept up to
+date by the exercise write helpers of this process. writes that are not made exercise by exercise
+(batches, user setup and deletion) drop it, and like user_cache entries it is dropped after
+INDEX_TTL seconds, which bounds staleness between processes
+"""
+
+from bisect import bisect_left, insort
+from cachetools import TTLCache
+
+import itertools
+import threading
+
+from user_cache import CACHE_TTL
+
+INDEX_TTL = CACHE_TTL
+# number of users whose index is kept
+MAX_INDEXED_USERS = 10_000
+# default and largest number of search results
+SEARCH_LIMIT = 20
+MAX_SEARCH_LIMIT = 100
+MAX_QUERY_LENGTH = 100
+
+# stored documents carry their commit time, which the index does not know for its own writes
+_IGNORED_FIELDS = ("updated_at",)
+
+
+def normalize(text: str):
+    """case and whitespace insensitive form of a name or query"""
+    return " ".join(str(text).casefold().split())
+
+
+def name_keys(name):
+    """the keys a name is found under: (the name from each of its words on, position of the word)"""
+    if not isinstance(name, str):
+        return []
+    words = normalize(name).split()
+    return [(" ".join(words[i:]), i) for i in range(len(words))]
+
+
+def _indexed(data: dict):
+    return {field: value for field, value in data.items() if field not in _IGNORED_FIELDS}
+
+
+class PrefixIndex:
+    """the exercises of one catalog, searchable by name prefix"""
+
+    def __init__(self, documents=()):
+        """
+        Args:
+            documents (iterable of (id, dict), optional): exercises. Defaults to ().
+        """
+        self._documents = {doc_id: _indexed(data) for doc_id, data in documents}
+        self._keys = sorted(
+            (key, position, doc_id)
+            for doc_id, data in self._documents.items()
+            for key, position in name_keys(data.get("name"))
+        )
+
+    def __len__(self):
+        return len(self._documents)
+
+    def __contains__(self, doc_id):
+        return doc_id in self._documents
+
+    def get(self, doc_id: str):
+        return self._documents.get(doc_id)
+
+    def put(self, doc_id: str, data: dict):
+        """add an exercise, or replace it"""
+        self.remove(doc_id)
+        self._documents[doc_id] = data = _indexed(data)
+        for key, position in name_keys(data.get("name")):
+            insort(self._keys, (key, position, doc_id))
+
+    def remove(self, doc_id: str):
+        data = self._documents.pop(doc_id, None)
+        if data is None:
+            return
+        for entry in ((key, position, doc_id) for key, position in name_keys(data.get("name"))):
+            i = bisect_left(self._keys, entry)
+            if i < len(self._keys) and self._keys[i] == entry:
+                del self._keys[i]
+
+    def search(self, prefix: str, muscle: str = None):
+        """lazily yield the exercises with a name key starting with prefix, in key order (names
+        before the same words later in a name)
+
+        Args:
+            prefix (str): normalized prefix
+            muscle (str, optional): only exercises of this muscle. Defaults to None.
+
+        Yields:
+            tuple: (id, exercise), every exercise once
+        """
+        seen = set()
+        for i in range(bisect_left(self._keys, (prefix,)), len(self._keys)):
+            key, _, doc_id = self._keys[i]
+            if not key.startswith(prefix):
+                return
+            data = self._documents[doc_id]
+            if doc_id not in seen and (muscle is None or data.get("muscle") == muscle):
+                seen.add(doc_id)
+                yield doc_id, data
+
+
+# uid -> PrefixIndex. every change to a user's exercises takes a new generation from the counter,
+# so an index built from reads that raced with a write is never stored (see UserCache)
+_user_indexes = TTLCache(maxsize=MAX_INDEXED_USERS, ttl=INDEX_TTL)
+_generations = TTLCache(maxsize=MAX_INDEXED_USERS, ttl=INDEX_TTL)
+_next_generation = itertools.count(1)
+# the premade index, rebuilt when the cached premade tree it was built from is replaced
+_premade_index = {"tree": None, "index": PrefixIndex()}
+_lock = threading.Lock()
+_stats = {"hits": 0, "misses": 0}
+
+
+def user_index(uid: str, load):
+    """the user's index, built from load() when there is none
+
+    Args:
+        uid (str): user id
+        load (function): returns the user's exercises as (id, dict) pairs
+
+    Returns:
+        PrefixIndex: the index
+    """
+    with _lock:
+        index = _user_indexes.get(uid)
+        _stats["hits" if index is not None else "misses"] += 1
+        if index is not None:
+            return index
+        generation = _generations.get(uid)
+        if generation is None:
+            generation = _generations[uid] = next(_next_generation)
+    index = PrefixIndex(load())
+    with _lock:
+        # kept unless the user's exercises changed while they were read
+        if _generations.get(uid) == generation:
+            _user_indexes[uid] = index
+    return index
+
+
+def premade_index(tree):
+    """the index of the premade exercises
+
+    Args:
+        tree (list[tuple]): the premade exercises, see data_helper.read_collection_tree
+
+    Returns:
+        PrefixIndex: the index
+    """
+    with _lock:
+        if _premade_index["tree"] is not tree:
+            _premade_index["index"] = PrefixIndex((doc_id, data) for doc_id, data, _ in tree)
+            _premade_index["tree"] = tree
+        return _premade_index["index"]
+
+
+def _change(uid: str, apply):
+    with _lock:
+        _generations[uid] = next(_next_generation)
+        index = _user_indexes.get(uid)
+        if index is not None and not apply(index):
+            del _user_indexes[uid]
+
+
+def added(uid: str, exercise_id: str, data: dict):
+    """an exercise of the user was created (or replaced)"""
+    _change(uid, lambda index: index.put(exercise_id, data) or True)
+
+
+def updated(uid: str, exercise_id: str, changes: dict):
+    """fields of an exercise of the user were updated"""
+
+    def apply(index):
+        if exercise_id not in index:
+            return False
+        index.put(exercise_id, {**index.get(exercise_id), **changes})
+        return True
+
+    _change(uid, apply)
+
+
+def removed(uid: str, exercise_id: str):
+    """an exercise of the user was deleted"""
+    _change(uid, lambda index: index.remove(exercise_id) or True)
+
+
+def forget(uid: str):
+    """the user's exercises changed in ways the index cannot follow, it is built again when needed"""
+    _change(uid, lambda index: False)
+
+
+def parse_search(q: str, limit: str = None):
+    """validate the q and limit query parameters of an exercise search
+
+    Raises:
+        ValueError: if q is empty or too long, or limit is not between 1 and MAX_SEARCH_LIMIT
+
+    Returns:
+        tuple: (normalized prefix, limit)
+    """
+    prefix = normalize(q)
+    if not prefix:
+        raise ValueError("q must not be empty.")
+    if len(prefix) > MAX_QUERY_LENGTH:
+        raise ValueError(f"q must be at most {MAX_QUERY_LENGTH} characters.")
+    limit = SEARCH_LIMIT if limit is None else int(limit)
+    if limit < 1 or limit > MAX_SEARCH_LIMIT:
+        raise ValueError(f"limit must be between 1 and {MAX_SEARCH_LIMIT}.")
+    return prefix, limit
+
+
+def search(prefix: str, user: PrefixIndex, premades: PrefixIndex, muscle: str = None, limit: int = SEARCH_LIMIT):
+    """the user's exercises matching prefix, then the premade ones the user has no copy of
+
+    Args:
+        prefix (str): normalized name prefix
+        user (PrefixIndex): the user's index
+        premades (PrefixIndex): the premade index
+        muscle (str, optional): only exercises of this muscle. Defaults to None.
+        limit (int, optional): max number of results. Defaults to SEARCH_LIMIT.
+
+    Returns:
+        list[dict]: exercises with their id and source ("user" or "premade")
+    """
+    with _lock:
+        matches = itertools.chain(
+            ((doc_id, data, "user") for doc_id, data in user.search(prefix, muscle)),
+            ((doc_id, data, "premade") for doc_id, data in premades.search(prefix, muscle) if doc_id not in user),
+        )
+        return [{**data, "id": doc_id, "source": source} for doc_id, data, source in itertools.islice(matches, limit)]
+
+
+def stats():
+    """
+    Returns:
+        dict: hits, misses and number of indexed users
+    """
+    with _lock:
+        return {**_stats, "size": len(_user_indexes)}
+
+
+def clear():
+    """drop every index and reset the counters"""
+    with _lock:
+        _user_indexes.clear()
+        _generations.clear()
+        _premade_index.update(tree=None, index=PrefixIndex())
+        _stats.update(hits=0, misses=0)
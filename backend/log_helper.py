@@ -0,0 +1,236 @@
+from flask import g, request
+
+import atexit
+import contextvars
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import re
+import sys
+import time
+import uuid
+
+# records waiting for the writer thread; when it is full new records are dropped, never waited on
+LOG_QUEUE_SIZE = 10_000
+# longest logged string value (message or field), longer ones are cut so payloads are never dumped
+MAX_FIELD_LENGTH = 256
+REQUEST_ID_HEADER = "X-Request-ID"
+# incoming request ids are reused only if they look like an id
+_REQUEST_ID_PATTERN = re.compile(r"^[A-Za-z0-9._:-]{1,128}$")
+
+# attributes every LogRecord has, anything else was passed through extra= and is logged as a field
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime"}
+
+_request_id = contextvars.ContextVar("request_id", default=None)
+_route = contextvars.ContextVar("route", default=None)
+_sampled = contextvars.ContextVar("sampled", default=True)
+
+_listener = None
+
+
+def _truncate(value):
+    if isinstance(value, str) and len(value) > MAX_FIELD_LENGTH:
+        return value[:MAX_FIELD_LENGTH] + f"...({len(value)} chars)"
+    if isinstance(value, (list, tuple, dict, set)):
+        # collections are summarized, only their size is logged
+        return f"<{type(value).__name__} of {len(value)}>"
+    return value
+
+
+class JsonFormatter(logging.Formatter):
+    """one json object per line: ts, level, logger, msg, request_id, route, the fields passed in
+    extra= and the exception if any. long strings are truncated and collections summarized"""
+
+    def format(self, record):
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": _truncate(record.getMessage()),
+        }
+        for key in ("request_id", "route"):
+            if getattr(record, key, None):
+                entry[key] = getattr(record, key)
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRIBUTES and key not in entry and key != "sampled":
+                entry[key] = _truncate(value)
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class RequestContextFilter(logging.Filter):
+    """tags records with the request id and route of the request logging them and drops records
+    below WARNING of requests that were not sampled"""
+
+    def filter(self, record):
+        record.request_id = _request_id.get()
+        record.route = _route.get()
+        return _sampled.get() or record.levelno >= logging.WARNING
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """queue handler that never blocks the logging thread: records are handed to the writer
+    thread unformatted, and dropped (and counted) when the queue is full"""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # formatting happens on the writer thread, only render the message while args are live
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class _StderrHandler(logging.StreamHandler):
+    """writes to whatever sys.stderr is when the record is written"""
+
+    def __init__(self):
+        super().__init__()
+
+    @property
+    def stream(self):
+        return sys.stderr
+
+    @stream.setter
+    def stream(self, _value):
+        pass
+
+
+def parse_sample_rates(spec: str):
+    """parse per-route sample rates
+
+    Args:
+        spec (str): comma separated route=rate pairs, e.g. "/get-all-pain=0.1,/metrics=0"
+
+    Raises:
+        ValueError: if a rate is not a number between 0 and 1
+
+    Returns:
+        dict: url rule -> fraction of requests whose INFO/DEBUG records are kept
+    """
+    rates = {}
+    for pair in filter(None, (p.strip() for p in (spec or "").split(","))):
+        route, _, rate = pair.rpartition("=")
+        rate = float(rate)
+        if not route or not 0 <= rate <= 1:
+            raise ValueError(f"invalid sample rate '{pair}'")
+        rates[route] = rate
+    return rates
+
+
+def configure_logging(level=None, handler: logging.Handler = None):
+    """send every record through a bounded queue to a writer thread, as json lines.
+    safe to call more than once, later calls replace the earlier setup
+
+    Args:
+        level (str or int, optional): root level. Defaults to $LOG_LEVEL or INFO.
+        handler (logging.Handler, optional): where the writer thread writes. Defaults to stderr.
+
+    Returns:
+        DroppingQueueHandler: the handler installed on the root logger
+    """
+    global _listener
+    stop_logging()
+    root = logging.getLogger()
+    handler = handler or _StderrHandler()
+    handler.setFormatter(JsonFormatter())
+    log_queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+    queue_handler = DroppingQueueHandler(log_queue)
+    queue_handler.addFilter(RequestContextFilter())
+    root.addHandler(queue_handler)
+    root.setLevel(level or os.environ.get("LOG_LEVEL", "INFO").upper())
+
+    _listener = logging.handlers.QueueListener(log_queue, handler, respect_handler_level=True)
+    _listener.start()
+    return queue_handler
+
+
+def stop_logging():
+    """undo configure_logging: write what is queued, stop the writer thread and remove the handler"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+    root = logging.getLogger()
+    for old in [h for h in root.handlers if isinstance(h, DroppingQueueHandler)]:
+        root.removeHandler(old)
+
+
+def flush_logging():
+    """wait until every queued record is written (restarts the writer thread)"""
+    if _listener is not None:
+        _listener.stop()
+        _listener.start()
+
+
+@atexit.register
+def _stop_listener():
+    if _listener is not None:
+        _listener.stop()
+
+
+def init_app(app, sample_rates: dict = None, default_rate: float = None):
+    """correlate records with requests: every request gets an id (its X-Request-ID header when it
+    has a usable one, a new uuid otherwise) that is logged with each record and returned in the
+    X-Request-ID response header, and a sampling decision for its INFO/DEBUG records
+
+    Args:
+        app (flask.Flask): app
+        sample_rates (dict, optional): url rule -> rate. Defaults to $LOG_SAMPLE_RATES.
+        default_rate (float, optional): rate of other routes. Defaults to $LOG_SAMPLE_RATE or 1.
+    """
+    if sample_rates is None:
+        sample_rates = parse_sample_rates(os.environ.get("LOG_SAMPLE_RATES", ""))
+    if default_rate is None:
+        default_rate = float(os.environ.get("LOG_SAMPLE_RATE", "1"))
+    access_logger = logging.getLogger("access")
+
+    @app.before_request
+    def start_request_log():
+        incoming = request.headers.get(REQUEST_ID_HEADER, "")
+        request_id = incoming if _REQUEST_ID_PATTERN.match(incoming) else uuid.uuid4().hex
+        route = request.url_rule.rule if request.url_rule else None
+        rate = sample_rates.get(route, default_rate)
+        g.log_tokens = (
+            _request_id.set(request_id),
+            _route.set(route),
+            _sampled.set(rate >= 1 or random.random() < rate),
+        )
+        g.log_start = time.perf_counter()
+
+    @app.after_request
+    def finish_request_log(response):
+        request_id = _request_id.get()
+        if request_id:
+            response.headers[REQUEST_ID_HEADER] = request_id
+        if "log_start" in g:
+            access_logger.info(
+                "%s %s %s",
+                request.method,
+                request.path,
+                response.status_code,
+                extra={
+                    "status": response.status_code,
+                    "ms": round((time.perf_counter() - g.log_start) * 1000, 3),
+                },
+            )
+        return response
+
+    @app.teardown_request
+    def end_request_log(_error=None):
+        tokens = g.pop("log_tokens", None)
+        if tokens:
+            for var, token in zip((_request_id, _route, _sampled), tokens):
+                var.reset(token)
@@ -0,0 +1,237 @@
+from flask import Response, g, request
+
+import threading
+import time
+
+PROMETHEUS_MIMETYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# histogram bucket upper bounds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+DOCUMENT_BUCKETS = (0, 1, 5, 10, 50, 100, 500, 1000, 5000, 10000, 50000)
+
+
+class Histogram:
+    """cumulative prometheus histogram"""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+        self.sum += value
+        self.count += 1
+
+
+class RouteMetrics:
+    """everything recorded for one (route, method)"""
+
+    def __init__(self):
+        self.statuses = {}
+        self.latency = Histogram(LATENCY_BUCKETS)
+        self.size = Histogram(SIZE_BUCKETS)
+        self.reads = Histogram(DOCUMENT_BUCKETS)
+        self.writes = Histogram(DOCUMENT_BUCKETS)
+        self.calls = 0
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(**labels):
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels.items()) + "}"
+
+
+def _number(value):
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+class Metrics:
+    """per route request metrics (count by status, latency, response size, firestore calls, reads
+    and writes) plus in-process cache statistics, exposed in prometheus text format at /metrics
+
+    routes are labelled with their url rule (/users/<uid>/exercises), never the concrete path, so
+    the number of series stays bounded
+    """
+
+    def __init__(self, store_counters=None):
+        """
+        Args:
+            store_counters (storage.StoreCounters, optional): counters of the CountingClient the
+                routes use. Defaults to None (firestore usage is not recorded).
+        """
+        self.store_counters = store_counters
+        self._routes = {}
+        self._caches = {}
+        self._lock = threading.Lock()
+
+    def register_cache(self, name: str, stats):
+        """expose an in-process cache
+
+        Args:
+            name (str): cache label
+            stats (function): returns a dict with at least hits and misses (and optionally size,
+                entries or bytes)
+        """
+        self._caches[name] = stats
+
+    def init_app(self, app, path: str = "/metrics"):
+        """record every request of a flask app and add the metrics route
+
+        Args:
+            app (flask.Flask): app
+            path (str, optional): route of the metrics. Defaults to "/metrics".
+        """
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        app.add_url_rule(path, "metrics", self.view, methods=["GET"])
+
+    def _before_request(self):
+        g.metrics_start = time.perf_counter()
+        if self.store_counters is not None:
+            g.metrics_store = dict(self.store_counters.current())
+
+    def _after_request(self, response):
+        start = g.get("metrics_start")
+        if start is None:
+            return response
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+        method = request.method
+        store_before = g.get("metrics_store")
+
+        def record(size):
+            store = None
+            if store_before is not None:
+                current = self.store_counters.current()
+                store = {key: current[key] - store_before[key] for key in current}
+            self.observe(
+                route, method, response.status_code, time.perf_counter() - start, size, store
+            )
+
+        if not response.is_streamed:
+            record(response.calculate_content_length() or 0)
+            return response
+
+        # a streamed body (and the firestore reads behind it) is produced after this hook,
+        # so the request is recorded once the server closes the response
+        body = response.response
+        sent = {"bytes": 0}
+
+        def counted():
+            for chunk in body:
+                sent["bytes"] += len(chunk)
+                yield chunk
+
+        response.response = counted()
+        response.call_on_close(lambda: record(sent["bytes"]))
+        return response
+
+    def observe(self, route, method, status, seconds, size, store=None):
+        """record one request
+
+        Args:
+            route (str): url rule
+            method (str): http method
+            status (int): status code
+            seconds (float): time to produce the response
+            size (int): response body bytes
+            store (dict, optional): firestore calls, reads and writes of the request. Defaults to None.
+        """
+        with self._lock:
+            metrics = self._routes.get((route, method))
+            if metrics is None:
+                metrics = self._routes[(route, method)] = RouteMetrics()
+            metrics.statuses[status] = metrics.statuses.get(status, 0) + 1
+            metrics.latency.observe(seconds)
+            metrics.size.observe(size)
+            if store is not None:
+                metrics.calls += store["calls"]
+                metrics.reads.observe(store["reads"])
+                metrics.writes.observe(store["writes"])
+
+    def render(self):
+        """
+        Returns:
+            str: every metric in prometheus text exposition format
+        """
+        lines = []
+
+        def family(name, kind, help_text):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+
+        def histogram(name, labels, hist):
+            for bound, count in zip(hist.buckets, hist.counts):
+                lines.append(f"{name}_bucket{_labels(**labels, le=_number(bound))} {count}")
+            lines.append(f"{name}_bucket{_labels(**labels, le='+Inf')} {hist.count}")
+            lines.append(f"{name}_sum{_labels(**labels)} {_number(hist.sum)}")
+            lines.append(f"{name}_count{_labels(**labels)} {hist.count}")
+
+        with self._lock:
+            routes = sorted(self._routes.items(), key=lambda item: item[0])
+
+            family("http_requests_total", "counter", "Requests handled, by route, method and status.")
+            for (route, method), metrics in routes:
+                for status, count in sorted(metrics.statuses.items()):
+                    lines.append(f"http_requests_total{_labels(route=route, method=method, status=status)} {count}")
+
+            family("http_request_duration_seconds", "histogram", "Time to produce a response.")
+            for (route, method), metrics in routes:
+                histogram("http_request_duration_seconds", {"route": route, "method": method}, metrics.latency)
+
+            family("http_response_size_bytes", "histogram", "Response body size.")
+            for (route, method), metrics in routes:
+                histogram("http_response_size_bytes", {"route": route, "method": method}, metrics.size)
+
+            if self.store_counters is not None:
+                family("firestore_calls_total", "counter", "Firestore round trips made by requests.")
+                for (route, method), metrics in routes:
+                    lines.append(f"firestore_calls_total{_labels(route=route, method=method)} {metrics.calls}")
+
+                family("firestore_reads_per_request", "histogram", "Firestore documents read by a request.")
+                for (route, method), metrics in routes:
+                    histogram("firestore_reads_per_request", {"route": route, "method": method}, metrics.reads)
+
+                family("firestore_writes_per_request", "histogram", "Firestore documents written by a request.")
+                for (route, method), metrics in routes:
+                    histogram("firestore_writes_per_request", {"route": route, "method": method}, metrics.writes)
+
+                totals = dict(self.store_counters.totals)
+                family("firestore_operations_total", "counter", "Firestore calls, reads and writes of the process.")
+                for kind in ("calls", "reads", "writes"):
+                    lines.append(f"firestore_operations_total{_labels(kind=kind)} {totals[kind]}")
+
+        caches = sorted(((name, stats()) for name, stats in self._caches.items()), key=lambda item: item[0])
+        family("cache_hits_total", "counter", "In-process cache hits.")
+        for name, stats in caches:
+            lines.append(f"cache_hits_total{_labels(cache=name)} {stats['hits']}")
+        family("cache_misses_total", "counter", "In-process cache misses.")
+        for name, stats in caches:
+            lines.append(f"cache_misses_total{_labels(cache=name)} {stats['misses']}")
+        family("cache_hit_ratio", "gauge", "Hits over lookups since the process started.")
+        for name, stats in caches:
+            lookups = stats["hits"] + stats["misses"]
+            ratio = stats["hits"] / lookups if lookups else 0
+            lines.append(f"cache_hit_ratio{_labels(cache=name)} {_number(round(ratio, 6))}")
+        family("cache_entries", "gauge", "Entries held by an in-process cache.")
+        for name, stats in caches:
+            lines.append(f"cache_entries{_labels(cache=name)} {stats.get('entries', stats.get('size', 0))}")
+        if any("bytes" in stats for _, stats in caches):
+            family("cache_bytes", "gauge", "Approximate memory held by an in-process cache.")
+            for name, stats in caches:
+                if "bytes" in stats:
+                    lines.append(f"cache_bytes{_labels(cache=name)} {stats['bytes']}")
+
+        return "\n".join(lines) + "\n"
+
+    def view(self):
+        """/metrics; GET; prometheus text format"""
+        return Response(self.render(), content_type=PROMETHEUS_MIMETYPE)
@@ -0,0 +1,193 @@
+"""per-user training load per muscle, kept in users/{uid}/meta/muscle_load by the completed workout
+write helpers so recommendations can weigh recent training without reading workout history:
+
+    {"days": {dateCompleted: {muscle: sets}}}
+
+every exercise of a completed workout ("sets|reps|weight|eid") adds its sets to the muscle of the
+exercise on the day the workout was completed (a set count that is not a positive number counts
+as one set, exercises that do not exist and workouts without a YYYY-MM-DD dateCompleted carry no
+load). only the last LOAD_WINDOW_DAYS days are kept. the counters are changed in the transaction
+writing the workout; a user without them gets them built from their completed workouts on their
+next write
+"""
+
+from datetime import datetime, timedelta
+
+from user_summary import SummaryDocument, completed_query
+
+LOAD_DOCUMENT = ("meta", "muscle_load")
+# days of load kept, and the half life of a day's load when it is weighed by recent_load
+LOAD_WINDOW_DAYS = 28
+HALF_LIFE_DAYS = 7
+
+_DATE_FORMAT = "%Y-%m-%d"
+
+
+def load_ref(uid: str, db):
+    return db.collection("users").document(uid).collection(LOAD_DOCUMENT[0]).document(LOAD_DOCUMENT[1])
+
+
+def _cutoff():
+    return (datetime.now() - timedelta(LOAD_WINDOW_DAYS)).strftime(_DATE_FORMAT)
+
+
+def exercise_sets(entry):
+    """
+    Args:
+        entry (str): an exercise of a completed workout, "sets|reps|weight|eid"
+
+    Returns:
+        Optional[tuple]: (eid, sets), None if the entry is not an exercise
+    """
+    fields = entry.split("|") if isinstance(entry, str) else []
+    if len(fields) != 4 or not fields[3]:
+        return None
+    try:
+        sets = float(fields[0])
+    except ValueError:
+        sets = 0
+    return fields[3], sets if 0 < sets < float("inf") else 1
+
+
+def _day(completed: dict):
+    day = completed.get("dateCompleted") if isinstance(completed, dict) else None
+    try:
+        datetime.strptime(day, _DATE_FORMAT)
+    except (TypeError, ValueError):
+        return None
+    return day
+
+
+def workout_eids(workouts):
+    """the distinct exercise ids of completed workouts"""
+    return list(
+        dict.fromkeys(
+            exercise[0]
+            for completed in workouts
+            if isinstance(completed, dict)
+            for exercise in map(exercise_sets, completed.get("exercises") or [])
+            if exercise
+        )
+    )
+
+
+def add_workouts(load: dict, workouts, exercise_info: dict, sign: int = 1):
+    """add (or with sign=-1, take out) the sets of completed workouts
+
+    Args:
+        load (dict): counters to change
+        workouts (iterable of dict): completed workouts
+        exercise_info (dict): eid -> exercise document (with its muscle)
+        sign (int, optional): 1 to add, -1 to remove. Defaults to 1.
+    """
+    cutoff = _cutoff()
+    for completed in workouts:
+        day = _day(completed)
+        if day is None or day <= cutoff:
+            continue
+        muscles = load["days"].setdefault(day, {})
+        for exercise in map(exercise_sets, completed.get("exercises") or []):
+            muscle = exercise_info.get(exercise[0], {}).get("muscle") if exercise else None
+            if isinstance(muscle, str):
+                muscles[muscle] = muscles.get(muscle, 0) + sign * exercise[1]
+
+
+def prune(load: dict):
+    """drop the days that left the window and the counters that went to zero
+
+    Returns:
+        dict: load
+    """
+    cutoff = _cutoff()
+    days = {}
+    for day, muscles in load["days"].items():
+        muscles = {muscle: sets for muscle, sets in muscles.items() if sets > 1e-9}
+        if day > cutoff and muscles:
+            days[day] = muscles
+    load["days"] = days
+    return load
+
+
+def recent_load(load: dict):
+    """the training load of every muscle, each day's sets halved every HALF_LIFE_DAYS days
+
+    Args:
+        load (dict): counters, None for a user without any
+
+    Returns:
+        dict: muscle -> load
+    """
+    today = datetime.now().date()
+    totals = {}
+    for day, muscles in ((load or {}).get("days") or {}).items():
+        age = max((today - datetime.strptime(day, _DATE_FORMAT).date()).days, 0)
+        weight = 0.5 ** (age / HALF_LIFE_DAYS)
+        for muscle, sets in muscles.items():
+            totals[muscle] = totals.get(muscle, 0) + weight * sets
+    return totals
+
+
+def _key(snapshot):
+    return snapshot.reference.parent.parent.id, snapshot.id
+
+
+def _pending(removed, added):
+    """keys of added workouts whose stored version is not counted yet"""
+    return {key for key, _ in added} - {key for key, _ in removed}
+
+
+def _exercise_refs(uid: str, workouts, db):
+    collection_ref = db.collection("users").document(uid).collection("exercises")
+    return [collection_ref.document(eid) for eid in workout_eids(workouts)]
+
+
+def _exercise_info(snapshots):
+    return {doc.id: doc.to_dict() for doc in snapshots if doc.exists}
+
+
+def update(transaction, uid: str, db, removed=(), added=()):
+    """change the counters inside a transaction: take out the stored versions of completed
+    workouts, add their new versions, see user_summary
+
+    Args:
+        transaction (google.cloud.firestore.Transaction): transaction
+        uid (str): user id
+        db (google.cloud.firestore.Client): firebase db
+        removed (iterable of ((template id, completed id), dict), optional): workouts before the change. Defaults to ().
+        added (iterable of ((template id, completed id), dict), optional): workouts after the change. Defaults to ().
+    """
+    removed, added = list(removed), list(added)
+    ref = load_ref(uid, db)
+    snapshot = ref.get(transaction=transaction)
+    history = []
+    if not snapshot.exists:
+        pending = _pending(removed, added)
+        history = [
+            doc.to_dict() for doc in completed_query(uid, db).stream(transaction=transaction) if _key(doc) not in pending
+        ]
+    workouts = history + [completed for _, completed in removed + added]
+    refs = _exercise_refs(uid, workouts, db)
+    exercise_info = _exercise_info(db.get_all(refs, transaction=transaction)) if refs else {}
+    load = snapshot.to_dict() if snapshot.exists else {"days": {}}
+    add_workouts(load, history, exercise_info)
+    add_workouts(load, (completed for _, completed in removed), exercise_info, sign=-1)
+    add_workouts(load, (completed for _, completed in added), exercise_info)
+    transaction.set(ref, prune(load))
+
+
+def _build(transaction, uid: str, db):
+    """counters of a user's completed workouts, read in the transaction"""
+    workouts = [doc.to_dict() for doc in completed_query(uid, db).stream(transaction=transaction)]
+    refs = _exercise_refs(uid, workouts, db)
+    exercise_info = _exercise_info(db.get_all(refs, transaction=transaction)) if refs else {}
+    load = {"days": {}}
+    add_workouts(load, workouts, exercise_info)
+    return prune(load)
+
+
+document = SummaryDocument("muscle load", load_ref, update, _build, lambda load: {"days": len(load["days"])})
+# record(uid, db, removed, added), rebuild(uid, db) -> counters, catch_up(uid, db, created, rebuild),
+# for completed workouts written without the counters (batches, bulk imports, template deletes)
+record = document.record
+rebuild = document.rebuild
+catch_up = document.catch_up
@@ -0,0 +1,269 @@
+"""per-user pain summary, kept in users/{uid}/meta/pain_summary by the pain note write helpers
+so the recommender reads one small document instead of the pain collection:
+
+    {"count": valid notes,
+     "parts": {body_part: {"count": notes,
+                           "latest": {"id", "date", "pain_level"} of the newest note,
+                           "days": {date: {"count", "sum"}} pain levels of the last WINDOW_DAYS days}}}
+
+"newest" is firestore's order of recent_pain_query (date, then document id, descending) and a note
+is valid when it has a body_part, a pain_level and a (YYYY-MM-DD) date. the summary is changed in
+the transaction writing the note; a user without one gets it built from the raw notes on their
+next write, and this tool rebuilds them:
+
+    cd backend
+    python pain_summary.py <uid> [<uid> ...]        # rebuild some users
+    python pain_summary.py --all                    # rebuild every user
+"""
+
+from google.cloud import firestore
+from datetime import datetime, timedelta
+import argparse
+
+import storage
+from user_summary import SummaryDocument
+
+SUMMARY_DOCUMENT = ("meta", "pain_summary")
+# days of pain levels kept per body part, the window of recommender.get_recent_pain
+WINDOW_DAYS = 7
+
+
+def summary_ref(uid: str, db):
+    return db.collection("users").document(uid).collection(SUMMARY_DOCUMENT[0]).document(SUMMARY_DOCUMENT[1])
+
+
+def _pain_ref(uid: str, db):
+    return db.collection("users").document(uid).collection("pain")
+
+
+def _cutoff(days: int = WINDOW_DAYS):
+    """dates after this are inside the window, like recommender.recent_pain_query"""
+    return (datetime.now() - timedelta(days)).strftime("%Y-%m-%d")
+
+
+def _valid(note):
+    return (
+        isinstance(note, dict)
+        and note.get("body_part") is not None
+        and note.get("pain_level") is not None
+        and isinstance(note.get("date"), str)
+    )
+
+
+def _newer(a: dict, b: dict):
+    return (a["date"], a["id"]) > (b["date"], b["id"])
+
+
+def empty_summary():
+    return {"count": 0, "parts": {}}
+
+
+def add_notes(summary: dict, notes):
+    """count (note id, note) pairs into the summary
+
+    Args:
+        summary (dict): summary to change
+        notes (iterable of (str, dict)): notes to add
+    """
+    cutoff = _cutoff()
+    for note_id, note in notes:
+        if not _valid(note):
+            continue
+        part = summary["parts"].setdefault(note["body_part"], {"count": 0, "latest": None, "days": {}})
+        part["count"] += 1
+        summary["count"] += 1
+        latest = {"id": note_id, "date": note["date"], "pain_level": note["pain_level"]}
+        if part["latest"] is None or _newer(latest, part["latest"]):
+            part["latest"] = latest
+        if note["date"] > cutoff:
+            day = part["days"].setdefault(note["date"], {"count": 0, "sum": 0})
+            day["count"] += 1
+            day["sum"] += note["pain_level"]
+
+
+def remove_notes(summary: dict, notes):
+    """take (note id, note) pairs, as they are stored, out of the summary
+
+    Args:
+        summary (dict): summary to change
+        notes (iterable of (str, dict)): notes to remove
+
+    Returns:
+        list[str]: body parts that lost their latest note and still have notes; their new
+            latest note has to be read from the pain collection (see replace_latest)
+    """
+    stale = []
+    for note_id, note in notes:
+        part = summary["parts"].get(note.get("body_part")) if _valid(note) else None
+        if part is None:
+            continue
+        part["count"] -= 1
+        summary["count"] -= 1
+        day = part["days"].get(note["date"])
+        if day is not None:
+            day["count"] -= 1
+            day["sum"] -= note["pain_level"]
+            if day["count"] <= 0:
+                del part["days"][note["date"]]
+        if part["count"] <= 0:
+            del summary["parts"][note["body_part"]]
+        elif part["latest"] is not None and part["latest"]["id"] == note_id:
+            part["latest"] = None
+            stale.append(note["body_part"])
+    return [body_part for body_part in dict.fromkeys(stale) if body_part in summary["parts"]]
+
+
+def prune(summary: dict):
+    """drop the days that left the window
+
+    Returns:
+        dict: summary
+    """
+    cutoff = _cutoff()
+    for part in summary["parts"].values():
+        part["days"] = {date: day for date, day in part["days"].items() if date > cutoff}
+    return summary
+
+
+def summarize(notes):
+    """
+    Args:
+        notes (iterable of (str, dict)): every pain note of a user
+
+    Returns:
+        dict: their summary
+    """
+    summary = empty_summary()
+    add_notes(summary, notes)
+    return summary
+
+
+def latest_query(uid: str, body_part: str, db):
+    """a body part's notes, newest first; firestore needs a composite index
+    (body_part ascending, date descending) on the pain collection for it
+
+    Args:
+        uid (str): user id
+        body_part (str): body part
+        db (google.cloud.firestore.Client): firebase db
+
+    Returns:
+        query:
+    """
+    return (
+        _pain_ref(uid, db)
+        .where(filter=firestore.FieldFilter("body_part", "==", body_part))
+        .order_by("date", direction=firestore.Query.DESCENDING)
+    )
+
+
+def replace_latest(summary: dict, body_part: str, notes, skip):
+    """set a body part's latest note to the first valid note of notes (newest first) that is
+    not in skip. notes may be a (lazy) stream of snapshots, it is only read that far
+
+    Returns:
+        bool: whether a note was found
+    """
+    for snapshot in notes:
+        note = snapshot.to_dict()
+        if snapshot.id not in skip and _valid(note):
+            summary["parts"][body_part]["latest"] = {
+                "id": snapshot.id, "date": note["date"], "pain_level": note["pain_level"],
+            }
+            return True
+    return False
+
+
+def _changed_ids(removed, added):
+    """(ids whose stored version is not part of the summary yet, ids whose stored version is stale)"""
+    removed_ids, added_ids = {note_id for note_id, _ in removed}, {note_id for note_id, _ in added}
+    return added_ids - removed_ids, removed_ids | added_ids
+
+
+def update(transaction, uid: str, db, removed=(), added=()):
+    """change the summary inside a transaction: remove the stored versions of notes, add
+    their new versions, see user_summary
+
+    removed notes must be their stored version. added notes may already be stored (bulk
+    imports update the summary after their batches), a missing summary is then built
+    from the stored notes without them
+
+    Args:
+        transaction (google.cloud.firestore.Transaction): transaction
+        uid (str): user id
+        db (google.cloud.firestore.Client): firebase db
+        removed (iterable of (str, dict), optional): notes before the change. Defaults to ().
+        added (iterable of (str, dict), optional): notes after the change. Defaults to ().
+    """
+    removed, added = list(removed), list(added)
+    pending, stale_ids = _changed_ids(removed, added)
+    ref = summary_ref(uid, db)
+    snapshot = ref.get(transaction=transaction)
+    if snapshot.exists:
+        summary = snapshot.to_dict()
+    else:
+        notes = _pain_ref(uid, db).stream(transaction=transaction)
+        summary = summarize((note.id, note.to_dict()) for note in notes if note.id not in pending)
+    for body_part in remove_notes(summary, removed):
+        notes = latest_query(uid, body_part, db).stream(transaction=transaction)
+        replace_latest(summary, body_part, notes, stale_ids)
+    add_notes(summary, added)
+    transaction.set(ref, prune(summary))
+
+
+def _build(transaction, uid: str, db):
+    """summary of a user's pain notes, read in the transaction"""
+    notes = _pain_ref(uid, db).stream(transaction=transaction)
+    return prune(summarize((note.id, note.to_dict()) for note in notes))
+
+
+document = SummaryDocument("pain summary", summary_ref, update, _build, lambda summary: {"notes": summary["count"]})
+# record(uid, db, removed, added), rebuild(uid, db) -> summary, catch_up(uid, db, created, rebuild),
+# for pain notes written without the summary (batches, bulk imports). a discarded summary makes
+# readers fall back to the pain collection until the next write rebuilds it
+record = document.record
+rebuild = document.rebuild
+catch_up = document.catch_up
+discard = document.discard
+
+
+def recent_pain(summary: dict, days: int = WINDOW_DAYS):
+    """the latest note of every body part, if it is from the past `days` days, newest first.
+    get_intensity finds the same note in these as in recommender.get_recent_pain
+
+    Args:
+        summary (dict): summary
+        days (int, optional): size of the window in days, at most WINDOW_DAYS. Defaults to WINDOW_DAYS.
+
+    Returns:
+        list[dict]: pain notes with date, body_part and pain_level
+    """
+    cutoff = _cutoff(days)
+    latest = sorted(
+        (
+            (part["latest"]["date"], part["latest"]["id"], body_part, part["latest"]["pain_level"])
+            for body_part, part in summary["parts"].items()
+            if part["latest"] is not None and part["latest"]["date"] > cutoff
+        ),
+        reverse=True,
+    )
+    return [{"date": date, "body_part": body_part, "pain_level": level} for date, _, body_part, level in latest]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="rebuild per-user pain summaries from the pain notes")
+    parser.add_argument("uids", nargs="*", help="users to rebuild")
+    parser.add_argument("--all", action="store_true", help="rebuild every user")
+    args = parser.parse_args(argv)
+    if not args.uids and not args.all:
+        parser.error("give user ids or --all")
+
+    db = storage.create_client()
+    uids = args.uids or [doc.id for doc in db.collection("users").list_documents()]
+    for uid in uids:
+        summary = rebuild(uid, db)
+        print(f"{uid}: {summary['count']} notes, {len(summary['parts'])} body parts")
+
+
+if __name__ == "__main__":
+    main()
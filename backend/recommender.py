@@ -2,8 +2,16 @@ from google.cloud import firestore
 from firebase_admin import credentials
 from firebase_admin import firestore
 import google.cloud.firestore
+from cachetools import TTLCache
 
 from datetime import datetime, timedelta
+import logging
+import threading
+
+import muscle_load
+import pain_summary
+
+logger = logging.getLogger(__name__)
 
 ABS = "Abs"
 BACK = "Back"
@@ -30,6 +38,27 @@ muscles = [
     TRICEPS,
 ]
 
+# the muscle groups of pick_muscle: the muscles counted towards a group, and the muscles it
+# recommends from, in the order ties are broken in (the first least worked one wins)
+ARMS = [BICEPS, FOREARMS, SHOULDERS, TRICEPS]
+MIDBODY = [ABS, BACK, CHEST, TRAPS]
+LEGS = [GLUTES, HAMSTRINGS, QUADRICEPS]
+ARM_CHOICES = [BICEPS, TRICEPS, SHOULDERS, FOREARMS]
+MIDBODY_CHOICES = [BACK, CHEST, TRAPS, ABS]
+UPPER_BODY_CHOICES = [BICEPS, TRICEPS, SHOULDERS, BACK, CHEST, TRAPS, SHOULDERS, ABS, FOREARMS]
+LEGS_CHOICES = [GLUTES, HAMSTRINGS, QUADRICEPS]
+
+# ranked recommendations: what one set of recent load (see muscle_load.recent_load) adds to a
+# muscle's score, next to the 1 of every exercise of the current workout, and the default top k
+LOAD_WEIGHT = 0.1
+DEFAULT_TOP_K = 3
+
+# the premade workouts almost never change, so each one is kept in memory for this many seconds
+PREMADE_WORKOUT_TTL = 600
+_premade_workouts = TTLCache(maxsize=32, ttl=PREMADE_WORKOUT_TTL)
+_premade_workouts_lock = threading.Lock()
+_premade_workout_stats = {"hits": 0, "misses": 0}
+
 
 def get_intensity(recent_pain, to_recommend):
     """this looks for the most recent note relating to pain in an area. 
@@ -37,7 +66,7 @@ def get_intensity(recent_pain, to_recommend):
     high intensity. if there is medium pain / no notes it recommends of a similar intensity
 
     Args:
-        recent_pain (list of notes): list of previous pain notes
+        recent_pain (iterable of notes): previous pain notes, newest first
         to_recommend (Muscle Enum): the muscle being recommended
 
     Returns:
@@ -55,127 +84,303 @@ def get_intensity(recent_pain, to_recommend):
         return "same"
 
 
-def recommend_exercise(uid: str, curr_workout, db: google.cloud.firestore.Client):
-    """taking a current workout (and user id), recommends an exercise type to user and intensity
-    looks at the current workouts, tries to infer the type of workout being done, and picks a muslce to work out
-    then for that recommendation, it looks at previous pain notes and recommends the intensity the user should shoot for
+def get_recent_pain(uid: str, db: google.cloud.firestore.Client, days: int = 7):
+    """lazily yields the user's pain notes from the past `days` days, newest first.
+    the date window and ordering are done by firestore (dates are stored as YYYY-MM-DD,
+    so string order is date order), so only notes inside the window are read, and
+    reading stops as soon as the caller stops iterating
+
+    Args:
+        uid (str): user id
+        db (google.cloud.firestore.Client): firebase db
+        days (int, optional): size of the window in days. Defaults to 7.
+
+    Yields:
+        dict: pain note with date, body_part and pain_level
+    """
+    for pain_doc in recent_pain_query(uid, db, days).stream():
+        doc_dict = pain_doc.to_dict()
+        # check if invalid note
+        if "body_part" in doc_dict and "pain_level" in doc_dict:
+            yield doc_dict
 
 
+def recent_pain_query(uid: str, db, days: int = 7):
+    """the query behind get_recent_pain
+
     Args:
         uid (str): user id
-        curr_workout (workout: list of exercises): the workout as described elsewhere
         db (google.cloud.firestore.Client): firebase db
+        days (int, optional): size of the window in days. Defaults to 7.
 
     Returns:
-        dict[str,str]: dict with fields 'recommendation' and 'intensity' 
+        query: the user's pain notes newer than `days` days, newest first
     """
-    # curworkout: list({eid, name, sets, reps, weight})
+    date_format = "%Y-%m-%d"
+    cutoff = (datetime.now() - timedelta(days)).strftime(date_format)
+
+    return (
+        db.collection("users")
+        .document(uid)
+        .collection("pain")
+        .where(filter=firestore.FieldFilter("date", ">", cutoff))
+        .order_by("date", direction=firestore.Query.DESCENDING)
+    )
 
-    # get information about exercises in current workout
-    collection_ref = db.collection("users").document(uid).collection("exercises")
-    exercise_info = dict()
 
-    for exer in curr_workout:
-        if not('eid' in exer and exer['eid']):
-            continue
-        doc = collection_ref.document(exer["eid"]).get()
-        # print(collection_ref.document(BICEPS).get().__dict__)
-        if doc.exists:
-            exercise_info[exer["eid"]] = doc.to_dict()
-        else:
-            print(f"Document {exer['eid']} not found", flush=True)
+def muscle_choices(curr_workout, exercise_info: dict):
+    """infer the type of workout from the muscles of its exercises
 
-    # get information about pain in past week
-    date_format = "%Y-%m-%d"
-    one_week_ago = datetime.now() - timedelta(7)
+    Args:
+        curr_workout (workout: list of exercises): the workout, every exercise has an eid
+        exercise_info (dict): eid -> exercise document (with its muscle)
 
-    collection_ref = db.collection("users").document(uid).collection("pain")
+    Raises:
+        KeyError: if an exercise of the workout is not in exercise_info
 
-    docs = collection_ref.stream()
-    recent_pain = []
-    for pain_doc in docs:
-        doc_dict = pain_doc.to_dict()
-        # check if invalid note
-        if not (
-            "date" in doc_dict and "body_part" in doc_dict and "pain_level" in doc_dict
-        ):
-            continue
-        else:
-            converted_date = datetime.strptime(doc_dict["date"], date_format)
-            if converted_date >= one_week_ago:
-                recent_pain.append(doc_dict)
-    recent_pain.sort(key=lambda e: e["date"], reverse=True)
-    print(recent_pain)
-    # by this point, we should have a sorted list of pain notes
-
-    # get exercise recommendation
+    Returns:
+        tuple: (muscle -> number of exercises of the workout working it, the muscles the type of
+            workout recommends from in tie order)
+    """
     # we will look at the types of exercises they are doing to predict the workout
-    # then from those groups we will suggest the least done exercise of them
-    # finally we will  query notes to decide if they should
     worked = dict(zip(muscles, [0 for _ in muscles]))
     for exer in curr_workout:
         muscle = exercise_info[exer["eid"]]["muscle"]
         worked[muscle] += 1
 
     # if arms
-    arms = worked[BICEPS] + worked[FOREARMS] + worked[SHOULDERS] + worked[TRICEPS]
+    arms = sum(worked[m] for m in ARMS)
 
     # if mid body
-    midbody = (
-        worked[ABS] + worked[BACK] + worked[CHEST] + worked[TRAPS]
-    )
+    midbody = sum(worked[m] for m in MIDBODY)
 
     # if upper body
     upper_body = arms + midbody
 
     # if legs
-    legs = worked[GLUTES] + worked[HAMSTRINGS] + worked[QUADRICEPS]
+    legs = sum(worked[m] for m in LEGS)
 
     maj_needed = len(curr_workout) // 2 + 1
-    to_recommend = ""
 
     if arms >= maj_needed:
-        # to_recommend = "arms"
-        arm_muscles = [BICEPS, TRICEPS, SHOULDERS, FOREARMS]
-        curr_counts = [worked[m] for m in arm_muscles]
-        min_ind = curr_counts.index(min(curr_counts))
-        to_recommend = arm_muscles[min_ind]
-
+        return worked, ARM_CHOICES
     elif midbody >= maj_needed:
-        to_recommend = "mid"
-        mid_muscles = [ BACK, CHEST, TRAPS, ABS]
-        curr_counts = [worked[m] for m in mid_muscles]
-        min_ind = curr_counts.index(min(curr_counts))
-        to_recommend = mid_muscles[min_ind]
-
+        return worked, MIDBODY_CHOICES
     elif upper_body >= maj_needed:
-        # to_recommend = "upper"
-        upper_body_muscles = [BICEPS,TRICEPS,SHOULDERS,BACK,CHEST,TRAPS,SHOULDERS,ABS,FOREARMS,]
-        curr_counts = [worked[m] for m in upper_body_muscles]
-        min_ind = curr_counts.index(min(curr_counts))
-        to_recommend = upper_body_muscles[min_ind]
-
+        return worked, UPPER_BODY_CHOICES
     elif legs >= maj_needed:
-        
-        # to_recommend = "legs"
-        legs_muscles = [GLUTES, HAMSTRINGS, QUADRICEPS]
-        curr_counts = [worked[m] for m in legs_muscles]
-        min_ind = curr_counts.index(min(curr_counts))
-        to_recommend = legs_muscles[min_ind]
+        return worked, LEGS_CHOICES
+    # full body
+    return worked, muscles
+
+
+def pick_muscle(curr_workout, exercise_info: dict):
+    """the scoring part of recommend_exercise, without any reads: infer the type of workout
+    from the muscles of its exercises and pick the least worked muscle of that type
+
+    Args:
+        curr_workout (workout: list of exercises): the workout, every exercise has an eid
+        exercise_info (dict): eid -> exercise document (with its muscle)
+
+    Raises:
+        KeyError: if an exercise of the workout is not in exercise_info
+
+    Returns:
+        str: the muscle to recommend
+    """
+    # from the groups of the workout we will suggest the least done exercise of them
+    worked, choices = muscle_choices(curr_workout, exercise_info)
+    curr_counts = [worked[m] for m in choices]
+    return choices[curr_counts.index(min(curr_counts))]
+
+
+def rank_muscles(curr_workout, exercise_info: dict, load: dict = None, k: int = DEFAULT_TOP_K):
+    """pick_muscle as a ranking: the muscles of the type of workout come first, then the others,
+    each ordered by score, the exercises of the workout working the muscle plus LOAD_WEIGHT times
+    its recent load. equal scores keep pick_muscle's tie order, so without load the first muscle
+    is pick_muscle's
+
+    Args:
+        curr_workout (workout: list of exercises): the workout, every exercise has an eid
+        exercise_info (dict): eid -> exercise document (with its muscle)
+        load (dict, optional): the user's muscle_load counters, None if they have none. Defaults to None.
+        k (int, optional): number of muscles. Defaults to DEFAULT_TOP_K.
+
+    Raises:
+        KeyError: if an exercise of the workout is not in exercise_info
+
+    Returns:
+        list[dict]: {"muscle", "score", "load"} of the k best muscles, best first
+    """
+    worked, choices = muscle_choices(curr_workout, exercise_info)
+    recent = muscle_load.recent_load(load)
+    ranked = sorted(
+        dict.fromkeys(choices + muscles),
+        key=lambda m: (m not in choices, worked[m] + LOAD_WEIGHT * recent.get(m, 0)),
+    )
+    return [
+        {
+            "muscle": muscle,
+            "score": round(worked[muscle] + LOAD_WEIGHT * recent.get(muscle, 0), 3),
+            "load": round(recent.get(muscle, 0), 3),
+        }
+        for muscle in ranked[:k]
+    ]
+
+
+def parse_top_k(k: str = None):
+    """validate the k query parameter of ranked recommendations
+
+    Raises:
+        ValueError: if k is not between 1 and the number of muscles
+
+    Returns:
+        int: k, DEFAULT_TOP_K when not given
+    """
+    if k is None:
+        return DEFAULT_TOP_K
+    k = int(k)
+    if k < 1 or k > len(muscles):
+        raise ValueError(f"k must be between 1 and {len(muscles)}.")
+    return k
 
-    else:
-        to_recommend = "full"
-        # get the minimum of unseen
-        to_recommend = min(worked, key=lambda k: float("inf") if k not in worked else worked[k])
 
+def workout_eids(workouts):
+    """the distinct exercise ids of workouts, in order"""
+    return list(dict.fromkeys(exer["eid"] for workout in workouts for exer in workout if ("eid" in exer and exer["eid"])))
 
+
+def exercise_refs(uid: str, eids, db, *documents):
+    """the references of read_exercises' multi-get: the exercises, the pain summary, then documents"""
+    collection_ref = db.collection("users").document(uid).collection("exercises")
+    return [collection_ref.document(eid) for eid in eids] + [pain_summary.summary_ref(uid, db), *documents]
+
+
+def split_exercises(uid: str, snapshots, *paths):
+    """the snapshots of read_exercises' multi-get as (exercise_info, the data of the document at
+    every path, None for those that do not exist)"""
+    exercise_info, documents = dict(), dict.fromkeys(paths)
+    for doc in snapshots:
+        if doc.reference.path in documents:
+            documents[doc.reference.path] = doc.to_dict()
+        elif doc.exists:
+            exercise_info[doc.id] = doc.to_dict()
+        else:
+            logger.warning("exercise not found", extra={"uid": uid, "exercise_id": doc.id})
+    return (exercise_info, *documents.values())
+
+
+def read_exercises(uid: str, eids, db: google.cloud.firestore.Client, *documents):
+    """one multi-get for every exercise (and the pain summary) instead of a round trip per document
+
+    Args:
+        uid (str): user id
+        eids (list[str]): exercise ids
+        db (google.cloud.firestore.Client): firebase db
+        *documents (DocumentReference): other documents of the user to read in the same multi-get
+
+    Returns:
+        tuple: (eid -> exercise document, for the exercises that exist; the pain summary, None if
+            the user has none; the data of each of documents, None if it does not exist)
+    """
+    refs = exercise_refs(uid, eids, db, *documents)
+    return split_exercises(uid, db.get_all(refs), *(ref.path for ref in refs[len(eids):]))
+
+
+def recommend_exercise(uid: str, curr_workout, db: google.cloud.firestore.Client):
+    """taking a current workout (and user id), recommends an exercise type to user and intensity
+    looks at the current workouts, tries to infer the type of workout being done, and picks a muslce to work out
+    then for that recommendation, it looks at previous pain notes and recommends the intensity the user should shoot for.
+    the latest pain note of every body part comes from the user's pain summary, read in the same
+    multi-get as the exercises; users without one fall back to reading their recent notes
+
+
+    Args:
+        uid (str): user id
+        curr_workout (workout: list of exercises): the workout as described elsewhere
+        db (google.cloud.firestore.Client): firebase db
+
+    Returns:
+        dict[str,str]: dict with fields 'recommendation' and 'intensity' 
+    """
+    # curworkout: list({eid, name, sets, reps, weight})
+
+    # get information about exercises in current workout
+    exercise_info, summary = read_exercises(uid, workout_eids([curr_workout]), db)
+
+    to_recommend = pick_muscle(curr_workout, exercise_info)
+
+    if summary is not None:
+        recent_pain = pain_summary.recent_pain(summary)
+    else:
+        # pain notes are read newest first and only until get_intensity finds a match
+        recent_pain = get_recent_pain(uid, db)
     return {"recommended": to_recommend, "intensity": get_intensity(recent_pain, to_recommend)}
 
 
+def candidates_query(uid: str, ranked, db):
+    """the user's exercises working any of the ranked muscles, one query for all of them"""
+    return (
+        db.collection("users")
+        .document(uid)
+        .collection("exercises")
+        .where(filter=firestore.FieldFilter("muscle", "in", [r["muscle"] for r in ranked]))
+    )
+
+
+def add_candidates(ranked, exercise_docs, recent_pain):
+    """complete rank_muscles' muscles with their intensity and the exercises working them
+
+    Args:
+        ranked (list[dict]): rank_muscles' result, changed in place
+        exercise_docs (iterable of firebase documents): candidates_query's result
+        recent_pain (list of notes): pain notes, newest first
+
+    Returns:
+        list[dict]: ranked
+    """
+    candidates = {r["muscle"]: [] for r in ranked}
+    for doc in exercise_docs:
+        exercise = doc.to_dict()
+        exercise["id"] = doc.id
+        candidates[exercise["muscle"]].append(exercise)
+    for r in ranked:
+        r["intensity"] = get_intensity(recent_pain, r["muscle"])
+        r["exercises"] = candidates[r["muscle"]]
+    return ranked
+
+
+def recommend_ranked(uid: str, curr_workout, db: google.cloud.firestore.Client, k: int = DEFAULT_TOP_K):
+    """recommend_exercise as the k best muscles, weighing the training load of the user's recent
+    completed workouts (see rank_muscles), each with its intensity and the user's exercises
+    working it. the load comes from the counters muscle_load keeps up to date on every completed
+    workout write, read in the same multi-get as the exercises and the pain summary, so no workout
+    history is read here; a user without counters is ranked without load until their next write
+
+    Args:
+        uid (str): user id
+        curr_workout (workout: list of exercises): the workout as described elsewhere
+        db (google.cloud.firestore.Client): firebase db
+        k (int, optional): number of muscles. Defaults to DEFAULT_TOP_K.
+
+    Returns:
+        list[dict]: {"muscle", "score", "load", "intensity", "exercises"}, best first
+    """
+    exercise_info, summary, load = read_exercises(
+        uid, workout_eids([curr_workout]), db, muscle_load.load_ref(uid, db)
+    )
+    ranked = rank_muscles(curr_workout, exercise_info, load, k)
+    if summary is not None:
+        recent_pain = pain_summary.recent_pain(summary)
+    else:
+        recent_pain = list(get_recent_pain(uid, db))
+    return add_candidates(ranked, candidates_query(uid, ranked, db).stream(), recent_pain)
+
+
 def recommend_workout(workout_id: str, db: google.cloud.firestore.Client):
     """our recommend workout gives the user a workout based on the 
     area of focus. To ensure there are no errors when a user deletes an exercise, we get 
-    it from the globals collection
+    it from the globals collection. workouts are cached in process for PREMADE_WORKOUT_TTL seconds
 
     Args:
         workout_id (str): workout id
@@ -184,8 +389,26 @@ def recommend_workout(workout_id: str, db: google.cloud.firestore.Client):
     Returns:
         Optional[exercises]: the requested exercise (or none if there was an error)
     """
+    with _premade_workouts_lock:
+        if workout_id in _premade_workouts:
+            _premade_workout_stats["hits"] += 1
+            return _premade_workouts[workout_id]
+        _premade_workout_stats["misses"] += 1
+
     doc_ref = db.collection('globals').document('workouts').collection('premades').document(workout_id)
     doc = doc_ref.get()
-    if doc.exists:
-        return doc.to_dict()
-    return None
+    workout = doc.to_dict() if doc.exists else None
+
+    with _premade_workouts_lock:
+        _premade_workouts[workout_id] = workout
+    return workout
+
+
+def premade_workout_cache_stats():
+    """hit / miss statistics of the premade workout cache
+
+    Returns:
+        dict: hits, misses and number of cached workouts
+    """
+    with _premade_workouts_lock:
+        return {**_premade_workout_stats, "size": len(_premade_workouts)}
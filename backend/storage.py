@@ -0,0 +1,975 @@
+import firebase_admin
+from firebase_admin import credentials
+from firebase_admin import firestore
+from google.api_core import exceptions
+from google.cloud.firestore_v1 import transforms
+
+from datetime import datetime, timezone
+import asyncio
+import functools
+import os
+import random
+import string
+import threading
+
+# which storage engine create_client() builds when none is given: "firestore" or "memory"
+STORAGE_BACKEND_ENV = "STORAGE_BACKEND"
+DEFAULT_CREDENTIALS = "./admin_credentials.json"
+
+_AUTO_ID_CHARS = string.ascii_letters + string.digits
+_DESCENDING = "DESCENDING"
+
+
+def create_client(backend: str = None, credentials_path: str = DEFAULT_CREDENTIALS):
+    """build the storage client used by app.py, data_helper and recommender.
+
+    the storage interface is the subset of google.cloud.firestore.Client the backend uses:
+    collection / document references, add, get, get_all (multi-get), stream, set, update, delete,
+    collections, batch, bulk_writer, transaction, recursive_delete, collection_group, and queries with
+    where / order_by / limit / start_after / select (range queries). "firestore" is the real
+    client, "memory" is MemoryClient, a local engine that needs no network or credentials
+
+    Args:
+        backend (str, optional): "firestore" or "memory". Defaults to $STORAGE_BACKEND, or "firestore".
+        credentials_path (str, optional): service account file for firestore. Defaults to DEFAULT_CREDENTIALS.
+
+    Raises:
+        ValueError: unknown backend
+
+    Returns:
+        google.cloud.firestore.Client or MemoryClient:
+    """
+    backend = backend or os.environ.get(STORAGE_BACKEND_ENV, "firestore")
+    if backend == "firestore":
+        if not firebase_admin._apps:
+            firebase_admin.initialize_app(credentials.Certificate(credentials_path))
+        return firestore.client()
+    if backend == "memory":
+        return MemoryClient()
+    raise ValueError(f"Unknown storage backend {backend!r}, expected 'firestore' or 'memory'.")
+
+
+def create_async_client(backend: str = None, credentials_path: str = DEFAULT_CREDENTIALS, engine=None):
+    """build the asyncio storage client used by asgi_app: google.cloud.firestore.AsyncClient,
+    or AsyncMemoryClient for "memory" (see create_client)
+
+    Args:
+        backend (str, optional): "firestore" or "memory". Defaults to $STORAGE_BACKEND, or "firestore".
+        credentials_path (str, optional): service account file for firestore. Defaults to DEFAULT_CREDENTIALS.
+        engine (MemoryClient, optional): the memory engine to share with a synchronous client.
+            Defaults to a new one.
+
+    Raises:
+        ValueError: unknown backend
+
+    Returns:
+        google.cloud.firestore.AsyncClient or AsyncMemoryClient:
+    """
+    backend = backend or os.environ.get(STORAGE_BACKEND_ENV, "firestore")
+    if backend == "firestore":
+        from firebase_admin import firestore_async
+
+        if not firebase_admin._apps:
+            firebase_admin.initialize_app(credentials.Certificate(credentials_path))
+        return firestore_async.client()
+    if backend == "memory":
+        return AsyncMemoryClient(engine)
+    raise ValueError(f"Unknown storage backend {backend!r}, expected 'firestore' or 'memory'.")
+
+
+def _auto_id():
+    return "".join(random.choice(_AUTO_ID_CHARS) for _ in range(20))
+
+
+def _now():
+    return datetime.now(timezone.utc)
+
+
+def _split_path(path):
+    """'a/b/c' or ('a', 'b', 'c') -> ('a', 'b', 'c')"""
+    if isinstance(path, str):
+        return tuple(part for part in path.split("/") if part)
+    return tuple(path)
+
+
+def _copy(value):
+    """copy of a stored value, so callers never share state with the store"""
+    if isinstance(value, dict):
+        return {k: _copy(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_copy(v) for v in value]
+    return value
+
+
+def _get_field(data, field_path):
+    """value at a dotted field path, raises KeyError if missing"""
+    value = data
+    for part in field_path.split("."):
+        if not isinstance(value, dict):
+            raise KeyError(field_path)
+        value = value[part]
+    return value
+
+
+def _resolve(value, current=None):
+    """value to store, with sentinels and transforms (SERVER_TIMESTAMP, Increment, ...) applied
+    against the currently stored value"""
+    if value is transforms.SERVER_TIMESTAMP:
+        return _now()
+    if isinstance(value, transforms.Increment):
+        return (current if isinstance(current, (int, float)) else 0) + value.value
+    if isinstance(value, transforms.Maximum):
+        return max(current, value.value) if isinstance(current, (int, float)) else value.value
+    if isinstance(value, transforms.Minimum):
+        return min(current, value.value) if isinstance(current, (int, float)) else value.value
+    if isinstance(value, transforms.ArrayUnion):
+        current = current if isinstance(current, list) else []
+        return current + [v for v in value.values if v not in current]
+    if isinstance(value, transforms.ArrayRemove):
+        current = current if isinstance(current, list) else []
+        return [v for v in current if v not in value.values]
+    if isinstance(value, dict):
+        current = current if isinstance(current, dict) else {}
+        return {
+            k: _resolve(v, current.get(k))
+            for k, v in value.items()
+            if v is not transforms.DELETE_FIELD
+        }
+    return _copy(value)
+
+
+def _apply_field(data, field_path, value):
+    """update(): set a dotted field path in data"""
+    parts = field_path.split(".")
+    parent = data
+    for part in parts[:-1]:
+        if not isinstance(parent.get(part), dict):
+            parent[part] = {}
+        parent = parent[part]
+    if value is transforms.DELETE_FIELD:
+        parent.pop(parts[-1], None)
+    else:
+        parent[parts[-1]] = _resolve(value, parent.get(parts[-1]))
+
+
+def _merge(data, updates):
+    """set(..., merge=True): nested maps are merged instead of replaced"""
+    for key, value in updates.items():
+        if value is transforms.DELETE_FIELD:
+            data.pop(key, None)
+        elif isinstance(value, dict) and isinstance(data.get(key), dict):
+            _merge(data[key], value)
+        else:
+            data[key] = _resolve(value, data.get(key))
+
+
+def _type_rank(value):
+    """firestore orders values of different types by type first"""
+    if value is None:
+        return 0
+    if isinstance(value, bool):
+        return 1
+    if isinstance(value, (int, float)):
+        return 2
+    if isinstance(value, datetime):
+        return 3
+    if isinstance(value, str):
+        return 4
+    if isinstance(value, bytes):
+        return 5
+    if isinstance(value, (tuple, MemoryDocumentReference)):
+        return 6
+    if isinstance(value, list):
+        return 8
+    return 9
+
+
+def _sort_key(value):
+    """comparable key following firestore's ordering of values"""
+    if isinstance(value, MemoryDocumentReference):
+        value = value._path
+    if isinstance(value, datetime) and value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    if isinstance(value, list):
+        return (8, tuple(_sort_key(v) for v in value))
+    if isinstance(value, dict):
+        return (9, tuple(sorted((k, _sort_key(v)) for k, v in value.items())))
+    return (_type_rank(value), value)
+
+
+def _compare(a, b):
+    a, b = _sort_key(a), _sort_key(b)
+    return (a > b) - (a < b)
+
+
+class MemoryDocumentSnapshot:
+    """snapshot of a stored document, like google.cloud.firestore.DocumentSnapshot"""
+
+    def __init__(self, reference, data, create_time=None, update_time=None):
+        self.reference = reference
+        self._data = data
+        self.create_time = create_time
+        self.update_time = update_time
+        self.read_time = _now()
+
+    @property
+    def id(self):
+        return self.reference.id
+
+    @property
+    def exists(self):
+        return self._data is not None
+
+    def to_dict(self):
+        return _copy(self._data) if self._data is not None else None
+
+    def get(self, field_path):
+        if self._data is None:
+            return None
+        return _copy(_get_field(self._data, field_path))
+
+
+class MemoryDocumentReference:
+    """reference to a document, like google.cloud.firestore.DocumentReference"""
+
+    def __init__(self, client, path):
+        self._client = client
+        self._path = path
+
+    def __eq__(self, other):
+        return isinstance(other, MemoryDocumentReference) and other._path == self._path
+
+    def __hash__(self):
+        return hash(self._path)
+
+    def __repr__(self):
+        return f"<MemoryDocumentReference {self.path}>"
+
+    @property
+    def id(self):
+        return self._path[-1]
+
+    @property
+    def path(self):
+        return "/".join(self._path)
+
+    @property
+    def parent(self):
+        return MemoryCollectionReference(self._client, self._path[:-1])
+
+    def collection(self, collection_id):
+        return MemoryCollectionReference(self._client, self._path + (collection_id,))
+
+    def collections(self):
+        return [
+            MemoryCollectionReference(self._client, self._path + (collection_id,))
+            for collection_id in self._client._subcollection_ids(self._path)
+        ]
+
+    def get(self, field_paths=None, transaction=None):
+        snapshot = self._client._snapshot(self._path)
+        if transaction is not None:
+            transaction._read(self._path, snapshot.update_time)
+        return snapshot
+
+    def create(self, document_data):
+        return self._client._write([("create", self._path, document_data)])
+
+    def set(self, document_data, merge=False):
+        return self._client._write([("merge" if merge else "set", self._path, document_data)])
+
+    def update(self, field_updates, option=None):
+        return self._client._write([("update", self._path, field_updates)])
+
+    def delete(self, option=None):
+        return self._client._write([("delete", self._path, None)])
+
+
+class MemoryQuery:
+    """query over one collection or a collection group, like google.cloud.firestore.Query.
+    supports where (FieldFilter or field, op, value), order_by, limit, limit_to_last,
+    start_at / start_after / end_at / end_before cursors and select"""
+
+    ASCENDING = "ASCENDING"
+    DESCENDING = _DESCENDING
+
+    def __init__(self, client, path, all_descendants=False):
+        self._client = client
+        self._path = path
+        self._all_descendants = all_descendants
+        self._filters = ()
+        self._orders = ()
+        self._limit = None
+        self._limit_to_last = False
+        self._start = None
+        self._end = None
+        self._projection = None
+
+    def _with(self, **changes):
+        query = object.__new__(type(self))
+        query.__dict__.update(self.__dict__)
+        for key, value in changes.items():
+            setattr(query, "_" + key, value)
+        return query
+
+    def where(self, field_path=None, op_string=None, value=None, *, filter=None):
+        if filter is None:
+            filter = firestore.FieldFilter(field_path, op_string, value)
+        return self._with(filters=self._filters + (filter,))
+
+    def order_by(self, field_path, direction="ASCENDING"):
+        return self._with(orders=self._orders + ((field_path, direction),))
+
+    def limit(self, count):
+        return self._with(limit=count, limit_to_last=False)
+
+    def limit_to_last(self, count):
+        return self._with(limit=count, limit_to_last=True)
+
+    def select(self, field_paths):
+        return self._with(projection=tuple(field_paths))
+
+    def start_at(self, document_fields_or_snapshot):
+        return self._with(start=(document_fields_or_snapshot, True))
+
+    def start_after(self, document_fields_or_snapshot):
+        return self._with(start=(document_fields_or_snapshot, False))
+
+    def end_at(self, document_fields_or_snapshot):
+        return self._with(end=(document_fields_or_snapshot, True))
+
+    def end_before(self, document_fields_or_snapshot):
+        return self._with(end=(document_fields_or_snapshot, False))
+
+    def _field_value(self, path, data, field_path):
+        if field_path == "__name__":
+            return MemoryDocumentReference(self._client, path)
+        return _get_field(data, field_path)
+
+    def _matches(self, path, data, filter):
+        try:
+            value = self._field_value(path, data, filter.field_path)
+        except KeyError:
+            return False
+        op, expected = filter.op_string, filter.value
+        if not isinstance(op, str):
+            # FieldFilter turns "== None" / "== nan" into unary filters
+            return value is None if expected is None else value != value
+        if isinstance(expected, str) and filter.field_path == "__name__":
+            expected = MemoryDocumentReference(self._client, self._path + (expected,))
+        if op == "array_contains":
+            return isinstance(value, list) and expected in value
+        if op == "array_contains_any":
+            return isinstance(value, list) and any(v in value for v in expected)
+        if op == "in":
+            return any(_compare(value, v) == 0 for v in expected)
+        if op == "not-in":
+            return value is not None and not any(_compare(value, v) == 0 for v in expected)
+        if op == "!=":
+            return value is not None and _compare(value, expected) != 0
+        if _type_rank(value) != _type_rank(expected):
+            return False
+        result = _compare(value, expected)
+        return {"==": result == 0, "<": result < 0, "<=": result <= 0, ">": result > 0, ">=": result >= 0}[op]
+
+    def _normalized_orders(self):
+        orders = list(self._orders)
+        # inequality filters order by their field first, like firestore
+        if not orders:
+            for filter in self._filters:
+                if filter.op_string in ("<", "<=", ">", ">=", "!=", "not-in") and filter.field_path != "__name__":
+                    orders.append((filter.field_path, "ASCENDING"))
+                    break
+        if "__name__" not in [field for field, _ in orders]:
+            orders.append(("__name__", orders[-1][1] if orders else "ASCENDING"))
+        return orders
+
+    def _cursor_values(self, cursor, orders):
+        if isinstance(cursor, MemoryDocumentSnapshot):
+            return [self._field_value(cursor.reference._path, cursor._data or {}, f) for f, _ in orders]
+        if isinstance(cursor, dict):
+            values = [cursor[field] for field, _ in orders if field in cursor]
+        else:
+            values = list(cursor)
+        for i, (field, _) in enumerate(orders[: len(values)]):
+            if field == "__name__" and isinstance(values[i], str):
+                values[i] = MemoryDocumentReference(self._client, self._path + (values[i],))
+        return values
+
+    def _run(self):
+        docs = [
+            (path, data)
+            for path, data in self._client._documents_in(self._path, self._all_descendants)
+            if all(self._matches(path, data, f) for f in self._filters)
+        ]
+        orders = self._normalized_orders()
+
+        def values(item):
+            return [self._field_value(item[0], item[1], field) for field, _ in orders]
+
+        keyed = []
+        for item in docs:
+            try:
+                keyed.append((values(item), item))
+            except KeyError:
+                # documents without an ordered field are not part of the result
+                continue
+
+        def compare(a, b, count=None):
+            for (field, direction), x, y in list(zip(orders, a, b))[:count]:
+                result = _compare(x, y)
+                if result:
+                    return -result if direction == _DESCENDING else result
+            return 0
+
+        keyed.sort(key=functools.cmp_to_key(lambda a, b: compare(a[0], b[0])))
+
+        if self._start is not None:
+            cursor, inclusive = self._start
+            start = self._cursor_values(cursor, orders)
+            keyed = [
+                k for k in keyed
+                if (compare(k[0], start, len(start)) >= 0 if inclusive else compare(k[0], start, len(start)) > 0)
+            ]
+        if self._end is not None:
+            cursor, inclusive = self._end
+            end = self._cursor_values(cursor, orders)
+            keyed = [
+                k for k in keyed
+                if (compare(k[0], end, len(end)) <= 0 if inclusive else compare(k[0], end, len(end)) < 0)
+            ]
+        if self._limit is not None:
+            keyed = keyed[-self._limit :] if self._limit_to_last else keyed[: self._limit]
+
+        snapshots = []
+        for _, (path, data) in keyed:
+            if self._projection is not None:
+                projected = {}
+                for field_path in self._projection:
+                    if field_path == "__name__":
+                        continue
+                    try:
+                        _apply_field(projected, field_path, _get_field(data, field_path))
+                    except KeyError:
+                        continue
+                data = projected
+            snapshots.append(MemoryDocumentSnapshot(MemoryDocumentReference(self._client, path), data))
+        return snapshots
+
+    def stream(self, transaction=None):
+        with self._client._lock:
+            snapshots = self._run()
+            if transaction is not None:
+                for snapshot in snapshots:
+                    path = snapshot.reference._path
+                    transaction._read(path, self._client._collections[path[:-1]][path[-1]][2])
+        self._client._count_reads(len(snapshots))
+        yield from snapshots
+
+    def get(self, transaction=None):
+        return list(self.stream(transaction=transaction))
+
+
+class MemoryCollectionReference(MemoryQuery):
+    """reference to a collection, like google.cloud.firestore.CollectionReference"""
+
+    def __init__(self, client, path):
+        super().__init__(client, path)
+
+    @property
+    def id(self):
+        return self._path[-1]
+
+    @property
+    def parent(self):
+        if len(self._path) == 1:
+            return None
+        return MemoryDocumentReference(self._client, self._path[:-1])
+
+    def document(self, document_id=None):
+        return MemoryDocumentReference(self._client, self._path + (document_id or _auto_id(),))
+
+    def add(self, document_data, document_id=None):
+        doc_ref = self.document(document_id)
+        update_time = doc_ref.create(document_data)
+        return update_time, doc_ref
+
+    def list_documents(self, page_size=None):
+        with self._client._lock:
+            ids = set(self._client._collections.get(self._path, {}))
+            # documents that do not exist but have subcollections are listed too
+            depth = len(self._path)
+            for collection_path in self._client._collections:
+                if len(collection_path) > depth + 1 and collection_path[:depth] == self._path:
+                    ids.add(collection_path[depth])
+        return [self.document(doc_id) for doc_id in sorted(ids)]
+
+
+class MemoryWriteBatch:
+    """atomic batch of writes, like google.cloud.firestore.WriteBatch"""
+
+    def __init__(self, client):
+        self._client = client
+        self._writes = []
+
+    def __len__(self):
+        return len(self._writes)
+
+    def create(self, reference, document_data):
+        self._writes.append(("create", reference._path, document_data))
+
+    def set(self, reference, document_data, merge=False):
+        self._writes.append(("merge" if merge else "set", reference._path, document_data))
+
+    def update(self, reference, field_updates, option=None):
+        self._writes.append(("update", reference._path, field_updates))
+
+    def delete(self, reference, option=None):
+        self._writes.append(("delete", reference._path, None))
+
+    def commit(self, retry=None, timeout=None):
+        writes, self._writes = self._writes, []
+        update_time = self._client._write(writes)
+        return [update_time for _ in writes]
+
+
+class MemoryBulkWriter(MemoryWriteBatch):
+    """non atomic bulk writer, like google.cloud.firestore.BulkWriter; writes are sent on flush/close"""
+
+    def flush(self):
+        self.commit()
+
+    def close(self):
+        self.commit()
+
+
+class MemoryTransaction(MemoryWriteBatch):
+    """optimistic transaction, like google.cloud.firestore.Transaction, for use with
+    firestore.transactional. the update time of every document read in it (get, get_all or
+    stream with transaction=) is recorded, and the commit fails with Aborted, so that the
+    function is retried, if one of them changed in the meantime. queries only check the
+    documents they returned, not documents that would newly match them"""
+
+    def __init__(self, client, max_attempts=5, read_only=False):
+        super().__init__(client)
+        self._max_attempts = max_attempts
+        self._read_only = read_only
+        self._id = None
+        self._reads = {}
+
+    @property
+    def in_progress(self):
+        return self._id is not None
+
+    def _clean_up(self):
+        self._writes = []
+        self._reads = {}
+        self._id = None
+
+    def _begin(self, retry_id=None):
+        if self.in_progress:
+            raise ValueError(f"Cannot begin transaction {self._id!r}, it is already in progress.")
+        self._id = _auto_id().encode()
+
+    def _read(self, path, update_time):
+        # the first read of a document is the version the transaction depends on
+        self._reads.setdefault(path, update_time)
+
+    def _commit(self):
+        if not self.in_progress:
+            raise ValueError("Transaction not in progress, cannot be used in API requests.")
+        if self._read_only and self._writes:
+            raise ValueError("Cannot perform write operation in read-only transaction.")
+        update_time = self._client._write(self._writes, expected=self._reads)
+        results = [update_time for _ in self._writes]
+        self._clean_up()
+        return results
+
+    def _rollback(self):
+        self._clean_up()
+
+    def commit(self, retry=None, timeout=None):
+        raise ValueError("Transactions are committed by firestore.transactional.")
+
+
+class MemoryClient:
+    """in-memory storage engine implementing the storage interface (see create_client).
+    every client is an independent, thread safe database; nothing touches the network.
+
+    documents are kept per collection path, so collection reads only look at their own
+    collection, and collection group reads only at the collections with that id
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        # collection path -> {document id: (data, create_time, update_time)}
+        self._collections = {}
+        # collection id -> set of collection paths, for collection group queries
+        self._groups = {}
+        self.reads = 0
+        self.writes = 0
+
+    def _count_reads(self, count):
+        with self._lock:
+            self.reads += count
+
+    ### references
+    def collection(self, *collection_path):
+        path = _split_path("/".join(collection_path))
+        if len(path) % 2 != 1:
+            raise ValueError(f"{'/'.join(path)} is not a collection path")
+        return MemoryCollectionReference(self, path)
+
+    def document(self, *document_path):
+        path = _split_path("/".join(document_path))
+        if len(path) % 2 != 0 or not path:
+            raise ValueError(f"{'/'.join(path)} is not a document path")
+        return MemoryDocumentReference(self, path)
+
+    def collection_group(self, collection_id):
+        return MemoryQuery(self, (collection_id,), all_descendants=True)
+
+    def collections(self):
+        with self._lock:
+            ids = sorted({path[0] for path in self._collections})
+        return [MemoryCollectionReference(self, (collection_id,)) for collection_id in ids]
+
+    ### reads
+    def get_all(self, references, field_paths=None, transaction=None):
+        snapshots = [self._snapshot(reference._path, count=False) for reference in references]
+        if transaction is not None:
+            for snapshot in snapshots:
+                transaction._read(snapshot.reference._path, snapshot.update_time)
+        self._count_reads(len(snapshots))
+        yield from snapshots
+
+    def _snapshot(self, path, count=True):
+        with self._lock:
+            stored = self._collections.get(path[:-1], {}).get(path[-1])
+        if count:
+            self._count_reads(1)
+        reference = MemoryDocumentReference(self, path)
+        if stored is None:
+            return MemoryDocumentSnapshot(reference, None)
+        data, create_time, update_time = stored
+        return MemoryDocumentSnapshot(reference, data, create_time, update_time)
+
+    def _documents_in(self, path, all_descendants):
+        """(document path, data) for a collection, or for a collection group"""
+        if all_descendants:
+            collection_paths = sorted(self._groups.get(path[-1], ()))
+        else:
+            collection_paths = [path]
+        for collection_path in collection_paths:
+            for doc_id, (data, _, _) in self._collections.get(collection_path, {}).items():
+                yield collection_path + (doc_id,), data
+
+    def _subcollection_ids(self, doc_path):
+        depth = len(doc_path)
+        with self._lock:
+            return sorted(
+                {
+                    collection_path[depth]
+                    for collection_path in self._collections
+                    if len(collection_path) > depth and collection_path[:depth] == doc_path
+                }
+            )
+
+    ### writes
+    def batch(self):
+        return MemoryWriteBatch(self)
+
+    def bulk_writer(self, options=None):
+        return MemoryBulkWriter(self)
+
+    def transaction(self, max_attempts=5, read_only=False):
+        return MemoryTransaction(self, max_attempts, read_only)
+
+    def _write(self, writes, expected=None):
+        """apply (kind, path, data) writes atomically, firestore style errors on failure.
+        expected is {path: update time (None if missing)} of documents that must be unchanged"""
+        with self._lock:
+            for path, update_time in (expected or {}).items():
+                stored = self._collections.get(path[:-1], {}).get(path[-1])
+                if (stored[2] if stored else None) != update_time:
+                    raise exceptions.Aborted(f"Transaction read a document that has changed: {'/'.join(path)}")
+            # validate everything first so a failing write leaves the store untouched
+            for kind, path, _ in writes:
+                exists = path[-1] in self._collections.get(path[:-1], {})
+                if kind == "create" and exists:
+                    raise exceptions.AlreadyExists(f"Document already exists: {'/'.join(path)}")
+                if kind == "update" and not exists:
+                    raise exceptions.NotFound(f"No document to update: {'/'.join(path)}")
+
+            update_time = _now()
+            for kind, path, document_data in writes:
+                collection_path, doc_id = path[:-1], path[-1]
+                documents = self._collections.get(collection_path)
+                if kind == "delete":
+                    if documents is not None:
+                        documents.pop(doc_id, None)
+                        if not documents:
+                            self._drop_collection(collection_path)
+                    continue
+
+                if documents is None:
+                    documents = self._collections[collection_path] = {}
+                    self._groups.setdefault(collection_path[-1], set()).add(collection_path)
+                previous = documents.get(doc_id)
+                create_time = previous[1] if previous else update_time
+                if kind in ("create", "set"):
+                    data = _resolve(document_data)
+                elif kind == "merge":
+                    data = _copy(previous[0]) if previous else {}
+                    _merge(data, document_data)
+                else:
+                    data = _copy(previous[0])
+                    for field_path, value in document_data.items():
+                        _apply_field(data, field_path, value)
+                documents[doc_id] = (data, create_time, update_time)
+            self.writes += len(writes)
+            return update_time
+
+    def _drop_collection(self, collection_path):
+        self._collections.pop(collection_path, None)
+        group = self._groups.get(collection_path[-1])
+        if group is not None:
+            group.discard(collection_path)
+
+    def recursive_delete(self, reference, *, bulk_writer=None, chunk_size=5000):
+        """delete a document or collection and everything under it
+
+        Returns:
+            int: number of documents deleted
+        """
+        path = reference._path
+        with self._lock:
+            doomed = [
+                collection_path + (doc_id,)
+                for collection_path, documents in self._collections.items()
+                if len(collection_path) >= len(path) and collection_path[: len(path)] == path
+                for doc_id in documents
+            ]
+            if isinstance(reference, MemoryDocumentReference):
+                doomed.append(path)
+            self._write([("delete", doc_path, None) for doc_path in doomed])
+        return len(doomed)
+
+
+# storage calls that read documents / write documents; every call is one round trip
+_READ_CALLS = {"get", "get_all", "stream", "collections", "list_documents"}
+_WRITE_CALLS = {"add", "create", "set", "update", "delete"}
+_COMMIT_CALLS = {"commit", "_commit", "flush", "close"}
+
+
+class StoreCounters:
+    """storage calls, document reads and document writes, per thread (so a request handled by a
+    thread can measure itself) and for the whole process"""
+
+    def __init__(self):
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self.totals = {"calls": 0, "reads": 0, "writes": 0}
+
+    def current(self):
+        """
+        Returns:
+            dict: calls, reads and writes made by the current thread since it started
+        """
+        if not hasattr(self._local, "counts"):
+            self._local.counts = {"calls": 0, "reads": 0, "writes": 0}
+        return self._local.counts
+
+    def add(self, calls=0, reads=0, writes=0):
+        counts = self.current()
+        counts["calls"] += calls
+        counts["reads"] += reads
+        counts["writes"] += writes
+        with self._lock:
+            self.totals["calls"] += calls
+            self.totals["reads"] += reads
+            self.totals["writes"] += writes
+
+
+def _is_storage_object(value):
+    module = type(value).__module__
+    return module.startswith("google.cloud.firestore") or module == __name__
+
+
+class _Proxy:
+    """base of the wrappers around storage objects, _target is the wrapped object"""
+
+    def __init__(self, target):
+        self._target = target
+
+    def __iter__(self):
+        return iter(self._target)
+
+    def __repr__(self):
+        return f"<{type(self).__name__} {self._target!r}>"
+
+
+def _unwrap(value):
+    if isinstance(value, _Proxy):
+        return value._target
+    if isinstance(value, (list, tuple)):
+        return type(value)(_unwrap(v) for v in value)
+    if isinstance(value, dict):
+        return {k: _unwrap(v) for k, v in value.items()}
+    if isinstance(value, firestore.FieldFilter) and isinstance(value.value, _Proxy):
+        # FieldFilter on __name__ compares against a document reference; the caller's filter is kept
+        return firestore.FieldFilter(value.field_path, value.op_string, value.value._target)
+    return value
+
+
+def _queues_writes(kind):
+    """batches, bulk writers and transactions queue their writes until they are committed"""
+    return "Batch" in kind or "BulkWriter" in kind or "Transaction" in kind
+
+
+class _CountingProxy(_Proxy):
+    """wraps any storage object (client, reference, query, batch, snapshot) and counts the
+    round trips, documents read and documents written through it"""
+
+    def __init__(self, target, counters):
+        super().__init__(target)
+        self._counters = counters
+        self._kind = type(target).__name__
+
+    def _wrap(self, value):
+        if _is_storage_object(value) and not isinstance(value, (str, bytes)):
+            return _CountingProxy(value, self._counters)
+        return value
+
+    def _count_snapshots(self, snapshots):
+        for snapshot in snapshots:
+            self._counters.add(reads=1)
+            yield self._wrap(snapshot)
+
+    def __getattr__(self, name):
+        attribute = getattr(self._target, name)
+        if not callable(attribute) or isinstance(attribute, type):
+            return self._wrap(attribute)
+
+        def call(*args, **kwargs):
+            result = attribute(*_unwrap(args), **_unwrap(kwargs))
+            kind = self._kind
+            if name in _READ_CALLS and "Snapshot" not in kind:
+                self._counters.add(calls=1)
+                if name == "get" and "Document" in kind:
+                    self._counters.add(reads=1)
+                    return self._wrap(result)
+                if name in ("collections", "list_documents"):
+                    return [self._wrap(r) for r in result]
+                if name == "get":
+                    return list(self._count_snapshots(result))
+                return self._count_snapshots(result)
+            if name in _WRITE_CALLS and not _queues_writes(kind):
+                self._counters.add(calls=1, writes=1)
+            elif name in _WRITE_CALLS:
+                # queued in a batch, sent on commit
+                self._counters.add(writes=1)
+            elif name in _COMMIT_CALLS:
+                self._counters.add(calls=1)
+            elif name == "recursive_delete":
+                self._counters.add(calls=1, writes=result)
+            if name == "add":
+                return result[0], self._wrap(result[1])
+            return self._wrap(result)
+
+        return call
+
+
+class CountingClient(_CountingProxy):
+    """storage client wrapper counting round trips, document reads and document writes
+    (see StoreCounters) made through any object it hands out; works with either backend
+
+    Args:
+        client (google.cloud.firestore.Client or MemoryClient): client to wrap
+        counters (StoreCounters, optional): where to count. Defaults to a new StoreCounters.
+    """
+
+    def __init__(self, client, counters: StoreCounters = None):
+        super().__init__(client, counters or StoreCounters())
+
+    @property
+    def counters(self):
+        return self._counters
+
+    @property
+    def client(self):
+        """the wrapped client"""
+        return self._target
+
+
+# AsyncClient calls that are coroutines / async iterators, everything else (references, queries,
+# batch.set, snapshot.get) stays synchronous like in google.cloud.firestore
+_ASYNC_CALLS = {
+    "get", "create", "set", "update", "delete", "add", "commit", "recursive_delete", "_begin", "_commit", "_rollback",
+}
+_ASYNC_ITERATOR_CALLS = {"stream", "get_all", "collections", "list_documents"}
+
+
+class _AsyncProxy(_Proxy):
+    """gives a memory engine object the interface of its google.cloud.firestore async twin"""
+
+    def __getattr__(self, name):
+        attribute = getattr(self._target, name)
+        if not callable(attribute) or isinstance(attribute, type):
+            return _wrap_async(attribute)
+        kind = type(self._target).__name__
+        # queueing writes is synchronous, sending them is not
+        synchronous = "Snapshot" in kind or (
+            _queues_writes(kind) and name not in ("commit", "_begin", "_commit", "_rollback")
+        )
+
+        if name in _ASYNC_ITERATOR_CALLS and not synchronous:
+
+            async def iterate(*args, **kwargs):
+                for item in attribute(*_unwrap(args), **_unwrap(kwargs)):
+                    yield _wrap_async(item)
+                    # let other tasks run between documents, like a real stream would
+                    await asyncio.sleep(0)
+
+            return iterate
+
+        if name in _ASYNC_CALLS and not synchronous:
+
+            async def call(*args, **kwargs):
+                await asyncio.sleep(0)
+                result = attribute(*_unwrap(args), **_unwrap(kwargs))
+                if name == "add":
+                    return result[0], _wrap_async(result[1])
+                if isinstance(result, list):
+                    return [_wrap_async(item) for item in result]
+                return _wrap_async(result)
+
+            return call
+
+        def call(*args, **kwargs):
+            return _wrap_async(attribute(*_unwrap(args), **_unwrap(kwargs)))
+
+        return call
+
+
+def _wrap_async(value):
+    if _is_storage_object(value) and not isinstance(value, (str, bytes)):
+        return _AsyncProxy(value)
+    return value
+
+
+class AsyncMemoryClient(_AsyncProxy):
+    """MemoryClient with the asyncio interface of google.cloud.firestore.AsyncClient:
+    get / add / set / update / delete / commit / recursive_delete are awaited, stream / get_all /
+    collections / list_documents are async iterators
+
+    Args:
+        client (MemoryClient, optional): engine to share. Defaults to a new MemoryClient.
+    """
+
+    def __init__(self, client: MemoryClient = None):
+        super().__init__(client or MemoryClient())
+
+    @property
+    def engine(self):
+        return self._target
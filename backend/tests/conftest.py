@@ -0,0 +1,33 @@
+import pytest
+
+import app as app_module
+import auth_helper
+import data_helper
+import exercise_index
+import recommender
+import storage
+
+
+def clear_caches():
+    """empty every process wide cache, so nothing read from one database leaks into the next test"""
+    data_helper._premade_trees.clear()
+    data_helper.user_cache.clear()
+    exercise_index.clear()
+    recommender._premade_workouts.clear()
+    auth_helper.token_cache.clear()
+
+
+@pytest.fixture
+def db(mocker):
+    """a fresh memory engine, also used by the app's routes"""
+    clear_caches()
+    db = storage.MemoryClient()
+    mocker.patch.object(app_module, "db", db)
+    yield db
+    clear_caches()
+
+
+@pytest.fixture
+def client():
+    with app_module.app.test_client() as client:
+        yield client
@@ -0,0 +1,188 @@
+import asyncio
+import gzip
+import json
+import msgpack
+import pytest
+from datetime import datetime
+from unittest.mock import ANY
+
+import app as app_module
+import asgi_app
+import async_helper
+import data_helper
+import log_helper
+import recommender
+import storage
+
+
+def call(method, path, body=None, headers=None):
+    """run one request through the ASGI app, returns (status, headers, body)"""
+    query = b""
+    if "?" in path:
+        path, query = path.split("?", 1)
+        query = query.encode()
+    scope = {
+        "type": "http",
+        "http_version": "1.1",
+        "method": method,
+        "path": path,
+        "query_string": query,
+        "headers": [(k.lower().encode(), v.encode()) for k, v in (headers or {}).items()],
+    }
+    if body is not None and not isinstance(body, bytes):
+        body = json.dumps(body).encode()
+        scope["headers"].append((b"content-type", b"application/json"))
+    if body is not None:
+        scope["headers"].append((b"content-length", str(len(body)).encode()))
+    messages = [{"type": "http.request", "body": body or b""}]
+    sent = []
+
+    async def receive():
+        return messages.pop(0)
+
+    async def send(message):
+        sent.append(message)
+
+    asyncio.run(asgi_app.app(scope, receive, send))
+    start = sent[0]
+    response_headers = {k.decode().lower(): v.decode() for k, v in start["headers"]}
+    body = b"".join(message.get("body", b"") for message in sent[1:])
+    if response_headers.get("content-encoding") == "gzip":
+        body = gzip.decompress(body)
+    if response_headers.get("content-type") == "application/msgpack":
+        return start["status"], response_headers, msgpack.unpackb(body)
+    if response_headers.get("content-type") == "application/json":
+        return start["status"], response_headers, json.loads(body)
+    return start["status"], response_headers, body or None
+
+
+@pytest.fixture
+def async_db(db, mocker):
+    """the AsyncClient of the native routes, on the engine of db"""
+    async_db = storage.AsyncMemoryClient(db)
+    mocker.patch.object(asgi_app, "db", async_db)
+    return async_db
+
+
+def user_with_history(db):
+    eids = [data_helper.create_user_exercise("u1", {"name": m, "muscle": m}, db) for m in recommender.muscles[:6]]
+    template_id = data_helper.create_template_workout("u1", {"name": "t"}, db)
+    today = datetime.now().strftime("%Y-%m-%d")
+    for eid in eids[:3]:
+        data_helper.create_completed_workout("u1", template_id, {"dateCompleted": today, "exercises": [f"3|10|0|{eid}"]}, db)
+    data_helper.create_pain("u1", {"date": today, "pain_level": 8, "body_part": recommender.muscles[0]}, db)
+    return eids
+
+
+def test_crud_round_trip(db):
+    status, _, body = call("POST", "/users/u1/exercises", {"name": "Curl", "muscle": recommender.BICEPS})
+    assert status == 201
+    exercise_id = body["id"]
+
+    assert call("GET", f"/users/u1/exercises/{exercise_id}")[2] == {"name": "Curl", "muscle": recommender.BICEPS, "updated_at": ANY}
+    assert call("DELETE", f"/users/u1/exercises/{exercise_id}")[0] == 200
+    assert call("GET", f"/users/u1/exercises/{exercise_id}")[0] == 404
+    assert call("GET", "/users/u1/exercises?limit=0")[0] == 400
+    assert call("GET", "/nope")[0] == 404
+
+
+def test_same_answers_as_flask_app(db):
+    for i in range(40):
+        call("POST", "/users/u1/journals", {"title": f"journal {i}", "text": "x" * 20})
+
+    with app_module.app.test_client() as client:
+        for path, headers in [
+            ("/users/u1/journals", {}),
+            ("/users/u1/journals", {"Accept": "application/msgpack", "Accept-Encoding": "gzip"}),
+            ("/users/u1/journals?limit=0", {"Accept": "application/msgpack"}),
+        ]:
+            status, response_headers, data = call("GET", path, headers=headers)
+            expected = client.get(path, headers=headers)
+            expected_data = expected.data
+            if expected.headers.get("Content-Encoding") == "gzip":
+                expected_data = gzip.decompress(expected_data)
+            if expected.mimetype == "application/msgpack":
+                expected_data = msgpack.unpackb(expected_data)
+            else:
+                expected_data = json.loads(expected_data)
+            assert (status, data) == (expected.status_code, expected_data), path
+            assert response_headers.get("etag") == expected.headers.get("ETag"), path
+
+
+def test_native_routes_answer_like_flask_app(async_db, db, client, mocker):
+    eids = user_with_history(db)
+    workout = [{"eid": eid} for eid in eids[:2]] + [{"name": "no eid"}]
+    requests = [
+        ("POST", "/recommend/u1/exercise", workout),
+        ("POST", "/recommend/u1/ranked?k=3", workout),
+        ("POST", "/recommend/u1/ranked?k=99", workout),
+        ("GET", "/users/u1/workouts/ALL/completed?fields=dateCompleted", None),
+        ("GET", "/users/u1/workouts/ALL/completed?fields=a..b", None),
+        ("GET", "/users/u1/sync", None),
+        ("GET", "/users/u1/sync?since=yesterday", None),
+    ]
+    expected = [client.open(path, method=method, json=body) for method, path, body in requests]
+    expected = [(response.status_code, response.get_json()) for response in expected]
+
+    # served by the async views, not by the flask routes
+    for name in ("recommend_exercise", "recommend_ranked"):
+        mocker.patch.object(recommender, name, side_effect=AssertionError)
+    for name in ("get_all_completed_workouts_all", "get_changes"):
+        mocker.patch.object(data_helper, name, side_effect=AssertionError)
+    for (method, path, body), (expected_status, expected_data) in zip(requests, expected):
+        status, headers, data = call(method, path, body)
+        if status == 200 and "watermark" in data:
+            data["watermark"] = expected_data["watermark"] = ANY
+        assert (status, data) == (expected_status, expected_data), path
+        assert headers["x-request-id"]
+
+
+def test_sync_reads_collections_together(async_db, db, mocker):
+    user_with_history(db)
+    in_flight, peak = [0], [0]
+    snapshots = async_helper._snapshots
+
+    async def tracked(query):
+        in_flight[0] += 1
+        peak[0] = max(peak[0], in_flight[0])
+        try:
+            # a round trip to firestore
+            await asyncio.sleep(0)
+            return await snapshots(query)
+        finally:
+            in_flight[0] -= 1
+
+    mocker.patch.object(async_helper, "_snapshots", tracked)
+    first = asyncio.run(async_helper.get_changes("u1", None, async_db))
+    assert first == {**data_helper.get_changes("u1", None, db), "watermark": first["watermark"]}
+    assert peak[0] == len(data_helper.SYNC_COLLECTIONS)
+    asyncio.run(async_helper.get_changes("u1", first["watermark"], async_db))
+    # and the tombstones
+    assert peak[0] == len(data_helper.SYNC_COLLECTIONS) + 1
+
+
+def test_streamed_and_other_requests_go_to_flask_app(async_db, db):
+    eids = user_with_history(db)
+    status, headers, body = call("GET", "/users/u1/workouts/ALL/completed?stream=ndjson")
+    assert status == 200 and headers["content-type"] == "application/x-ndjson"
+    assert body.count(b"\n") == 3
+    # the body read to pick the view is passed on
+    status, _, body = call("POST", "/recommend/u1/exercise?stream=json", [{"eid": eids[0]}])
+    assert status == 200 and body["status"] == "success"
+    assert call("PUT", "/recommend/u1/exercise", [])[0] == 405
+
+
+def test_lifespan_configures_logging(mocker):
+    configure = mocker.patch.object(log_helper, "configure_logging")
+    messages = [{"type": "lifespan.startup"}, {"type": "lifespan.shutdown"}]
+    sent = []
+
+    async def receive():
+        return messages.pop(0)
+
+    async def send(message):
+        sent.append(message)
+
+    asyncio.run(asgi_app.app({"type": "lifespan"}, receive, send))
+    configure.assert_called_once_with()
+    assert [m["type"] for m in sent] == ["lifespan.startup.complete", "lifespan.shutdown.complete"]
@@ -1,4 +1,5 @@
 import pytest
+import time
 from flask import Flask
 from firebase_admin import auth
 from app import app
@@ -31,3 +32,47 @@ def test_verify_token_missing_token(client):
     response = client.post('/verify-token', json={})
     assert response.status_code == 401
     assert "error" in response.json
+
+@pytest.fixture
+def token_cache():
+    import auth_helper
+    auth_helper.token_cache.clear()
+    yield auth_helper.token_cache
+    auth_helper.token_cache.clear()
+
+def test_verify_token_cached(client, mocker, token_cache):
+    # a token that is still valid is only verified by firebase once
+    mock_decoded_token = {"uid": "test_uid", "exp": time.time() + 3600}
+    verify = mocker.patch.object(auth, 'verify_id_token', return_value=mock_decoded_token)
+
+    for _ in range(3):
+        response = client.post('/verify-token', json={'token': 'cached_token'})
+        assert response.status_code == 200
+        assert response.json == {"uid": "test_uid"}
+    assert verify.call_count == 1
+    assert token_cache.stats()["hits"] == 2
+
+def test_verify_token_expired_not_cached(client, mocker, token_cache):
+    mock_decoded_token = {"uid": "test_uid", "exp": time.time() - 1}
+    verify = mocker.patch.object(auth, 'verify_id_token', return_value=mock_decoded_token)
+
+    client.post('/verify-token', json={'token': 'old_token'})
+    client.post('/verify-token', json={'token': 'old_token'})
+    assert verify.call_count == 2
+
+def test_require_auth(mocker, token_cache):
+    import auth_helper
+    test_app = Flask(__name__)
+
+    @test_app.route("/users/<uid>/thing")
+    @auth_helper.require_auth
+    def thing(uid):
+        return {"uid": uid}
+
+    mocker.patch.object(auth, 'verify_id_token', return_value={"uid": "me", "exp": time.time() + 3600})
+    with test_app.test_client() as test_client:
+        assert test_client.get("/users/me/thing").status_code == 401
+        response = test_client.get("/users/me/thing", headers={"Authorization": "Bearer tok"})
+        assert response.status_code == 200
+        response = test_client.get("/users/other/thing", headers={"Authorization": "Bearer tok"})
+        assert response.status_code == 403
@@ -0,0 +1,159 @@
+import pytest
+from unittest.mock import ANY
+from google.api_core import exceptions
+
+import data_helper
+import storage
+
+
+def test_batch_applies_every_operation(db):
+    exercise_id = data_helper.create_user_exercise("u1", {"name": "Curl"}, db)
+    journal_id = data_helper.create_journal("u1", {"title": "old"}, db)
+    template_id = data_helper.create_template_workout("u1", {"name": "Legs"}, db)
+
+    results = data_helper.commit_batch("u1", [
+        {"op": "create", "collection": "completed", "template_id": template_id, "data": {"notes": "done"}},
+        {"op": "create", "collection": "pain", "data": {"date": "2024-05-01", "pain_level": 3, "body_part": "Chest", "x": 1}},
+        {"op": "update", "collection": "exercises", "id": exercise_id, "data": {"name": "Hammer Curl"}},
+        {"op": "delete", "collection": "journals", "id": journal_id},
+    ], db)
+
+    assert [(r["index"], r["op"], r["collection"]) for r in results] == [
+        (0, "create", "completed"), (1, "create", "pain"), (2, "update", "exercises"), (3, "delete", "journals"),
+    ]
+    completed_id, pain_id = results[0]["id"], results[1]["id"]
+    assert data_helper.get_completed_workout("u1", template_id, completed_id, db) == {"notes": "done", "updated_at": ANY}
+    # pain notes keep only their fields
+    assert db.document(f"users/u1/pain/{pain_id}").get().to_dict() == {
+        "date": "2024-05-01", "pain_level": 3, "body_part": "Chest", "updated_at": ANY,
+    }
+    assert data_helper.get_user_exercise("u1", exercise_id, db)["name"] == "Hammer Curl"
+    assert data_helper.get_all_journals("u1", db) == []
+
+
+def test_batch_reports_every_invalid_operation(db):
+    with pytest.raises(data_helper.BatchError) as e:
+        data_helper.commit_batch("u1", [
+            {"op": "create", "collection": "journals", "data": {"title": "ok"}},
+            {"op": "upsert", "collection": "journals", "data": {}},
+            {"op": "create", "collection": "pain", "data": {"pain_level": 11}},
+            {"op": "create", "collection": "completed", "data": {}},
+            {"op": "delete", "collection": "workouts", "id": "t1"},
+            {"op": "update", "collection": "exercises", "data": {"name": "x"}},
+        ], db)
+    assert [error["index"] for error in e.value.errors] == [1, 2, 3, 4, 5]
+    assert e.value.errors[1]["error"] == "Pain level must be an integer between 1 and 10."
+    assert data_helper.get_all_journals("u1", db) == []
+
+    with pytest.raises(data_helper.BatchError):
+        data_helper.commit_batch("u1", [], db)
+    with pytest.raises(data_helper.BatchError):
+        data_helper.commit_batch("u1", [{"op": "delete", "collection": "pain", "id": "p"}] * 501, db)
+
+
+def test_batch_is_atomic_and_invalidates(db):
+    data_helper.create_journal("u1", {"title": "first"}, db)
+    assert len(data_helper.get_all_journals("u1", db)) == 1
+
+    with pytest.raises(exceptions.NotFound):
+        data_helper.commit_batch("u1", [
+            {"op": "create", "collection": "journals", "data": {"title": "second"}},
+            {"op": "update", "collection": "exercises", "id": "missing", "data": {"name": "x"}},
+        ], db)
+    assert len(data_helper.get_all_journals("u1", db)) == 1
+
+    data_helper.commit_batch("u1", [{"op": "create", "collection": "journals", "data": {"title": "second"}}], db)
+    assert len(data_helper.get_all_journals("u1", db)) == 2
+
+
+def test_batch_bumps_versions_in_the_same_write(db, mocker):
+    versions_before = data_helper.get_collection_version("u1", "journals", db)
+    bump = mocker.spy(data_helper, "bump_versions")
+    commit = mocker.spy(storage.MemoryWriteBatch, "commit")
+    data_helper.commit_batch("u1", [{"op": "create", "collection": "journals", "data": {"title": "a"}}], db)
+    assert commit.call_count == 1 and bump.call_count == 0
+    assert data_helper.get_collection_version("u1", "journals", db) != versions_before
+
+    # the version bump takes one of the BATCH_LIMIT writes
+    mocker.patch.object(data_helper, "BATCH_LIMIT", 3)
+    with pytest.raises(data_helper.BatchError):
+        data_helper.commit_batch("u1", [{"op": "delete", "collection": "journals", "id": "j"}] * 2, db)
+    data_helper.commit_batch("u1", [{"op": "delete", "collection": "journals", "id": "j"}], db)
+
+
+def test_failed_version_bump_keeps_the_write(db, client, mocker):
+    mocker.patch.object(data_helper, "bump_versions", side_effect=exceptions.ServiceUnavailable("down"))
+    response = client.post("/users/u1/journals", json={"title": "a"})
+    assert response.status_code == 201
+    assert data_helper.get_all_journals("u1", db)[0]["title"] == "a"
+
+    # pain notes bump their version in the write's own transaction
+    response = client.post("/add-pain", json={"uid": "u1", "date": "2024-05-01", "pain_level": 3, "body_part": "Chest"})
+    assert response.status_code == 200
+    assert data_helper.get_collection_version("u1", "pain", db) != "0"
+
+
+def test_batch_route(db, client):
+    response = client.post("/users/u1/batch", json={"operations": [
+        {"op": "create", "collection": "medications", "data": {"title": "a"}},
+    ]})
+    assert response.status_code == 200
+    medication_id = response.json["results"][0]["id"]
+    assert data_helper.get_all_medications("u1", db) == [{"title": "a", "id": medication_id, "updated_at": ANY}]
+
+    response = client.post("/users/u1/batch", json=[{"op": "create", "collection": "nope", "data": {}}])
+    assert response.status_code == 400
+    assert response.json["errors"][0]["index"] == 0
+
+    response = client.post("/users/u1/batch", json=[
+        {"op": "update", "collection": "medications", "id": "missing", "data": {"title": "b"}},
+    ])
+    assert response.status_code == 404
+
+
+def test_import_records(db, mocker):
+    records = [{"date": f"2024-01-{day:02d}", "pain_level": 1 + day % 10, "body_part": "Chest"} for day in range(1, 29)]
+    records[3] = {"date": "2024-01-04", "pain_level": 0, "body_part": "Chest"}
+    records[7] = ValueError("Invalid json: x")
+    data_helper.get_all_pain("u1", db)
+
+    # 26 valid records, in 6 batched writes
+    mocker.patch.object(data_helper, "BATCH_LIMIT", 5)
+    batch = mocker.spy(db, "batch")
+    results = data_helper.import_records("u1", "pain", records, db)
+    assert batch.call_count == 6
+    assert [result["index"] for result in results] == list(range(28))
+    assert results[3] == {"index": 3, "error": "Pain level must be an integer between 1 and 10."}
+    assert results[7] == {"index": 7, "error": "Invalid json: x"}
+    stored = {pain["hash_id"]: pain for pain in data_helper.get_all_pain("u1", db)}
+    assert len(stored) == 26
+    assert stored[results[0]["id"]]["date"] == "2024-01-01"
+
+    with pytest.raises(ValueError):
+        data_helper.import_records("u1", "journals", records, db)
+
+
+def test_parse_records():
+    assert data_helper.parse_records(b'[{"a": 1}]') == [{"a": 1}]
+    assert data_helper.parse_records(b'{"records": [{"a": 1}]}') == [{"a": 1}]
+    records = data_helper.parse_records(b'{"a": 1}\n\nnope\n{"a": 2}\n', ndjson=True)
+    assert records[0] == {"a": 1} and isinstance(records[1], ValueError) and records[2] == {"a": 2}
+    for body in (b"", b"[]", b'{"a": 1}', b"nope"):
+        with pytest.raises(ValueError):
+            data_helper.parse_records(body)
+
+
+def test_import_routes(db, client):
+    response = client.post(
+        "/users/u1/pain/bulk",
+        data='{"date": "2024-01-01", "pain_level": 3, "body_part": "Chest"}\n{"pain_level": 30}\n',
+        content_type="application/x-ndjson",
+    )
+    assert response.status_code == 200
+    assert (response.json["imported"], response.json["failed"]) == (1, 1)
+
+    response = client.post("/users/u1/workouts/t1/completed/bulk", json=[{"notes": "a"}, {"notes": "b"}, []])
+    assert (response.json["imported"], response.json["failed"]) == (2, 1)
+    assert sorted(c["notes"] for c in data_helper.get_all_completed_workouts("u1", "t1", db)) == ["a", "b"]
+
+    assert client.post("/users/u1/pain/bulk", json=[]).status_code == 400
@@ -0,0 +1,103 @@
+import pytest
+import random
+from datetime import datetime
+
+import batch_recommender
+import data_helper
+from recommender import *
+
+
+EXERCISES = {muscle: {"muscle": muscle} for muscle in muscles}
+
+
+def workout_of(*parts):
+    return [{"eid": muscle} for muscle in parts]
+
+
+def test_matches_pick_muscle_on_random_workouts():
+    rng = random.Random(3)
+    workouts = [workout_of(*rng.choices(muscles, k=rng.randint(0, 9))) for _ in range(3000)]
+    assert batch_recommender.pick_muscles(workouts, EXERCISES) == [pick_muscle(w, EXERCISES) for w in workouts]
+
+
+@pytest.mark.parametrize(
+    "workout, expected",
+    [
+        # arms, ties go to the first arm choice
+        (workout_of(BICEPS, TRICEPS), SHOULDERS),
+        (workout_of(BICEPS, TRICEPS, SHOULDERS), FOREARMS),
+        # mid body
+        (workout_of(CHEST, ABS, BACK), TRAPS),
+        # upper body, no group has a majority on its own; SHOULDERS is listed twice
+        (workout_of(BICEPS, BACK, GLUTES), TRICEPS),
+        (workout_of(BICEPS, TRICEPS, BACK, GLUTES, HAMSTRINGS), SHOULDERS),
+        (workout_of(BICEPS, TRICEPS, SHOULDERS, BACK, CHEST, TRAPS, ABS, GLUTES, HAMSTRINGS, QUADRICEPS, QUADRICEPS), FOREARMS),
+        # legs
+        (workout_of(GLUTES, QUADRICEPS), HAMSTRINGS),
+        # full body, first least worked muscle
+        (workout_of(GLUTES, BICEPS), ABS),
+        ([], ABS),
+    ],
+)
+def test_group_priority_and_ties(workout, expected):
+    assert pick_muscle(workout, EXERCISES) == expected
+    assert batch_recommender.pick_muscles([workout], EXERCISES) == [expected]
+
+
+def test_unknown_exercise_fails_like_pick_muscle():
+    with pytest.raises(KeyError):
+        batch_recommender.pick_muscles([workout_of(BICEPS), [{"eid": "gone"}]], EXERCISES)
+    assert batch_recommender.pick_muscles([], EXERCISES) == []
+
+
+def test_recommendations_report_invalid_workouts():
+    recent_pain = [{"date": "2024-05-02", "body_part": FOREARMS, "pain_level": 9}]
+    results = batch_recommender.recommendations(
+        [workout_of(BICEPS, TRICEPS, SHOULDERS), [{"eid": "gone"}], workout_of(GLUTES, QUADRICEPS)],
+        {**EXERCISES, "odd": {"muscle": ["x"]}},
+        recent_pain,
+    )
+    assert results == [
+        {"recommended": FOREARMS, "intensity": "lower"},
+        {"error": "Exercise not found: gone"},
+        {"recommended": HAMSTRINGS, "intensity": "same"},
+    ]
+    assert batch_recommender.recommendations([[{"eid": "odd"}]], {"odd": {"muscle": ["x"]}}, []) == [
+        {"error": "Exercise has no known muscle: odd"},
+    ]
+
+
+def test_parse_workouts():
+    assert batch_recommender.parse_workouts([[{"eid": "a"}, {"eid": ""}, {"name": "x"}]]) == [[{"eid": "a"}]]
+    assert batch_recommender.parse_workouts({"workouts": [[]]}) == [[]]
+    for body in (None, [], {"workouts": []}, [{"eid": "a"}], [[1]]):
+        with pytest.raises(ValueError):
+            batch_recommender.parse_workouts(body)
+
+
+def test_recommend_routes(db, client):
+    eids = {muscle: data_helper.create_user_exercise("u1", {"muscle": muscle}, db) for muscle in muscles}
+    today = datetime.now().strftime("%Y-%m-%d")
+    data_helper.create_pain("u1", {"date": today, "pain_level": 2, "body_part": HAMSTRINGS}, db)
+
+    response = client.post("/recommend/u1/exercises", json=[
+        [{"eid": eids[GLUTES]}, {"eid": eids[QUADRICEPS]}],
+        [{"eid": eids[BICEPS]}, {"eid": "gone"}],
+    ])
+    assert response.status_code == 200
+    assert response.json["recommendations"] == [
+        {"recommended": HAMSTRINGS, "intensity": "higher"},
+        {"error": "Exercise not found: gone"},
+    ]
+    assert client.post("/recommend/u1/exercises", json=[]).status_code == 400
+
+    legs = data_helper.create_template_workout(
+        "u1", {"name": "Legs", "exercises": [f"3|10|0|{eids[GLUTES]}", f"3|10|0|{eids[QUADRICEPS]}", "bad"]}, db
+    )
+    empty = data_helper.create_template_workout("u1", {"name": "Empty"}, db)
+    response = client.get("/recommend/u1/templates")
+    assert response.status_code == 200
+    assert response.json["recommendations"] == {
+        legs: {"recommended": HAMSTRINGS, "intensity": "higher"},
+        empty: {"recommended": ABS, "intensity": "same"},
+    }
@@ -0,0 +1,40 @@
+import sys
+import os
+
+# Add the parent directory to sys.path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import app as app_module
+from benchmarks import bench_endpoints
+
+TINY = {"exercises": 4, "templates": 1, "completed": 2, "pain": 3, "journals": 1, "medications": 1}
+
+
+def test_percentile():
+    samples = list(range(1, 101))
+    assert bench_endpoints.percentile(samples, 50) == 50
+    assert bench_endpoints.percentile(samples, 99) == 99
+    assert bench_endpoints.percentile([7], 95) == 7
+
+
+def test_every_route_benchmarked():
+    original_db = app_module.db
+    report = bench_endpoints.run({"tiny": TINY}, iterations=2, memory_samples=1)
+
+    assert app_module.db is original_db
+    assert report["unbenchmarked_routes"] == []
+    for result in report["results"]:
+        assert all(status.startswith("2") for status in result["statuses"]), result
+        assert result["p50_ms"] <= result["p95_ms"] <= result["p99_ms"]
+        assert result["peak_kib"] > 0
+    reads = {r["route"]: r for r in report["results"]}
+    assert reads["read exercise"]["store_calls"] == 1
+    # the template, its 10 completed workouts, the collection versions, the tombstone and the
+    # rebuilt muscle load
+    assert reads["delete template"]["store_writes"] == 14
+
+
+def test_regressions():
+    baseline = {"results": [{"profile": "p", "route": "r", "p95_ms": 1.0, "store_calls": 1}]}
+    report = {"results": [{"profile": "p", "route": "r", "p95_ms": 2.0, "store_calls": 2}]}
+    assert len(bench_endpoints.regressions(report, baseline, 1.25)) == 2
+    assert bench_endpoints.regressions(baseline, baseline, 1.25) == []
@@ -2,6 +2,7 @@ import pytest
 from app import app
 import firebase_admin
 from firebase_admin import credentials, firestore
+import data_helper
 
 USER_DOCUMENT_NAME = "auto_test"
 
@@ -29,21 +30,10 @@ def setup_and_teardown_user():
     try:
         if user_doc_ref.get().exists:
             print(f"Cleaning up user document: {USER_DOCUMENT_NAME}")
-            delete_document_and_subcollections(user_doc_ref)
+            data_helper.delete_user_document(USER_DOCUMENT_NAME, db)
     except Exception as e:
         print(f"Error during cleanup: {e}")
 
-def delete_document_and_subcollections(doc_ref):
-    # Helper function to recursively delete a document and its subcollections
-    print(f"Deleting document: {doc_ref.id}")
-    for collection in doc_ref.collections():
-        print(f"Deleting subcollection: {collection.id}")
-        for doc in collection.stream():
-            print(f"Deleting document in subcollection {collection.id}: {doc.id}")
-            delete_document_and_subcollections(doc.reference)  # Recursive call
-    doc_ref.delete()
-    print(f"Deleted document: {doc_ref.id}")
-
 ### Exercise CRUD API tests
 
 def test_create_exercise(client):
@@ -130,6 +120,22 @@ def test_delete_template(client):
     response = client.get(f"/users/{USER_DOCUMENT_NAME}/workouts/{template_id}")
     assert response.status_code == 404
 
+def test_delete_template_deletes_completed(client):
+    # First, create the template and completed workout
+    create_response = client.post(f"/users/{USER_DOCUMENT_NAME}/workouts", json={"name": "Morning Routine"})
+    template_id = create_response.json["id"]
+
+    completed_response = client.post(f"/users/{USER_DOCUMENT_NAME}/workouts/{template_id}/completed", json={"notes": "Great session!"})
+    completed_id = completed_response.json["id"]
+
+    # Then, delete the template
+    response = client.delete(f"/users/{USER_DOCUMENT_NAME}/workouts/{template_id}")
+    assert response.status_code == 200
+
+    # Verify no completed workout was left behind
+    response = client.get(f"/users/{USER_DOCUMENT_NAME}/workouts/{template_id}/completed/{completed_id}")
+    assert response.status_code == 404
+
 ### Workout template's completed workouts CRUD API tests
 
 def test_create_completed_workout(client):
@@ -273,6 +279,52 @@ def test_read_all_completed_all(client):
     response = client.get(f"/users/{USER_DOCUMENT_NAME}/workouts/ALL/completed")
     assert response.status_code == 200
 
+def test_read_all_completed_all_has_template_id(client):
+    # First, create the template and completed workout
+    create_response = client.post(f"/users/{USER_DOCUMENT_NAME}/workouts", json={"name": "Morning Routine"})
+    template_id = create_response.json["id"]
+
+    completed_response = client.post(f"/users/{USER_DOCUMENT_NAME}/workouts/{template_id}/completed", json={"notes": "Great session!"})
+    completed_id = completed_response.json["id"]
+
+    # Then, every completed workout should say which template it belongs to
+    response = client.get(f"/users/{USER_DOCUMENT_NAME}/workouts/ALL/completed")
+    assert response.status_code == 200
+    completed = next((c for c in response.json if c["id"] == completed_id), None)
+    assert completed is not None
+    assert completed["template_id"] == template_id
+
+def test_get_all_pain_paginated(client):
+    # First, add a few pain entries
+    for level in (3, 4, 5):
+        client.post('/add-pain', json={
+            "uid": USER_DOCUMENT_NAME,
+            "date": "2024-11-30",
+            "pain_level": level,
+            "body_part": "lower back"
+        })
+
+    # Then, walk the pages
+    seen = []
+    cursor = None
+    while True:
+        url = '/get-all-pain?limit=2' + (f'&cursor={cursor}' if cursor else '')
+        response = client.post(url, json={"uid": USER_DOCUMENT_NAME})
+        assert response.status_code == 200
+        assert len(response.json["pain"]) <= 2
+        seen += [p["hash_id"] for p in response.json["pain"]]
+        cursor = response.json["next_cursor"]
+        if not cursor:
+            break
+
+    # Verify the pages cover everything exactly once
+    all_response = client.post('/get-all-pain', json={"uid": USER_DOCUMENT_NAME})
+    assert sorted(seen) == sorted(p["hash_id"] for p in all_response.json["pain"])
+
+def test_read_exercises_invalid_limit(client):
+    response = client.get(f"/users/{USER_DOCUMENT_NAME}/exercises?limit=0")
+    assert response.status_code == 400
+
 ### Journal API Tests
 def test_create_journal(client):
     response = client.post(f"/users/{USER_DOCUMENT_NAME}/journals", json={"title": "My Journal", "content": "Daily log"})
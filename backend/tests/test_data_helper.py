@@ -0,0 +1,139 @@
+import pytest
+from unittest.mock import MagicMock
+
+import sys
+import os
+
+# Add the parent directory to sys.path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import data_helper
+
+
+def mock_premade_client():
+    """mock firestore client where each premade collection has 3 documents,
+    and the first workout has a 'sets' subcollection with 2 documents"""
+    db_mock = MagicMock()
+
+    def make_doc(doc_id, data, subcollections=()):
+        doc = MagicMock(id=doc_id)
+        doc.to_dict.return_value = data
+        doc.reference.collections.return_value = list(subcollections)
+        return doc
+
+    def make_collection(name, docs):
+        collection = MagicMock(id=name)
+        collection.stream.side_effect = lambda: iter(docs)
+        return collection
+
+    sets = make_collection("sets", [make_doc(f"s{i}", {"reps": i}) for i in range(2)])
+    collections = {
+        "globals/exercises/premades": make_collection(
+            "premades", [make_doc(f"e{i}", {"muscle": {"not": "a subcollection"}}) for i in range(3)]
+        ),
+        "globals/workouts/premades": make_collection(
+            "premades", [make_doc("w0", {"name": "w"}, [sets])] + [make_doc(f"w{i}", {}) for i in range(1, 3)]
+        ),
+    }
+    db_mock.collection.side_effect = lambda path: collections.get(path, MagicMock())
+    return db_mock, collections
+
+
+def test_create_user_document_batches_and_caches(mocker):
+    mocker.patch.dict(data_helper._premade_trees, clear=True)
+    db_mock, collections = mock_premade_client()
+
+    data_helper.create_user_document("u1", "first", "last", db_mock)
+    data_helper.create_user_document("u2", "first", "last", db_mock)
+
+    # premades are only read for the first sign up
+    for collection in collections.values():
+        assert collection.stream.call_count == 1
+
+    # user doc + 3 exercises + 3 workouts + 2 sets per user, one batch each
+    batch = db_mock.batch.return_value
+    assert db_mock.batch.call_count == 2
+    assert batch.commit.call_count == 2
+    assert batch.set.call_count == 2 * 9
+
+
+def test_commit_writes_chunks_batches():
+    db_mock = MagicMock()
+    writes = [(MagicMock(), {"i": i}) for i in range(data_helper.BATCH_LIMIT * 2 + 1)]
+    data_helper.commit_writes(writes, db_mock)
+    assert db_mock.batch.call_count == 3
+    assert db_mock.batch.return_value.set.call_count == len(writes)
+
+
+def test_delete_template_workout_recursive():
+    db_mock = MagicMock()
+    db_mock.recursive_delete.return_value = 4
+    data_helper.delete_template_workout("u1", "t1", db_mock)
+
+    template_ref = db_mock.collection.return_value.document.return_value.collection.return_value.document.return_value
+    db_mock.recursive_delete.assert_called_once_with(
+        template_ref, bulk_writer=db_mock.bulk_writer.return_value
+    )
+
+
+def test_read_page_next_cursor():
+    collection_mock = MagicMock()
+    query = collection_mock.order_by.return_value.start_after.return_value.limit.return_value
+    query.stream.return_value = [
+        MagicMock(id=f"d{i}", to_dict=MagicMock(return_value={"i": i})) for i in range(3)
+    ]
+
+    page = data_helper.read_page(collection_mock, 2, cursor="d0", id_field="hash_id")
+    collection_mock.order_by.assert_called_once_with("__name__")
+    collection_mock.order_by.return_value.start_after.assert_called_once_with({"__name__": "d0"})
+    collection_mock.order_by.return_value.start_after.return_value.limit.assert_called_once_with(3)
+    assert page == {"items": [{"i": 0, "hash_id": "d0"}, {"i": 1, "hash_id": "d1"}], "next_cursor": "d1"}
+
+    # last page has no cursor
+    query.stream.return_value = query.stream.return_value[:1]
+    page = data_helper.read_page(collection_mock, 2, cursor="d0")
+    assert page["next_cursor"] is None
+
+
+### per-user read cache
+@pytest.fixture
+def clear_cache():
+    data_helper.user_cache.clear()
+    yield
+    data_helper.user_cache.clear()
+
+
+def test_cached_read_and_invalidation(clear_cache):
+    db_mock = MagicMock()
+    exercises_ref = db_mock.collection.return_value.document.return_value.collection.return_value
+    exercises_ref.stream.side_effect = lambda: iter(
+        [MagicMock(id="e1", to_dict=MagicMock(return_value={"name": "Push-Up"}))]
+    )
+    exercises_ref.add.return_value = (None, MagicMock(id="e2"))
+
+    assert data_helper.get_all_user_exercises("u1", db_mock) == [{"name": "Push-Up", "id": "e1"}]
+    data_helper.get_all_user_exercises("u1", db_mock)
+    assert exercises_ref.stream.call_count == 1
+
+    # other users and other collections are not affected by the write
+    data_helper.get_all_user_exercises("u2", db_mock)
+    data_helper.create_user_exercise("u1", {"name": "Squat"}, db_mock)
+    data_helper.get_all_user_exercises("u2", db_mock)
+    assert exercises_ref.stream.call_count == 2
+
+    # but the written user's reads are fresh
+    data_helper.get_all_user_exercises("u1", db_mock)
+    assert exercises_ref.stream.call_count == 3
+    assert data_helper.cache_stats()["hits"] == 2
+
+
+def test_user_cache_memory_cap():
+    from user_cache import UserCache
+
+    cache = UserCache(max_bytes=100)
+    cache.get_or_load("u1", "journals", "a", lambda: "x" * 60)
+    cache.get_or_load("u1", "journals", "b", lambda: "y" * 60)
+    assert cache.stats()["entries"] == 1
+    assert cache.stats()["bytes"] <= 100
+    # values over the cap are returned but never stored
+    assert cache.get_or_load("u1", "journals", "c", lambda: "z" * 200) == "z" * 200
+    assert cache.stats()["entries"] == 1
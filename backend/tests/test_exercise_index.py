@@ -0,0 +1,97 @@
+import data_helper
+import exercise_index
+from recommender import *
+
+
+def names(results):
+    return [result["name"] for result in results]
+
+
+def test_prefix_index():
+    index = exercise_index.PrefixIndex([
+        ("a", {"name": "Hammer Curl", "muscle": BICEPS}),
+        ("b", {"name": "curl", "muscle": BICEPS}),
+        ("c", {"name": "Cable  Crunch", "muscle": ABS}),
+        ("d", {"muscle": ABS}),
+    ])
+    assert [doc_id for doc_id, _ in index.search("cur")] == ["b", "a"]
+    assert [doc_id for doc_id, _ in index.search("c")] == ["c", "b", "a"]
+    assert [doc_id for doc_id, _ in index.search("c", ABS)] == ["c"]
+    assert [doc_id for doc_id, _ in index.search("cable c")] == ["c"]
+
+    index.put("a", {"name": "Preacher Curl", "muscle": BICEPS})
+    index.remove("b")
+    index.remove("missing")
+    assert [data["name"] for _, data in index.search("cur")] == ["Preacher Curl"]
+    assert list(index.search("hammer")) == []
+    assert len(index) == 3
+
+
+def test_search_follows_writes_without_reading_again(db, mocker):
+    curl = data_helper.create_user_exercise("u1", {"name": "Curl", "muscle": BICEPS}, db)
+    loads = mocker.spy(data_helper, "_exercise_documents")
+    assert names(data_helper.search_user_exercises("u1", "c", db)) == ["Curl"]
+
+    press = data_helper.create_user_exercise("u1", {"name": "Chest Press", "muscle": CHEST}, db)
+    data_helper.update_user_exercise("u1", curl, {"name": "Cable Curl"}, db)
+    results = data_helper.search_user_exercises("u1", "c", db)
+    assert names(results) == ["Cable Curl", "Chest Press"]
+    assert results[1] == {"name": "Chest Press", "muscle": CHEST, "id": press, "source": "user"}
+
+    data_helper.delete_user_exercise("u1", press, db)
+    assert names(data_helper.search_user_exercises("u1", "press", db)) == []
+    assert loads.call_count == 1
+
+    # a batch is not followed exercise by exercise, the index is read again
+    data_helper.commit_batch("u1", [{"op": "create", "collection": "exercises", "data": {"name": "Crunch"}}], db)
+    assert names(data_helper.search_user_exercises("u1", "cr", db)) == ["Crunch"]
+    assert loads.call_count == 2
+
+
+def test_premades_after_the_users_own(db):
+    premades = db.collection("globals/exercises/premades")
+    premades.document("bench").set({"name": "Bench Press", "muscle": CHEST})
+    premades.document("squat").set({"name": "Back Squat", "muscle": QUADRICEPS})
+    data_helper.create_user_document("u1", "a", "b", db)
+    data_helper.create_user_exercise("u1", {"name": "Banded Row", "muscle": BACK}, db)
+    premades.document("burpee").set({"name": "Burpee", "muscle": QUADRICEPS})
+    data_helper._premade_trees.clear()
+
+    results = data_helper.search_user_exercises("u1", "b", db)
+    # the copies made at sign up are the user's, premades added later are not
+    assert [(r["name"], r["source"]) for r in results] == [
+        ("Back Squat", "user"), ("Banded Row", "user"), ("Bench Press", "user"), ("Burpee", "premade"),
+    ]
+    assert names(data_helper.search_user_exercises("u1", "b", db, muscle=QUADRICEPS, limit=1)) == ["Back Squat"]
+
+
+def test_index_built_from_stale_reads_is_not_kept(db):
+    data_helper.create_user_exercise("u1", {"name": "Curl", "muscle": BICEPS}, db)
+
+    def load():
+        # a write between the read and the index being kept, the next search reads again
+        exercise_index.added("u1", "x", {"name": "Other"})
+        return []
+
+    stale = exercise_index.user_index("u1", load)
+    assert list(stale.search("curl")) == []
+    assert names(data_helper.search_user_exercises("u1", "curl", db)) == ["Curl"]
+
+
+def test_muscle_filter_and_search_routes(db, client):
+    for name, muscle in [("Curl", BICEPS), ("Hammer Curl", BICEPS), ("Crunch", ABS)]:
+        client.post("/users/u1/exercises", json={"name": name, "muscle": muscle})
+
+    response = client.get(f"/users/u1/exercises?muscle={BICEPS}")
+    assert response.status_code == 200
+    assert sorted(names(response.json)) == ["Curl", "Hammer Curl"]
+    page = client.get(f"/users/u1/exercises?muscle={BICEPS}&limit=1").json
+    assert len(page["items"]) == 1 and page["next_cursor"]
+    streamed = client.get(f"/users/u1/exercises?muscle={ABS}&stream=ndjson")
+    assert streamed.get_data(as_text=True).count("\n") == 1
+
+    assert names(client.get("/users/u1/exercises?q=CUR").json) == ["Curl", "Hammer Curl"]
+    assert names(client.get(f"/users/u1/exercises?q=c&muscle={ABS}").json) == ["Crunch"]
+    assert len(client.get("/users/u1/exercises?q=c&limit=2").json) == 2
+    for query in ("muscle=Neck", "q=", "q=%20", "q=c&limit=0", f"q={'x' * 101}"):
+        assert client.get(f"/users/u1/exercises?{query}").status_code == 400, query
@@ -0,0 +1,66 @@
+import pytest
+
+import data_helper
+from recommender import *
+
+
+def test_parse_fields():
+    assert data_helper.parse_fields(None) is None
+    assert data_helper.parse_fields(" name,muscle,name ") == ("muscle", "name")
+    # a field already includes its nested fields
+    assert data_helper.parse_fields("sets.reps,sets,_x.y1") == ("_x.y1", "sets")
+    for fields in ("", "name,", "a..b", "1a", "a-b", ",".join(f"f{i}" for i in range(data_helper.MAX_FIELDS + 1))):
+        with pytest.raises(ValueError):
+            data_helper.parse_fields(fields)
+
+
+def test_project():
+    document = {"name": "Legs", "meta": {"level": 2, "tags": ["a"]}, "notes": None}
+    assert data_helper.project(document, ("meta.level", "name", "notes", "missing", "name.x")) == {
+        "name": "Legs", "meta": {"level": 2}, "notes": None,
+    }
+    assert data_helper.project(document, None) is document
+    assert data_helper.project(None, ("name",)) is None
+    assert document["meta"] == {"level": 2, "tags": ["a"]}
+
+
+def test_list_reads_select_fields(db):
+    template_id = data_helper.create_template_workout("u1", {"name": "Legs", "exercises": ["3|10|0|e"]}, db)
+    data_helper.create_completed_workout("u1", template_id, {"dateCompleted": "2024-05-02", "exercises": []}, db)
+    data_helper.create_pain("u1", {"date": "2024-05-02", "pain_level": 3, "body_part": BACK}, db)
+
+    assert data_helper.get_all_template_workouts("u1", db, fields=("name",)) == [{"name": "Legs", "id": template_id}]
+    # projected and whole reads are cached apart
+    assert data_helper.get_all_template_workouts("u1", db)[0]["exercises"] == ["3|10|0|e"]
+    assert [set(c) for c in data_helper.get_all_completed_workouts_all("u1", db, ("dateCompleted",))] == [
+        {"dateCompleted", "id", "template_id"}
+    ]
+    page = data_helper.get_all_pain("u1", db, limit=1, fields=("pain_level",))
+    assert [set(p) for p in page["items"]] == [{"pain_level", "hash_id"}]
+    assert [set(p) for p in data_helper.iter_user_collection("u1", "pain", db, "hash_id", ("date",))] == [{"date", "hash_id"}]
+
+
+def test_fields_routes(db, client):
+    exercise_id = client.post("/users/u1/exercises", json={"name": "Curl", "muscle": BICEPS}).json["id"]
+    template_id = client.post("/users/u1/workouts", json={"name": "Arms", "exercises": []}).json["id"]
+
+    assert client.get(f"/users/u1/exercises/{exercise_id}?fields=name").json == {"name": "Curl"}
+    assert client.get("/users/u1/exercises?fields=muscle").json == [{"muscle": BICEPS, "id": exercise_id}]
+    assert client.get("/users/u1/exercises?fields=name&stream=ndjson").get_data(as_text=True) == (
+        f'{{"id":"{exercise_id}","name":"Curl"}}\n'
+    )
+    assert client.get("/users/u1/exercises?q=cu&fields=muscle").json == [
+        {"muscle": BICEPS, "id": exercise_id, "source": "user"}
+    ]
+    assert client.get(f"/users/u1/workouts/{template_id}?fields=name,missing").json == {"name": "Arms"}
+    assert client.post("/get-all-pain?fields=date", json={"uid": "u1"}).json == {"pain": []}
+
+    # the field list is part of the ETag
+    whole = client.get("/users/u1/workouts")
+    projected = client.get("/users/u1/workouts?fields=name")
+    assert projected.json == [{"name": "Arms", "id": template_id}]
+    assert whole.headers["ETag"] != projected.headers["ETag"]
+
+    for path in (f"/users/u1/exercises/{exercise_id}?fields=", "/users/u1/workouts?fields=a;b", "/users/u1/journals?fields=1"):
+        assert client.get(path).status_code == 400, path
+    assert client.post("/get-all-pain?fields=", json={"uid": "u1"}).status_code == 400
@@ -0,0 +1,100 @@
+import json
+import logging
+import pytest
+
+import log_helper
+from app import app
+
+
+class ListHandler(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.lines = []
+
+    def emit(self, record):
+        self.lines.append(json.loads(self.format(record)))
+
+
+@pytest.fixture
+def captured():
+    handler = ListHandler()
+    level = logging.getLogger().level
+    log_helper.configure_logging("INFO", handler=handler)
+    yield handler
+    log_helper.stop_logging()
+    logging.getLogger().setLevel(level)
+
+
+@pytest.fixture
+def client():
+    with app.test_client() as client:
+        yield client
+
+
+def test_json_lines_with_fields(captured):
+    logging.getLogger("data_helper").info(
+        "exercise created", extra={"uid": "u1", "payload": "x" * 1000, "items": list(range(50))}
+    )
+    log_helper.flush_logging()
+
+    (line,) = captured.lines
+    assert line["msg"] == "exercise created"
+    assert line["level"] == "INFO" and line["logger"] == "data_helper"
+    assert line["uid"] == "u1"
+    # payloads are never written out in full
+    assert len(line["payload"]) < 300 and line["payload"].endswith("(1000 chars)")
+    assert line["items"] == "<list of 50>"
+
+
+def test_full_queue_drops_instead_of_blocking(captured, mocker):
+    queue_handler = next(h for h in logging.getLogger().handlers if isinstance(h, log_helper.DroppingQueueHandler))
+    mocker.patch.object(queue_handler.queue, "put_nowait", side_effect=log_helper.queue.Full)
+    logging.getLogger("x").warning("lost")
+    assert queue_handler.dropped == 1
+
+
+def test_request_id_correlation(client, captured, mocker):
+    mocker.patch("data_helper.create_journal", side_effect=lambda uid, data, db: logging.getLogger("data_helper").info("journal entry created") or "j1")
+
+    response = client.post("/users/u1/journals", json={}, headers={"X-Request-ID": "abc-123"})
+    assert response.headers["X-Request-ID"] == "abc-123"
+    response = client.post("/users/u1/journals", json={}, headers={"X-Request-ID": "bad id"})
+    generated = response.headers["X-Request-ID"]
+    assert generated != "bad id" and len(generated) == 32
+    log_helper.flush_logging()
+
+    created = [l for l in captured.lines if l["msg"] == "journal entry created"]
+    assert [l["request_id"] for l in created] == ["abc-123", generated]
+    assert created[0]["route"] == "/users/<uid>/journals"
+    access = [l for l in captured.lines if l["logger"] == "access"]
+    assert access[0]["status"] == 201 and access[0]["request_id"] == "abc-123"
+
+
+def test_route_sampling(captured, mocker):
+    sampled_app = type(app)("sampled")
+    log_helper.init_app(sampled_app, sample_rates={"/quiet": 0}, default_rate=1)
+
+    @sampled_app.route("/quiet")
+    def quiet():
+        logging.getLogger("x").info("dropped")
+        logging.getLogger("x").warning("kept")
+        return "ok"
+
+    @sampled_app.route("/loud")
+    def loud():
+        logging.getLogger("x").info("kept too")
+        return "ok"
+
+    with sampled_app.test_client() as client:
+        client.get("/quiet")
+        client.get("/loud")
+    log_helper.flush_logging()
+
+    messages = [l["msg"] for l in captured.lines if l["logger"] == "x"]
+    assert messages == ["kept", "kept too"]
+
+
+def test_parse_sample_rates():
+    assert log_helper.parse_sample_rates("/get-all-pain=0.1, /metrics=0") == {"/get-all-pain": 0.1, "/metrics": 0.0}
+    with pytest.raises(ValueError):
+        log_helper.parse_sample_rates("/x=2")
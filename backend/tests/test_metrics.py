@@ -0,0 +1,86 @@
+import pytest
+
+import app as app_module
+import data_helper
+import metrics
+import storage
+from app import app
+
+
+@pytest.fixture
+def memory_db(db, mocker):
+    # a counted memory store whose counters the app's metrics read, and fresh metrics
+    counted = storage.CountingClient(db)
+    mocker.patch.object(app_module, "db", counted)
+    mocker.patch.object(app_module.request_metrics, "store_counters", counted.counters)
+    fresh = metrics.Metrics(counted.counters)
+    mocker.patch.object(app_module.request_metrics, "_routes", fresh._routes)
+    return counted
+
+
+def metric(text, name, **labels):
+    prefix = name + metrics._labels(**labels) if labels else name
+    for line in text.splitlines():
+        if line.startswith(prefix + " "):
+            return float(line.rsplit(" ", 1)[1])
+    return None
+
+
+def test_app_counts_its_storage_calls():
+    assert isinstance(app_module.db, storage.CountingClient)
+    assert app_module.request_metrics.store_counters is app_module.db.counters
+
+
+def test_histogram_is_cumulative():
+    hist = metrics.Histogram((1, 5, 10))
+    for value in (0.5, 3, 7, 20):
+        hist.observe(value)
+    assert hist.counts == [1, 2, 3]
+    assert hist.count == 4 and hist.sum == 30.5
+
+
+def test_route_metrics(client, memory_db):
+    for _ in range(3):
+        client.post("/users/u1/exercises", json={"name": "Curl"})
+    client.get("/users/u1/exercises")
+    client.get("/users/u1/exercises?limit=0")
+
+    text = client.get("/metrics").data.decode()
+    route = "/users/<uid>/exercises"
+    assert metric(text, "http_requests_total", route=route, method="POST", status=201) == 3
+    assert metric(text, "http_requests_total", route=route, method="GET", status=200) == 1
+    assert metric(text, "http_requests_total", route=route, method="GET", status=400) == 1
+    assert metric(text, "http_request_duration_seconds_count", route=route, method="POST") == 3
+    # each create writes the exercise and bumps the collection version
+    assert metric(text, "firestore_calls_total", route=route, method="POST") == 6
+    # the GET read the version and all 3 documents, the bad request only the version
+    assert metric(text, "firestore_reads_per_request_sum", route=route, method="GET") == 5
+    assert metric(text, "firestore_reads_per_request_bucket", route=route, method="GET", le="1") == 1
+    assert metric(text, "http_response_size_bytes_sum", route=route, method="GET") > 0
+
+
+def test_streamed_response_metrics(client, memory_db):
+    client.post("/users/u1/journals", json={"title": "a"})
+    response = client.get("/users/u1/journals?stream=ndjson")
+    size = len(response.data)
+    response.close()
+
+    text = client.get("/metrics").data.decode()
+    route = "/users/<uid>/journals"
+    assert metric(text, "http_response_size_bytes_sum", route=route, method="GET") == size
+    # the collection version and the journal
+    assert metric(text, "firestore_reads_per_request_sum", route=route, method="GET") == 2
+
+
+def test_cache_metrics(client, memory_db):
+    data_helper.get_all_journals("u1", memory_db)
+    data_helper.get_all_journals("u1", memory_db)
+
+    response = client.get("/metrics")
+    assert response.mimetype == "text/plain"
+    text = response.data.decode()
+    assert metric(text, "cache_hits_total", cache="user_reads") == 1
+    assert metric(text, "cache_misses_total", cache="user_reads") == 1
+    assert metric(text, "cache_hit_ratio", cache="user_reads") == 0.5
+    assert metric(text, "cache_hits_total", cache="tokens") is not None
+
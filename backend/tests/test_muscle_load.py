@@ -0,0 +1,131 @@
+import pytest
+import random
+from datetime import datetime, timedelta
+
+import data_helper
+import muscle_load
+import recommender
+from recommender import *
+
+
+def day(days_ago):
+    return (datetime.now() - timedelta(days_ago)).strftime("%Y-%m-%d")
+
+
+def stored_load(db, uid="u1"):
+    return muscle_load.load_ref(uid, db).get().to_dict()
+
+
+def completed(days_ago, *exercises):
+    return {"dateCompleted": day(days_ago), "exercises": [f"{sets}|10|0|{eid}" for eid, sets in exercises]}
+
+
+def test_exercise_sets():
+    assert muscle_load.exercise_sets("3|10|20|e1") == ("e1", 3)
+    assert muscle_load.exercise_sets("x|10|20|e1") == ("e1", 1)
+    assert muscle_load.exercise_sets("0|10|20|e1") == ("e1", 1)
+    for entry in ("3|10|20|", "3|10|e1", None):
+        assert muscle_load.exercise_sets(entry) is None
+
+
+def test_load_follows_create_edit_delete(db):
+    rng = random.Random(5)
+    eids = [data_helper.create_user_exercise("u1", {"muscle": muscle}, db) for muscle in (BICEPS, CHEST, GLUTES)]
+    template_id = data_helper.create_template_workout("u1", {"name": "t"}, db)
+    ids = []
+    for _ in range(40):
+        action = rng.random()
+        workout = completed(rng.randint(0, 35), *((rng.choice(eids), rng.randint(1, 5)) for _ in range(3)))
+        if action < 0.5 or not ids:
+            ids.append(data_helper.create_completed_workout("u1", template_id, workout, db))
+        elif action < 0.8:
+            data_helper.update_completed_workout("u1", template_id, rng.choice(ids), workout, db)
+        else:
+            completed_id = rng.choice(ids)
+            ids.remove(completed_id)
+            data_helper.delete_completed_workout("u1", template_id, completed_id, db)
+        load = stored_load(db)
+        assert all(d > day(muscle_load.LOAD_WINDOW_DAYS) for d in load["days"])
+        assert load == muscle_load.rebuild("u1", db)
+
+
+def test_missing_load_is_built_on_write(db):
+    eid = data_helper.create_user_exercise("u1", {"muscle": BACK}, db)
+    template_id = data_helper.create_template_workout("u1", {"name": "t"}, db)
+    completed_ref = db.collection(f"users/u1/workouts/{template_id}/completed")
+    completed_ref.add(completed(1, (eid, 4)))
+    completed_ref.add(completed(40, (eid, 4)))
+    assert not muscle_load.load_ref("u1", db).get().exists
+
+    data_helper.create_completed_workout("u1", template_id, completed(0, (eid, 2), ("gone", 3)), db)
+    assert stored_load(db) == {"days": {day(1): {BACK: 4}, day(0): {BACK: 2}}}
+
+
+def test_batch_import_and_template_delete_catch_up(db):
+    eid = data_helper.create_user_exercise("u1", {"muscle": TRAPS}, db)
+    template_id = data_helper.create_template_workout("u1", {"name": "t"}, db)
+    results = data_helper.import_records("u1", "completed", [completed(0, (eid, 2)), completed(1, (eid, 3))], db, template_id)
+    assert stored_load(db) == {"days": {day(0): {TRAPS: 2}, day(1): {TRAPS: 3}}}
+
+    data_helper.commit_batch("u1", [
+        {"op": "create", "collection": "completed", "template_id": template_id, "data": completed(0, (eid, 5))},
+        {"op": "delete", "collection": "completed", "template_id": template_id, "id": results[1]["id"]},
+    ], db)
+    assert stored_load(db) == {"days": {day(0): {TRAPS: 7}}}
+
+    data_helper.delete_template_workout("u1", template_id, db)
+    assert stored_load(db) == {"days": {}}
+
+
+def test_recent_load_decays():
+    load = {"days": {day(0): {CHEST: 4}, day(muscle_load.HALF_LIFE_DAYS): {CHEST: 4, BACK: 2}}}
+    assert muscle_load.recent_load(load) == pytest.approx({CHEST: 6, BACK: 1})
+    assert muscle_load.recent_load(None) == {}
+
+
+def test_top_ranked_is_pick_muscle_without_load():
+    exercises = {muscle: {"muscle": muscle} for muscle in muscles}
+    rng = random.Random(11)
+    for _ in range(500):
+        workout = [{"eid": muscle} for muscle in rng.choices(muscles, k=rng.randint(0, 9))]
+        ranked = rank_muscles(workout, exercises, None, k=len(muscles))
+        assert ranked[0]["muscle"] == pick_muscle(workout, exercises)
+        assert sorted(r["muscle"] for r in ranked) == sorted(muscles)
+
+
+def test_load_changes_ranking():
+    exercises = {muscle: {"muscle": muscle} for muscle in muscles}
+    workout = [{"eid": BICEPS}, {"eid": TRICEPS}]
+    assert [r["muscle"] for r in rank_muscles(workout, exercises, None)] == [SHOULDERS, FOREARMS, BICEPS]
+
+    # 20 sets of shoulders today weigh 2 exercises
+    load = {"days": {day(0): {SHOULDERS: 20, FOREARMS: 5}}}
+    ranked = rank_muscles(workout, exercises, load, k=4)
+    assert [r["muscle"] for r in ranked] == [FOREARMS, BICEPS, TRICEPS, SHOULDERS]
+    assert ranked[0] == {"muscle": FOREARMS, "score": 0.5, "load": 5}
+
+
+def test_recommend_ranked_lists_candidates(db, mocker):
+    eids = {muscle: data_helper.create_user_exercise("u1", {"name": muscle, "muscle": muscle}, db) for muscle in muscles}
+    extra = data_helper.create_user_exercise("u1", {"name": "face pull", "muscle": SHOULDERS}, db)
+    template_id = data_helper.create_template_workout("u1", {"name": "t"}, db)
+    data_helper.create_completed_workout("u1", template_id, completed(0, (eids[FOREARMS], 5)), db)
+    data_helper.create_pain("u1", {"date": day(0), "pain_level": 9, "body_part": SHOULDERS}, db)
+
+    # the load is read from its counters, never from the completed workouts
+    mocker.patch.object(muscle_load, "completed_query", side_effect=AssertionError)
+    workout = [{"eid": eids[BICEPS]}, {"eid": eids[TRICEPS]}]
+    ranked = recommend_ranked("u1", workout, db, k=2)
+    assert [(r["muscle"], r["intensity"]) for r in ranked] == [(SHOULDERS, "lower"), (FOREARMS, "same")]
+    assert sorted(e["id"] for e in ranked[0]["exercises"]) == sorted([eids[SHOULDERS], extra])
+    assert ranked[1]["exercises"] == [{"id": eids[FOREARMS], "name": FOREARMS, "muscle": FOREARMS, "updated_at": mocker.ANY}]
+
+
+def test_ranked_route(db, client):
+    eid = data_helper.create_user_exercise("u1", {"muscle": GLUTES}, db)
+    response = client.post("/recommend/u1/ranked?k=2", json=[{"eid": eid}, {"eid": ""}])
+    assert response.status_code == 200
+    assert [r["muscle"] for r in response.json["recommended"]] == [HAMSTRINGS, QUADRICEPS]
+    assert len(client.post("/recommend/u1/ranked", json=[]).json["recommended"]) == recommender.DEFAULT_TOP_K
+    for k in ("0", "12", "x"):
+        assert client.post(f"/recommend/u1/ranked?k={k}", json=[]).status_code == 400
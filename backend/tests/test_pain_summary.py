@@ -0,0 +1,139 @@
+import pytest
+import random
+from datetime import datetime, timedelta
+from google.api_core import exceptions
+from google.cloud import firestore
+
+import data_helper
+import pain_summary
+import recommender
+import storage
+
+
+def day(days_ago):
+    return (datetime.now() - timedelta(days_ago)).strftime("%Y-%m-%d")
+
+
+def stored_summary(db, uid="u1"):
+    return pain_summary.summary_ref(uid, db).get().to_dict()
+
+
+def assert_matches_notes(db, uid="u1"):
+    summary = stored_summary(db, uid)
+    for muscle in recommender.muscles:
+        assert recommender.get_intensity(pain_summary.recent_pain(summary), muscle) == recommender.get_intensity(
+            recommender.get_recent_pain(uid, db), muscle
+        ), muscle
+    assert summary == pain_summary.rebuild(uid, db)
+
+
+def test_summary_follows_add_edit_remove(db):
+    rng = random.Random(7)
+    parts = [recommender.BICEPS, recommender.CHEST, recommender.BACK]
+    ids = []
+    for _ in range(60):
+        action = rng.random()
+        if action < 0.5 or not ids:
+            note = {"date": day(rng.randint(0, 10)), "pain_level": rng.randint(1, 10), "body_part": rng.choice(parts)}
+            ids.append(data_helper.create_pain("u1", note, db))
+        elif action < 0.8:
+            updates = rng.choice([
+                {"pain_level": rng.randint(1, 10)},
+                {"date": day(rng.randint(0, 10))},
+                {"body_part": rng.choice(parts)},
+            ])
+            assert data_helper.update_pain("u1", rng.choice(ids), updates, db)
+        else:
+            hash_id = rng.choice(ids)
+            ids.remove(hash_id)
+            assert data_helper.delete_pain("u1", hash_id, db)
+        assert_matches_notes(db)
+    assert stored_summary(db)["count"] == len(ids)
+
+
+def test_rolling_window(db):
+    for days_ago, level in [(0, 2), (0, 4), (3, 9), (9, 1)]:
+        data_helper.create_pain("u1", {"date": day(days_ago), "pain_level": level, "body_part": "Chest"}, db)
+    data_helper.create_pain("u1", {"date": day(0), "body_part": "Chest"}, db)
+
+    chest = stored_summary(db)["parts"]["Chest"]
+    assert chest["count"] == 4
+    assert chest["days"] == {day(0): {"count": 2, "sum": 6}, day(3): {"count": 1, "sum": 9}}
+    assert chest["latest"]["date"] == day(0)
+
+
+def test_missing_summary_is_built_on_write(db):
+    pain_ref = db.collection("users").document("u1").collection("pain")
+    pain_ref.add({"date": day(1), "pain_level": 8, "body_part": "Back"})
+    pain_ref.add({"date": day(2), "pain_level": 2, "body_part": "Chest"})
+    assert not pain_summary.summary_ref("u1", db).get().exists
+
+    data_helper.create_pain("u1", {"date": day(0), "pain_level": 5, "body_part": "Chest"}, db)
+    summary = stored_summary(db)
+    assert (summary["count"], summary["parts"]["Back"]["latest"]["pain_level"]) == (3, 8)
+    assert_matches_notes(db)
+
+
+def test_batch_and_import_catch_up(db):
+    results = data_helper.import_records("u1", "pain", [
+        {"date": day(1), "pain_level": 2, "body_part": "Chest"},
+        {"date": day(0), "pain_level": 9, "body_part": "Chest"},
+    ], db)
+    assert stored_summary(db)["parts"]["Chest"]["latest"]["id"] == results[1]["id"]
+
+    data_helper.commit_batch("u1", [
+        {"op": "create", "collection": "pain", "data": {"date": day(0), "pain_level": 1, "body_part": "Back"}},
+        {"op": "delete", "collection": "pain", "id": results[1]["id"]},
+    ], db)
+    assert stored_summary(db)["parts"]["Chest"]["latest"]["id"] == results[0]["id"]
+    assert_matches_notes(db)
+
+
+def test_failed_catch_up_discards_summary(db, mocker):
+    data_helper.create_pain("u1", {"date": day(0), "pain_level": 2, "body_part": "Chest"}, db)
+    mocker.patch.object(pain_summary.document, "record", side_effect=exceptions.ServiceUnavailable("down"))
+    data_helper.import_records("u1", "pain", [{"date": day(0), "pain_level": 9, "body_part": "Chest"}], db)
+    assert not pain_summary.summary_ref("u1", db).get().exists
+
+
+def test_recommend_exercise_reads_summary(db, mocker):
+    eid = data_helper.create_user_exercise("u1", {"muscle": recommender.ABS}, db)
+    data_helper.create_pain("u1", {"date": day(1), "pain_level": 9, "body_part": recommender.BACK}, db)
+    data_helper.create_pain("u1", {"date": day(20), "pain_level": 1, "body_part": recommender.BACK}, db)
+
+    mocker.patch.object(recommender, "get_recent_pain", side_effect=AssertionError)
+    assert recommender.recommend_exercise("u1", [{"eid": eid}], db) == {
+        "recommended": recommender.BACK, "intensity": "lower",
+    }
+
+
+def test_transaction_retries_on_conflict(db):
+    ref = db.document("counters/c")
+    ref.set({"n": 0})
+    attempts = []
+
+    @firestore.transactional
+    def increment(transaction):
+        n = ref.get(transaction=transaction).to_dict()["n"]
+        if not attempts:
+            # another writer commits between our read and our commit
+            ref.set({"n": 10})
+        attempts.append(n)
+        transaction.set(ref, {"n": n + 1})
+
+    increment(db.transaction())
+    assert attempts == [0, 10]
+    assert ref.get().to_dict() == {"n": 11}
+
+
+def test_rebuild_tool(db, mocker, capsys):
+    mocker.patch.object(storage, "create_client", return_value=db)
+    db.collection("users").document("u1").collection("pain").add({"date": day(0), "pain_level": 5, "body_part": "Chest"})
+    db.collection("users").document("u2").set({"name": "b"})
+
+    pain_summary.main(["--all"])
+    assert stored_summary(db, "u1")["count"] == 1
+    assert stored_summary(db, "u2") == {"count": 0, "parts": {}}
+    assert "u1: 1 notes" in capsys.readouterr().out
+    with pytest.raises(SystemExit):
+        pain_summary.main([])
@@ -46,10 +46,13 @@ def mock_firestore_client():
     user_doc_mock = MagicMock()
     user_collection_mock.document.return_value = user_doc_mock
 
-    # lmabda for exercises, pain collection
+    # lmabda for exercises, pain collection, and the (missing) pain summary
     user_exercises = MagicMock()
     user_pain = MagicMock()
-    user_doc_mock.collection.side_effect = lambda v: user_exercises if v == "exercises" else user_pain
+    user_meta = MagicMock()
+    summary_doc = user_meta.document.return_value
+    summary_doc.get.return_value = MagicMock(exists=False, reference=summary_doc, to_dict=MagicMock(return_value=None))
+    user_doc_mock.collection.side_effect = lambda v: {"exercises": user_exercises, "meta": user_meta}.get(v, user_pain)
 
     # creating get.todict() for exercise
     def exer_get_side_effect(eid):
@@ -58,12 +61,16 @@ def mock_firestore_client():
         mock_get = MagicMock()
         
         mock_get.exists = True
+        mock_get.id = eid
         mock_get.to_dict.return_value = {'muscle': eid}
         
         mock_doc.get.return_value = mock_get
         return mock_doc
     user_exercises.document.side_effect = exer_get_side_effect 
 
+    # multi-get returns one snapshot per requested reference
+    db_mock.get_all.side_effect = lambda refs: [ref.get() for ref in refs]
+
 
     # Mocking 'users/{uid}/pain' collection
 
@@ -105,7 +112,19 @@ def mock_firestore_client():
             })), 
         ]
     
-    user_pain.stream.return_value = mock_pain_docs()
+    # emulate the server side date window and newest first ordering
+    def pain_where_side_effect(filter):
+        def stream():
+            docs = [
+                d for d in mock_pain_docs()
+                if filter.op_string == ">" and d.to_dict()[filter.field_path] > filter.value
+            ]
+            docs.sort(key=lambda d: d.to_dict()["date"], reverse=True)
+            return iter(docs)
+        query_mock = MagicMock()
+        query_mock.order_by.return_value.stream.side_effect = stream
+        return query_mock
+    user_pain.where.side_effect = pain_where_side_effect
     
     return db_mock
 
@@ -149,6 +168,55 @@ def test_recommend_exercise(curr_workout, expected_recommendation, expected_inte
     assert recommendation["intensity"] == expected_intensity
     
 
+def test_recommend_exercise_single_multiget():
+    """exercise metadata should be fetched in one multi-get, deduplicated by eid, with the pain summary"""
+    db_mock = mock_firestore_client()
+    curr_workout = [{"eid": BICEPS}, {"eid": TRICEPS}, {"eid": BICEPS}, {"eid": SHOULDERS}]
+    recommendation = recommend_exercise("user_123", curr_workout, db_mock)
+    assert recommendation["recommended"] == FOREARMS
+    assert db_mock.get_all.call_count == 1
+    refs = db_mock.get_all.call_args[0][0]
+    assert len(refs) == 4
+
+
+def test_recommend_exercise_missing_exercise():
+    """a missing exercise still fails the recommendation like before"""
+    db_mock = mock_firestore_client()
+    missing = MagicMock(exists=False, id="gone")
+    db_mock.get_all.side_effect = lambda refs: [missing for _ in refs]
+    with pytest.raises(KeyError):
+        recommend_exercise("user_123", [{"eid": "gone"}], db_mock)
+
+
+def test_get_recent_pain_stops_early():
+    """intensity lookup should stop reading pain notes at the first match"""
+    db_mock = mock_firestore_client()
+    read = []
+    def notes():
+        for part in [BICEPS, TRICEPS, ABS]:
+            read.append(part)
+            yield MagicMock(to_dict=MagicMock(return_value={
+                "date": datetime.now().strftime("%Y-%m-%d"), "body_part": part, "pain_level": 5
+            }))
+    user_pain = db_mock.collection.return_value.document.return_value.collection("pain")
+    user_pain.where.side_effect = None
+    user_pain.where.return_value.order_by.return_value.stream.side_effect = notes
+    assert get_intensity(get_recent_pain("user_123", db_mock), TRICEPS) == "same"
+    assert read == [BICEPS, TRICEPS]
+
+
 def test_recommend_workout():
     """this is just retrieving file from db; no other logic; no reason to check"""
-    return 
\ No newline at end of file
+    return 
+
+def test_recommend_workout_cached(mocker):
+    """premade workouts are read from firestore once, then served from memory"""
+    import recommender
+    mocker.patch.object(recommender, "_premade_workouts", recommender.TTLCache(maxsize=4, ttl=60))
+    db_mock = MagicMock()
+    doc_ref = db_mock.collection.return_value.document.return_value.collection.return_value.document.return_value
+    doc_ref.get.return_value = MagicMock(exists=True, to_dict=MagicMock(return_value={"exercises": []}))
+
+    assert recommend_workout("arms", db_mock) == {"exercises": []}
+    assert recommend_workout("arms", db_mock) == {"exercises": []}
+    assert doc_ref.get.call_count == 1
@@ -0,0 +1,192 @@
+import gzip
+import json
+import msgpack
+import numpy
+import pytest
+from datetime import datetime
+from unittest.mock import MagicMock
+from werkzeug.http import http_date
+
+import app as app_module
+import data_helper
+import serialization
+from app import app
+
+
+@pytest.fixture
+def db_mock(mocker):
+    db_mock = MagicMock()
+    mocker.patch.object(app_module, "db", db_mock)
+    # a fresh mock must not see reads cached for an earlier one
+    data_helper.user_cache.clear()
+    yield db_mock
+    data_helper.user_cache.clear()
+
+
+def mock_docs(n):
+    return [MagicMock(id=f"doc{i}", to_dict=MagicMock(return_value={"n": i})) for i in range(n)]
+
+
+### Streaming tests
+def test_stream_json_array(client, db_mock):
+    collection = db_mock.collection.return_value.document.return_value.collection.return_value
+    collection.stream.return_value = iter(mock_docs(3))
+
+    response = client.get("/users/u1/exercises?stream=json")
+    assert response.status_code == 200
+    assert response.is_streamed
+    assert json.loads(response.data) == [{"n": i, "id": f"doc{i}"} for i in range(3)]
+
+
+def test_stream_ndjson(client, db_mock):
+    collection = db_mock.collection.return_value.document.return_value.collection.return_value
+    collection.stream.return_value = iter(mock_docs(2))
+
+    response = client.get("/users/u1/medications", headers={"Accept": "application/x-ndjson"})
+    assert response.status_code == 200
+    assert response.mimetype == "application/x-ndjson"
+    lines = response.data.decode().splitlines()
+    assert [json.loads(line) for line in lines] == [{"n": i, "id": f"doc{i}"} for i in range(2)]
+
+
+def test_stream_pain_wrapped(client, db_mock):
+    collection = db_mock.collection.return_value.document.return_value.collection.return_value
+    collection.stream.return_value = iter([])
+
+    response = client.post("/get-all-pain?stream=json", json={"uid": "u1"})
+    assert response.status_code == 200
+    assert json.loads(response.data) == {"pain": []}
+
+
+def test_stream_read_error_status(client, db_mock):
+    collection = db_mock.collection.return_value.document.return_value.collection.return_value
+    collection.stream.side_effect = Exception("unavailable")
+
+    response = client.get("/users/u1/journals?stream=json")
+    assert response.status_code == 400
+    assert response.json["error"] == "unavailable"
+
+
+### Cache header tests
+def test_recommend_workout_conditional(client, mocker):
+    mocker.patch("recommender.recommend_workout", return_value={"name": "arms", "exercises": []})
+
+    response = client.get("/recommend/workout/arms")
+    assert response.status_code == 200
+    assert response.headers["ETag"]
+    assert "max-age" in response.headers["Cache-Control"]
+
+    response = client.get("/recommend/workout/arms", headers={"If-None-Match": response.headers["ETag"]})
+    assert response.status_code == 304
+    assert response.data == b""
+
+
+def test_collection_conditional(client, db, mocker):
+    client.post("/users/u1/journals", json={"title": "a"})
+    response = client.get("/users/u1/journals")
+    etag = response.headers["ETag"]
+    assert response.status_code == 200
+    assert response.headers["Cache-Control"] == "no-cache, private"
+
+    # unchanged: answered from the version alone
+    read = mocker.spy(data_helper, "get_all_journals")
+    response = client.get("/users/u1/journals", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.headers["ETag"] == etag
+    assert read.call_count == 0
+
+    # other urls and other collections have their own tags
+    assert client.get("/users/u1/journals?limit=1").headers["ETag"] != etag
+    client.post("/users/u1/medications", json={"title": "m"})
+    assert client.get("/users/u1/journals", headers={"If-None-Match": etag}).status_code == 304
+
+    # any write to the collection, from any process, changes it
+    data_helper.create_journal("u1", {"title": "b"}, db)
+    response = client.get("/users/u1/journals", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert len(response.json) == 2
+    assert response.headers["ETag"] != etag
+
+    # a write of another process only bumps the version, the body cached here is not reused for it
+    etag = response.headers["ETag"]
+    db.collection("users/u1/journals").add({"title": "c"})
+    data_helper.bump_versions("u1", ("journals",), db)
+    response = client.get("/users/u1/journals", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert len(response.json) == 3
+    assert client.get("/users/u1/journals", headers={"If-None-Match": response.headers["ETag"]}).status_code == 304
+
+    # errors are not tagged
+    response = client.get("/users/u1/journals?limit=0")
+    assert response.status_code == 400
+    assert "ETag" not in response.headers
+
+
+def test_collection_version_survives_recreated_user(db):
+    data_helper.create_user_exercise("u1", {"name": "Curl"}, db)
+    before = data_helper.get_collection_version("u1", "exercises", db)
+    data_helper.delete_user_document("u1", db)
+    assert data_helper.get_collection_version("u1", "exercises", db) == "0"
+    data_helper.create_user_exercise("u1", {"name": "Curl"}, db)
+    assert data_helper.get_collection_version("u1", "exercises", db) != before
+
+
+### Encoding tests
+def test_json_provider(db):
+    data_helper.create_user_document("u1", "a", "b", db)
+    user = db.collection("users").document("u1").get().to_dict()
+    encoded = json.loads(app.json.dumps({"user": user, "score": numpy.float64(0.5), 2: numpy.int64(3)}))
+    assert encoded == {"2": 3, "score": 0.5, "user": {
+        **user, "created_at": http_date(user["created_at"]), "updated_at": http_date(user["updated_at"]),
+    }}
+    assert app.json.dumps({"b": 1, "a": [None]}) == '{"a":[null],"b":1}'
+    assert app.json.loads(b'{"a": 1}') == {"a": 1}
+    with pytest.raises(TypeError):
+        app.json.dumps({"a": object()})
+
+
+def test_invalid_json_body(client, db):
+    response = client.post("/users/u1/journals", data="{", content_type="application/json")
+    assert response.status_code == 400
+
+
+def test_msgpack_negotiation(client, db):
+    client.post("/users/u1/journals", json={"title": "a"})
+    as_json = client.get("/users/u1/journals")
+    as_msgpack = client.get("/users/u1/journals", headers={"Accept": "application/x-msgpack"})
+    assert as_msgpack.mimetype == serialization.MSGPACK_MIMETYPE
+    assert msgpack.unpackb(as_msgpack.data) == as_json.json
+    # stored timestamps are http dates in both formats
+    assert isinstance(as_json.json[0]["updated_at"], str)
+    # each format has its own tag, caches keep them apart
+    assert as_msgpack.headers["ETag"] != as_json.headers["ETag"]
+    assert "Accept" in as_msgpack.headers["Vary"]
+
+    for accept in ("*/*", "application/json, application/msgpack;q=0.5", "text/html"):
+        assert client.get("/users/u1/journals", headers={"Accept": accept}).mimetype == "application/json", accept
+    error = client.get("/users/u1/journals?limit=0", headers={"Accept": "application/msgpack"})
+    assert error.status_code == 400 and "error" in msgpack.unpackb(error.data)
+
+
+def test_gzip_large_bodies(client, db_mock):
+    collection = db_mock.collection.return_value.document.return_value.collection.return_value
+    collection.stream.side_effect = lambda *args, **kwargs: iter(mock_docs(200))
+    db_mock.collection.return_value.document.return_value.get.return_value.to_dict.return_value = {}
+    headers = {"Accept-Encoding": "gzip, deflate"}
+
+    response = client.get("/users/u1/exercises", headers=headers)
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert int(response.headers["Content-Length"]) == len(response.data)
+    assert json.loads(gzip.decompress(response.data)) == [{"n": i, "id": f"doc{i}"} for i in range(200)]
+    assert "Accept-Encoding" in response.headers["Vary"]
+    # the tag of the gzipped body is weak, and still answers a conditional request
+    assert response.headers["ETag"].startswith('W/"')
+    revalidated = client.get("/users/u1/exercises", headers={**headers, "If-None-Match": response.headers["ETag"]})
+    assert revalidated.status_code == 304
+
+    # small, not accepted, or streamed bodies are sent as they are
+    small = client.get("/users/u1/exercises?limit=2", headers=headers)
+    assert "Content-Encoding" not in small.headers and len(small.data) < serialization.GZIP_MIN_SIZE
+    assert "Content-Encoding" not in client.get("/users/u1/exercises", headers={"Accept-Encoding": "gzip;q=0"}).headers
+    streamed = client.get("/users/u1/exercises?stream=json", headers=headers)
+    assert "Content-Encoding" not in streamed.headers and len(streamed.json) == 200
@@ -0,0 +1,162 @@
+import pytest
+from unittest.mock import ANY
+from datetime import datetime, timedelta
+
+import sys
+import os
+
+# Add the parent directory to sys.path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from google.api_core import exceptions
+from firebase_admin import firestore
+import data_helper
+import recommender
+import storage
+
+
+def test_create_client_memory():
+    assert isinstance(storage.create_client("memory"), storage.MemoryClient)
+    with pytest.raises(ValueError):
+        storage.create_client("nope")
+
+
+### document operations
+def test_document_crud(db):
+    _, doc_ref = db.collection("users/u1/exercises").add({"name": "Push-Up", "muscle": "Chest"})
+    assert doc_ref.get().to_dict() == {"name": "Push-Up", "muscle": "Chest"}
+
+    doc_ref.update({"name": "Squat", "stats.count": firestore.Increment(2)})
+    doc_ref.update({"stats.count": firestore.Increment(1)})
+    assert doc_ref.get().to_dict() == {"name": "Squat", "muscle": "Chest", "stats": {"count": 3}}
+
+    doc_ref.set({"muscle": "Glutes", "extra": {"a": 1}}, merge=True)
+    assert doc_ref.get().to_dict()["muscle"] == "Glutes"
+    assert doc_ref.get().to_dict()["name"] == "Squat"
+
+    doc_ref.delete()
+    assert not doc_ref.get().exists
+    with pytest.raises(exceptions.NotFound):
+        doc_ref.update({"name": "gone"})
+
+
+def test_returned_data_is_a_copy(db):
+    doc_ref = db.collection("c").document("d")
+    data = {"list": [1]}
+    doc_ref.set(data)
+    data["list"].append(2)
+    doc_ref.get().to_dict()["list"].append(3)
+    assert doc_ref.get().to_dict() == {"list": [1]}
+
+
+def test_batch_is_atomic(db):
+    db.collection("c").document("a").set({"v": 1})
+    batch = db.batch()
+    batch.set(db.collection("c").document("b"), {"v": 2})
+    batch.update(db.collection("c").document("missing"), {"v": 3})
+    with pytest.raises(exceptions.NotFound):
+        batch.commit()
+    assert not db.collection("c").document("b").get().exists
+
+
+### queries
+def test_range_query_order_and_cursor(db):
+    pain = db.collection("users/u1/pain")
+    for day in range(10):
+        pain.document(f"p{day}").set({"date": f"2024-01-{day + 10}", "pain_level": day})
+
+    query = pain.where(filter=firestore.FieldFilter("date", ">", "2024-01-15")).order_by(
+        "date", direction=firestore.Query.DESCENDING
+    )
+    assert [d.id for d in query.stream()] == ["p9", "p8", "p7", "p6"]
+
+    page = pain.order_by("__name__").start_after({"__name__": "p3"}).limit(2)
+    assert [d.id for d in page.stream()] == ["p4", "p5"]
+
+    assert [d.to_dict() for d in pain.select(["pain_level"]).limit(1).stream()] == [{"pain_level": 0}]
+
+
+def test_collection_group_scoped_to_user(db):
+    for uid in ("u1", "u10", "u2"):
+        db.collection(f"users/{uid}/workouts/t1/completed").add({"uid": uid})
+    user_ref = db.collection("users").document("u1")
+    upper_ref = user_ref.collection("\uf8ff").document("\uf8ff")
+    docs = (
+        db.collection_group("completed")
+        .where(filter=firestore.FieldFilter("__name__", ">=", user_ref))
+        .where(filter=firestore.FieldFilter("__name__", "<", upper_ref))
+        .stream()
+    )
+    assert [d.to_dict()["uid"] for d in docs] == ["u1"]
+
+
+def test_recursive_delete(db):
+    template = db.collection("users/u1/workouts").document("t1")
+    template.set({"name": "t"})
+    for i in range(3):
+        template.collection("completed").add({"i": i})
+    assert [c.id for c in template.collections()] == ["completed"]
+
+    assert db.recursive_delete(template, bulk_writer=db.bulk_writer()) == 4
+    assert list(db.collection_group("completed").stream()) == []
+
+
+### the backend on the memory engine
+def test_data_helper_on_memory(db):
+    db.collection("globals/exercises/premades").document("Bench").set({"name": "Bench", "muscle": recommender.CHEST})
+    data_helper.create_user_document("u1", "first", "last", db)
+    exercise_id = data_helper.create_user_exercise("u1", {"name": "Curl", "muscle": recommender.BICEPS}, db)
+    template_id = data_helper.create_template_workout("u1", {"name": "Arms"}, db)
+    completed_id = data_helper.create_completed_workout("u1", template_id, {"notes": "ok"}, db)
+
+    assert data_helper.get_user_exercise("u1", exercise_id, db)["name"] == "Curl"
+    completed = data_helper.get_all_completed_workouts_all("u1", db)
+    assert completed == [{"notes": "ok", "updated_at": ANY, "id": completed_id, "template_id": template_id}]
+
+    page = data_helper.get_all_user_exercises("u1", db, limit=1)
+    assert len(page["items"]) == 1 and page["next_cursor"] == page["items"][0]["id"]
+
+    data_helper.delete_template_workout("u1", template_id, db)
+    assert data_helper.get_all_completed_workouts_all("u1", db) == []
+
+
+def test_recommender_on_memory(db):
+    exercises = db.collection("users/u1/exercises")
+    for muscle in (recommender.BICEPS, recommender.TRICEPS, recommender.SHOULDERS):
+        exercises.document(muscle).set({"muscle": muscle})
+    today = datetime.now()
+    for days, level in ((1, 2), (3, 9)):
+        db.collection("users/u1/pain").add({
+            "date": (today - timedelta(days=days)).strftime("%Y-%m-%d"),
+            "body_part": recommender.FOREARMS,
+            "pain_level": level,
+        })
+
+    workout = [{"eid": m} for m in (recommender.BICEPS, recommender.TRICEPS, recommender.SHOULDERS)]
+    assert recommender.recommend_exercise("u1", workout, db) == {
+        "recommended": recommender.FOREARMS,
+        "intensity": "higher",
+    }
+
+
+def test_counting_client(db):
+    counted = storage.CountingClient(db)
+    data_helper.create_user_exercise("u1", {"name": "Curl"}, counted)
+    data_helper.create_user_exercise("u1", {"name": "Row"}, counted)
+    # every create also bumps the collection version
+    assert counted.counters.current() == {"calls": 4, "reads": 0, "writes": 4}
+
+    assert len(data_helper.get_all_user_exercises("u1", counted)) == 2
+    assert counted.counters.current() == {"calls": 5, "reads": 2, "writes": 4}
+
+    batch = counted.batch()
+    for i in range(3):
+        batch.set(counted.collection("c").document(str(i)), {"i": i})
+    batch.commit()
+    assert counted.counters.current() == {"calls": 6, "reads": 2, "writes": 7}
+    assert counted.counters.totals == counted.counters.current()
+
+    # a filter on a counted reference is passed on unwrapped, without changing the caller's filter
+    user_ref = counted.collection("users").document("u1")
+    name_filter = firestore.FieldFilter("__name__", ">=", user_ref)
+    assert len(list(counted.collection_group("exercises").where(filter=name_filter).stream())) == 2
+    assert name_filter.value is user_ref
@@ -0,0 +1,106 @@
+import pytest
+from datetime import datetime, timedelta, timezone
+
+import data_helper
+import storage
+
+
+def test_changes_since_watermark(db):
+    exercise_id = data_helper.create_user_exercise("u1", {"name": "Curl"}, db)
+    template_id = data_helper.create_template_workout("u1", {"name": "Arms"}, db)
+    completed_id = data_helper.create_completed_workout("u1", template_id, {"notes": "a"}, db)
+    journal_id = data_helper.create_journal("u1", {"title": "j"}, db)
+
+    first = data_helper.get_changes("u1", None, db)
+    assert [e["id"] for e in first["changes"]["exercises"]] == [exercise_id]
+    assert first["changes"]["completed"][0]["template_id"] == template_id
+    assert first["deleted"] == []
+
+    # nothing changed, nothing sent
+    unchanged = data_helper.get_changes("u1", first["watermark"], db)
+    assert all(documents == [] for documents in unchanged["changes"].values())
+    assert unchanged["watermark"] >= first["watermark"]
+
+    data_helper.update_user_exercise("u1", exercise_id, {"name": "Hammer Curl"}, db)
+    pain_id = data_helper.create_pain("u1", {"date": "2024-05-01", "pain_level": 2, "body_part": "Chest"}, db)
+    data_helper.delete_journal("u1", journal_id, db)
+    data_helper.delete_completed_workout("u1", template_id, completed_id, db)
+
+    delta = data_helper.get_changes("u1", unchanged["watermark"], db)
+    assert [e["name"] for e in delta["changes"]["exercises"]] == ["Hammer Curl"]
+    assert [p["hash_id"] for p in delta["changes"]["pain"]] == [pain_id]
+    assert delta["changes"]["workouts"] == []
+    assert sorted((d["collection"], d["id"], d.get("template_id")) for d in delta["deleted"]) == [
+        ("completed", completed_id, template_id),
+        ("journals", journal_id, None),
+    ]
+
+
+def test_template_delete_leaves_one_tombstone(db):
+    template_id = data_helper.create_template_workout("u1", {"name": "Arms"}, db)
+    data_helper.create_completed_workout("u1", template_id, {"notes": "a"}, db)
+    since = data_helper.get_changes("u1", None, db)["watermark"]
+
+    data_helper.delete_template_workout("u1", template_id, db)
+    deleted = data_helper.get_changes("u1", since, db)["deleted"]
+    assert [(d["collection"], d["id"]) for d in deleted] == [("workouts", template_id)]
+
+
+def test_batch_deletes_leave_tombstones(db):
+    exercise_id = data_helper.create_user_exercise("u1", {"name": "Curl"}, db)
+    since = data_helper.get_changes("u1", None, db)["watermark"]
+    data_helper.commit_batch("u1", [{"op": "delete", "collection": "exercises", "id": exercise_id}], db)
+    assert data_helper.get_changes("u1", since, db)["deleted"][0]["id"] == exercise_id
+
+
+def test_every_write_helper_is_synced(db):
+    db.collection("globals/exercises/premades").document("bench").set({"name": "Bench"})
+    since = data_helper.get_changes("u1", None, db)["watermark"]
+    data_helper.create_user_document("u1", "a", "b", db)
+    journal_id = data_helper.create_document("users/u1/journals", {"title": "a"}, db)
+    delta = data_helper.get_changes("u1", since, db)
+    assert [e["id"] for e in delta["changes"]["exercises"]] == ["bench"]
+    assert [j["id"] for j in delta["changes"]["journals"]] == [journal_id]
+
+    since = delta["watermark"]
+    data_helper.edit_document("users/u1/journals", journal_id, {"title": "b"}, db)
+    assert [j["title"] for j in data_helper.get_changes("u1", since, db)["changes"]["journals"]] == ["b"]
+
+
+def test_completed_changes_in_one_query(db):
+    template_ids = [data_helper.create_template_workout("u1", {"name": str(i)}, db) for i in range(5)]
+    since = data_helper.get_changes("u1", None, db)["watermark"]
+    completed_id = data_helper.create_completed_workout("u1", template_ids[3], {"notes": "a"}, db)
+
+    counted = storage.CountingClient(db)
+    delta = data_helper.get_changes("u1", since, counted)
+    assert [(c["id"], c["template_id"]) for c in delta["changes"]["completed"]] == [(completed_id, template_ids[3])]
+    # the versions read, one query per collection and the tombstones, whatever the number of templates
+    assert counted.counters.current()["calls"] == 1 + len(data_helper.SYNC_COLLECTIONS) + 1
+
+
+def test_parse_since():
+    assert data_helper.parse_since(None) is None
+    now = datetime.now(timezone.utc)
+    assert data_helper.parse_since(now.isoformat()) == now
+    assert data_helper.parse_since(now.replace(tzinfo=None).isoformat()) == now
+    with pytest.raises(data_helper.SyncExpired):
+        data_helper.parse_since((now - timedelta(days=31)).isoformat())
+    with pytest.raises(ValueError):
+        data_helper.parse_since("yesterday")
+
+
+def test_sync_route(db, client):
+    client.post("/users/u1/journals", json={"title": "a"})
+    response = client.get("/users/u1/sync")
+    assert response.status_code == 200
+    assert [j["title"] for j in response.json["changes"]["journals"]] == ["a"]
+    watermark = response.json["watermark"]
+
+    client.post("/users/u1/medications", json={"title": "m"})
+    response = client.get("/users/u1/sync", query_string={"since": watermark})
+    assert response.json["changes"]["journals"] == []
+    assert [m["title"] for m in response.json["changes"]["medications"]] == ["m"]
+
+    assert client.get("/users/u1/sync?since=nope").status_code == 400
+    assert client.get("/users/u1/sync?since=2000-01-01T00:00:00Z").status_code == 410
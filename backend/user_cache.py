@@ -0,0 +1,118 @@
+from cachetools import LRUCache, TTLCache
+
+import itertools
+import json
+import threading
+
+# total (approximate, json encoded) size of the cached values
+CACHE_MAX_BYTES = 32 * 1024 * 1024
+# entries are dropped after this many seconds even without writes, which bounds staleness
+# between processes (writes only invalidate the cache of the process doing them)
+CACHE_TTL = 300
+# number of (uid, collection) groups whose generation is remembered
+CACHE_MAX_GROUPS = 100_000
+
+
+def _estimate_size(value):
+    """approximate memory cost of a cached value, its json encoded length"""
+    return len(json.dumps(value, default=str))
+
+
+class UserCache:
+    """read-through cache for per-user reads with LRU + TTL eviction and a memory cap.
+
+    entries are grouped by (uid, collection). every group has a generation that is part of the
+    entry keys; invalidating a group gives it a fresh generation, so all of its entries become
+    unreachable at once and age out of the LRU. generations come from a global counter, so a
+    forgotten (evicted) generation can never make old entries reachable again, and a read that
+    raced with a write stores its result under the old generation where nobody will find it
+    """
+
+    def __init__(
+        self,
+        max_bytes: int = CACHE_MAX_BYTES,
+        ttl: int = CACHE_TTL,
+        max_groups: int = CACHE_MAX_GROUPS,
+    ):
+        """
+        Args:
+            max_bytes (int, optional): memory cap. Defaults to CACHE_MAX_BYTES.
+            ttl (int, optional): seconds an entry lives. Defaults to CACHE_TTL.
+            max_groups (int, optional): generations remembered. Defaults to CACHE_MAX_GROUPS.
+        """
+        # values are (value, size) so the cache can weigh them without re-encoding
+        self._entries = TTLCache(maxsize=max_bytes, ttl=ttl, getsizeof=lambda entry: entry[1])
+        self._generations = LRUCache(maxsize=max_groups)
+        self._next_generation = itertools.count(1)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def _generation(self, uid: str, collection: str):
+        group = (uid, collection)
+        generation = self._generations.get(group)
+        if generation is None:
+            generation = self._generations[group] = next(self._next_generation)
+        return generation
+
+    def get_or_load(self, uid: str, collection: str, key, loader):
+        """get a cached value, or load and cache it
+
+        Args:
+            uid (str): user the value belongs to
+            collection (str): collection the value was read from
+            key (hashable): identifies the read inside the collection
+            loader (function): called without arguments on a miss
+
+        Returns:
+            Any: the (shared, treat as read-only) value
+        """
+        with self._lock:
+            full_key = (uid, collection, self._generation(uid, collection), key)
+            entry = self._entries.get(full_key)
+            if entry is not None:
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+        value = loader()
+        size = _estimate_size(value)
+        with self._lock:
+            if size <= self._entries.maxsize:
+                self._entries[full_key] = (value, size)
+        return value
+
+    def invalidate(self, uid: str, *collections: str):
+        """drop every cached read of the user's collections
+
+        Args:
+            uid (str): user
+            collections (str): collections that were written
+        """
+        with self._lock:
+            for collection in collections:
+                self._generations[(uid, collection)] = next(self._next_generation)
+                self.invalidations += 1
+
+    def stats(self):
+        """
+        Returns:
+            dict: hits, misses, invalidations, number of entries and their approximate size in bytes
+        """
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "invalidations": self.invalidations,
+                "entries": len(self._entries),
+                "bytes": self._entries.currsize,
+            }
+
+    def clear(self):
+        """drop everything and reset the counters"""
+        with self._lock:
+            self._entries.clear()
+            self._generations.clear()
+            self.hits = 0
+            self.misses = 0
+            self.invalidations = 0
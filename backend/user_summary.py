@@ -0,0 +1,120 @@
+"""machinery shared by the per-user documents that summarize a collection (pain_summary,
+muscle_load), and the user scoped reads they are built from.
+
+a summary is changed by an update function inside the transaction of the write it follows. all of
+its reads happen before the summary is written, so the write helper can queue its own writes on the
+transaction afterwards. writes committed without a transaction (batches, bulk imports) are caught up
+afterwards. if that fails, the summary is deleted rather than left wrong, and the next write builds
+it again
+"""
+
+from google.cloud import firestore
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def completed_query(uid: str, db):
+    """every completed workout of the user, of all templates, as one collection group query
+
+    Args:
+        uid (str): uid
+        db (google.cloud.firestore.Client): firestore client
+
+    Returns:
+        query:
+    """
+    # every completed workout lives at users/{uid}/workouts/{tid}/completed/{cid}, and document
+    # paths sort segment by segment, so they all fall between these two document paths
+    user_ref = db.collection("users").document(uid)
+    upper_ref = user_ref.collection("\uf8ff").document("\uf8ff")
+    return (
+        db.collection_group("completed")
+        .where(filter=firestore.FieldFilter("__name__", ">=", user_ref))
+        .where(filter=firestore.FieldFilter("__name__", "<", upper_ref))
+    )
+
+
+class SummaryDocument:
+    """a per-user summary document and the ways to keep it up to date
+
+    Args:
+        name (str): what it is called in the logs, e.g. "pain summary"
+        ref (function): (uid, db) -> its document reference
+        update (function): (transaction, uid, db, removed, added) changes it inside a transaction
+        build (function): (transaction, uid, db) -> a new summary, from the stored documents
+        describe (function): summary -> extra fields of the "rebuilt" log line
+    """
+
+    def __init__(self, name: str, ref, update, build, describe):
+        self.name = name
+        self.ref = ref
+        self._update = update
+        self._build = build
+        self._describe = describe
+
+    def record(self, uid: str, db, removed=(), added=()):
+        """update in a transaction of its own, for writes that were committed without one
+
+        Args:
+            uid (str): user id
+            db (google.cloud.firestore.Client): firebase db
+            removed (iterable, optional): documents before the change, see update. Defaults to ().
+            added (iterable, optional): documents after the change, see update. Defaults to ().
+        """
+        removed, added = list(removed), list(added)
+
+        @firestore.transactional
+        def run(transaction):
+            self._update(transaction, uid, db, removed, added)
+
+        run(db.transaction())
+
+    def rebuild(self, uid: str, db):
+        """regenerate a user's summary from the stored documents
+
+        Args:
+            uid (str): user id
+            db (google.cloud.firestore.Client): firebase db
+
+        Returns:
+            dict: the new summary
+        """
+
+        @firestore.transactional
+        def run(transaction):
+            summary = self._build(transaction, uid, db)
+            transaction.set(self.ref(uid, db), summary)
+            return summary
+
+        summary = run(db.transaction())
+        logger.info(f"{self.name} rebuilt", extra={"uid": uid, **self._describe(summary)})
+        return summary
+
+    def catch_up(self, uid: str, db, created=(), rebuild: bool = False):
+        """bring the summary up to date after documents were written without it: created
+        documents are added, and edits or deletes, whose old version is gone, rebuild it
+
+        Args:
+            uid (str): user id
+            db (google.cloud.firestore.Client): firebase db
+            created (iterable, optional): documents created, see update. Defaults to ().
+            rebuild (bool, optional): documents were also edited or deleted. Defaults to False.
+        """
+        try:
+            if rebuild:
+                self.rebuild(uid, db)
+            elif created:
+                self.record(uid, db, added=created)
+        except Exception:
+            logger.exception(f"{self.name} update failed", extra={"uid": uid})
+            self.discard(uid, db)
+
+    def discard(self, uid: str, db):
+        """delete a summary that could not be kept up to date
+
+        Returns:
+            the write result
+        """
+        logger.warning(f"{self.name} discarded", extra={"uid": uid})
+        return self.ref(uid, db).delete()